@@ -0,0 +1,444 @@
+"""
+Vision AI 图片描述
+
+generate_ai_description 接口只创建任务并立即返回任务标识，
+Celery 任务 ai_analyze_image_task 调用 Vision API，客户端轮询任务状态。
+
+- 每个 worker 进程共用一个 requests.Session：连接池 + keep-alive，重复请求不再重新握手
+- 同一 API Key 的并发请求数受 VISION_API_MAX_CONCURRENCY 限制（计数保存在共享缓存中，
+  跨 worker 生效），超出时任务稍后重试，不占用连接等待
+- 任务状态保存在共享缓存中 VISION_JOB_TTL 秒
+- 分析结果按图片内容哈希保存在 VisionResult 中，内容相同的图片不再重复发送
+- 批量分析（见 ai_batch）另外按令牌桶限制每个 API Key 的请求速率
+
+发送的图片不是原图，而是由原图降采样解码得到的 JPEG（长边不超过 VISION_IMAGE_MAX_EDGE，
+体积超过 VISION_IMAGE_MAX_BYTES 时降低质量、再缩小尺寸）。请求体中的 base64 分块编码、
+边编码边发送，内存中只保留压缩后的 JPEG。每次调用的请求/响应字节数和耗时累计在默认缓存中，
+由 vision_stats 接口查看。
+"""
+import base64
+import hashlib
+import json
+import logging
+import math
+import re
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from io import BytesIO
+
+import requests
+from django.conf import settings
+from django.core.cache import cache
+from PIL import Image as PILImage
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_API_URL = 'https://api.siliconflow.cn/v1/chat/completions'
+DEFAULT_MODEL = 'deepseek-ai/deepseek-vl2'
+
+SYSTEM_PROMPT = (
+    "你是一个专业的图片分析助手。请对用户提供的图片进行分析，生成描述和标签。\n\n"
+    "【输出要求】\n"
+    "请严格按照以下 JSON 格式输出，不要包含其他内容：\n"
+    "{\n"
+    '  "description": "图片的详细描述（50-150字）",\n'
+    '  "tags": ["标签1", "标签2"]\n'
+    "}\n\n"
+    "【描述要求】\n"
+    "1. 描述图片的主要内容、场景、氛围\n"
+    "2. 如果有人物，描述其大致动作或状态\n"
+    "3. 描述主要的颜色、光线等视觉特征\n"
+    "4. 语言流畅、客观、专业\n\n"
+    "【标签要求】\n"
+    "1. 提取1-3个最具特征的标签\n"
+    "2. 标签应简短（2-4个字）\n"
+    "3. 优先选择：场景类型、主体、风格、颜色等\n"
+    "4. 示例标签：风景、人像、美食、建筑、夜景、黑白、动物等"
+)
+
+JOB_PREFIX = 'vision-job'
+SLOT_PREFIX = 'vision-slots'
+BUCKET_PREFIX = 'vision-bucket'
+METRICS_PREFIX = 'vision-metrics'
+METRIC_FIELDS = ('calls', 'errors', 'request_bytes', 'response_bytes', 'elapsed_ms')
+# 请求体中图片数据的占位符
+IMAGE_PLACEHOLDER = '__IMAGE_BASE64__'
+# 降低 JPEG 质量的下限，低于此值改为缩小尺寸
+MIN_JPEG_QUALITY = 50
+
+_session = None
+_session_lock = threading.Lock()
+
+
+class ConcurrencyLimited(Exception):
+    """同一 API Key 的并发请求数已达上限"""
+
+
+def get_session():
+    """进程内共用的 HTTP 会话（连接池，keep-alive）"""
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                pool_size = getattr(settings, 'VISION_API_POOL_SIZE', 8)
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                _session = session
+    return _session
+
+
+def api_key_digest(api_key):
+    """缓存键中使用的 API Key 摘要（不保存明文）"""
+    return hashlib.sha256(api_key.encode('utf-8')).hexdigest()[:16]
+
+
+@contextmanager
+def api_key_slot(api_key):
+    """
+    占用 API Key 的一个并发名额
+
+    Raises:
+        ConcurrencyLimited: 名额已满
+    """
+    limit = getattr(settings, 'VISION_API_MAX_CONCURRENCY', 2)
+    key = f"{SLOT_PREFIX}:{api_key_digest(api_key)}"
+    # 进程异常退出时名额随过期时间释放
+    cache.add(key, 0, timeout=getattr(settings, 'VISION_API_TIMEOUT', 60) * 2)
+    try:
+        current = cache.incr(key)
+    except ValueError:
+        cache.add(key, 1, timeout=getattr(settings, 'VISION_API_TIMEOUT', 60) * 2)
+        current = 1
+    if current > limit:
+        release_slot(key)
+        raise ConcurrencyLimited()
+    try:
+        yield
+    finally:
+        release_slot(key)
+
+
+def release_slot(key):
+    try:
+        cache.decr(key)
+    except ValueError:
+        pass
+
+
+def take_token(api_key):
+    """
+    从 API Key 的令牌桶中取一个令牌
+
+    桶容量 VISION_API_BURST，每秒补充 VISION_API_RATE 个。桶状态保存在共享缓存中，
+    读改写期间用 cache.add 加短时锁，多个 worker 不会同时扣减
+
+    Returns:
+        float: 0 表示已取得令牌，否则为需要等待的秒数
+    """
+    rate = getattr(settings, 'VISION_API_RATE', 0.5)
+    burst = getattr(settings, 'VISION_API_BURST', 5)
+    key = f'{BUCKET_PREFIX}:{api_key_digest(api_key)}'
+    lock = f'{key}:lock'
+    if not cache.add(lock, True, timeout=5):
+        return 0.05
+    try:
+        now = time.time()
+        tokens, updated = cache.get(key, (burst, now))
+        tokens = min(burst, tokens + (now - updated) * rate)
+        wait = 0 if tokens >= 1 else (1 - tokens) / rate
+        if not wait:
+            tokens -= 1
+        # 桶补满之后状态与不存在相同，可以过期
+        cache.set(key, (tokens, now), timeout=math.ceil(burst / rate) + 1)
+        return wait
+    finally:
+        cache.delete(lock)
+
+
+def vision_model():
+    return getattr(settings, 'VISION_API_MODEL', DEFAULT_MODEL)
+
+
+def find_vision_results(content_hashes):
+    """
+    查询已缓存的分析结果（当前模型）
+
+    Returns:
+        dict: {内容哈希: VisionResult}
+    """
+    from .models import VisionResult
+
+    content_hashes = [value for value in set(content_hashes) if value]
+    if not content_hashes:
+        return {}
+    return {
+        result.content_hash: result
+        for result in VisionResult.objects.filter(content_hash__in=content_hashes, model=vision_model())
+    }
+
+
+def save_vision_result(content_hash, description, tags):
+    """缓存分析结果（没有内容哈希的旧数据不缓存）"""
+    from .models import VisionResult
+
+    if content_hash:
+        VisionResult.objects.bulk_create(
+            [VisionResult(content_hash=content_hash, model=vision_model(), description=description, tags=tags)],
+            ignore_conflicts=True,
+        )
+
+
+def analyze_image(image, api_key):
+    """
+    生成图片 JPEG 并调用 Vision API（不访问数据库，批量分析时在线程池中调用）
+
+    Returns:
+        tuple: (描述, 标签列表, 本次调用的指标)
+
+    Raises:
+        ConcurrencyLimited: API Key 的并发名额已满
+    """
+    with api_key_slot(api_key):
+        return request_description(api_key, vision_image_jpeg(image))
+
+
+def is_retryable(exc):
+    """网络错误、超时、429 和 5xx 可以重试，其他 HTTP 错误（如 Key 无效）不重试"""
+    status_code = getattr(exc.response, 'status_code', None)
+    return status_code is None or status_code == 429 or status_code >= 500
+
+
+def build_payload(image_url):
+    """构建 chat completions 请求体"""
+    return {
+        "model": vision_model(),
+        "messages": [
+            {
+                "role": "system",
+                "content": [{"type": "text", "text": SYSTEM_PROMPT}]
+            },
+            {
+                "role": "user",
+                "content": [
+                    {"type": "text", "text": "请分析这张图片，生成描述和标签。"},
+                    {"type": "image_url", "image_url": {"url": image_url, "detail": "auto"}}
+                ]
+            }
+        ],
+        "stream": False,
+        "max_tokens": 500,
+        "temperature": 0.7,
+        "top_p": 0.7,
+        "response_format": {"type": "text"},
+    }
+
+
+def vision_image_jpeg(image):
+    """
+    生成发送给 Vision API 的 JPEG
+
+    原图按目标尺寸降采样解码（JPEG 在 DCT 阶段缩放），长边不超过 VISION_IMAGE_MAX_EDGE；
+    编码结果超过 VISION_IMAGE_MAX_BYTES 时每次降低 10 的质量，降到 MIN_JPEG_QUALITY 后缩小尺寸
+
+    Returns:
+        bytes: JPEG 数据
+    """
+    from .renditions import decode_image
+
+    max_edge = getattr(settings, 'VISION_IMAGE_MAX_EDGE', 1024)
+    max_bytes = getattr(settings, 'VISION_IMAGE_MAX_BYTES', 512 * 1024)
+    quality = getattr(settings, 'VISION_IMAGE_QUALITY', 85)
+
+    with image.file.open('rb') as f:
+        img = decode_image(PILImage.open(f), (max_edge, max_edge), renditions=False)
+        img.thumbnail((max_edge, max_edge), PILImage.Resampling.LANCZOS)
+        img.load()
+
+    while True:
+        buffer = BytesIO()
+        img.save(buffer, format='JPEG', quality=quality, optimize=True)
+        if buffer.tell() <= max_bytes or max(img.size) <= 64:
+            return buffer.getvalue()
+        if quality > MIN_JPEG_QUALITY:
+            quality = max(quality - 10, MIN_JPEG_QUALITY)
+        else:
+            edge = int(max(img.size) * 0.75)
+            img.thumbnail((edge, edge), PILImage.Resampling.LANCZOS)
+
+
+class StreamedPayload:
+    """
+    分块输出的 JSON 请求体
+
+    图片的 base64 在发送时按块编码，不生成完整的 base64 字符串和 JSON 字符串；
+    长度预先计算，以 Content-Length 发送（不使用 chunked 编码）
+    """
+
+    CHUNK_SIZE = 48 * 1024  # 3 的倍数，各块编码结果可直接拼接
+
+    def __init__(self, payload, data):
+        head, tail = json.dumps(payload).split(IMAGE_PLACEHOLDER)
+        self.head = head.encode('utf-8')
+        self.tail = tail.encode('utf-8')
+        self.data = memoryview(data)
+
+    def __len__(self):
+        return len(self.head) + 4 * math.ceil(len(self.data) / 3) + len(self.tail)
+
+    def __iter__(self):
+        yield self.head
+        for start in range(0, len(self.data), self.CHUNK_SIZE):
+            yield base64.b64encode(self.data[start:start + self.CHUNK_SIZE])
+        yield self.tail
+
+
+def parse_ai_content(content):
+    """
+    解析模型输出
+
+    Returns:
+        tuple: (描述, 标签列表)
+
+    Raises:
+        json.JSONDecodeError: 输出中的 JSON 无法解析
+    """
+    json_match = re.search(r'\{[\s\S]*\}', content)
+    if json_match:
+        ai_result = json.loads(json_match.group())
+    else:
+        ai_result = {"description": content, "tags": []}
+    return ai_result.get('description', ''), ai_result.get('tags', [])
+
+
+def request_description(api_key, jpeg):
+    """
+    调用 Vision API
+
+    Args:
+        jpeg: vision_image_jpeg() 生成的图片数据
+
+    Returns:
+        tuple: (描述, 标签列表, 本次调用的指标)
+    """
+    body = StreamedPayload(build_payload(f'data:image/jpeg;base64,{IMAGE_PLACEHOLDER}'), jpeg)
+    call = {'image_bytes': len(jpeg), 'request_bytes': len(body), 'response_bytes': 0, 'elapsed_ms': 0}
+    start = time.perf_counter()
+    ok = False
+    try:
+        response = get_session().post(
+            getattr(settings, 'VISION_API_URL', DEFAULT_API_URL),
+            data=body,
+            headers={"Authorization": f"Bearer {api_key}", "Content-Type": "application/json"},
+            timeout=getattr(settings, 'VISION_API_TIMEOUT', 60),
+        )
+        call['response_bytes'] = len(response.content)
+        response.raise_for_status()
+        content = response.json()['choices'][0]['message']['content']
+        description, tags = parse_ai_content(content)
+        ok = True
+    finally:
+        call['elapsed_ms'] = round((time.perf_counter() - start) * 1000, 2)
+        record_call(call, ok)
+    return description, tags, call
+
+
+def _incr(key, delta):
+    try:
+        cache.incr(key, delta)
+    except ValueError:
+        if not cache.add(key, delta, timeout=None):
+            cache.incr(key, delta)
+
+
+def record_call(call, ok):
+    """累计调用次数、失败次数、请求/响应字节数和耗时"""
+    logger.info(
+        f"Vision API 调用: 图片 {call['image_bytes']} 字节, 请求 {call['request_bytes']} 字节, "
+        f"响应 {call['response_bytes']} 字节, 耗时 {call['elapsed_ms']} ms, {'成功' if ok else '失败'}"
+    )
+    values = {
+        'calls': 1,
+        'errors': 0 if ok else 1,
+        'request_bytes': call['request_bytes'],
+        'response_bytes': call['response_bytes'],
+        'elapsed_ms': int(call['elapsed_ms']),
+    }
+    for field, value in values.items():
+        if value:
+            _incr(f'{METRICS_PREFIX}:{field}', value)
+
+
+def vision_api_stats():
+    """
+    Vision API 调用统计
+
+    Returns:
+        dict: calls、errors 及平均请求/响应字节数和平均耗时
+    """
+    values = cache.get_many([f'{METRICS_PREFIX}:{field}' for field in METRIC_FIELDS])
+    calls, errors, request_bytes, response_bytes, elapsed_ms = (
+        values.get(f'{METRICS_PREFIX}:{field}', 0) for field in METRIC_FIELDS
+    )
+    return {
+        'calls': calls,
+        'errors': errors,
+        'request_bytes': request_bytes,
+        'response_bytes': response_bytes,
+        'avg_request_bytes': round(request_bytes / calls) if calls else None,
+        'avg_response_bytes': round(response_bytes / calls) if calls else None,
+        'avg_elapsed_ms': round(elapsed_ms / calls, 2) if calls else None,
+    }
+
+
+def reset_vision_api_stats():
+    cache.delete_many([f'{METRICS_PREFIX}:{field}' for field in METRIC_FIELDS])
+
+
+def apply_ai_result(image, description, tags):
+    """
+    写入描述和 AI 标签（最多 3 个）
+
+    Returns:
+        list: 新增的标签 [{'id', 'name', 'type'}]
+    """
+    from .models import attach_tags
+
+    if description:
+        image.description = description
+        image.save(update_fields=['description'])
+    tag_names = [name for name in tags[:3] if isinstance(name, str) and name and len(name) <= 20]
+    return [
+        {'id': tag.id, 'name': tag.name, 'type': 'ai'}
+        for _, tag in attach_tags({image: tag_names}, tag_type='ai')
+    ]
+
+
+def job_key(job_id):
+    return f'{JOB_PREFIX}:{job_id}'
+
+
+def create_job(image):
+    """创建任务记录，返回任务 ID"""
+    job_id = uuid.uuid4().hex
+    save_job(job_id, {'status': 'pending', 'image_id': image.id, 'owner_id': image.owner_id})
+    return job_id
+
+
+def get_job(job_id):
+    return cache.get(job_key(job_id))
+
+
+def update_job(job_id, **fields):
+    job = get_job(job_id)
+    if job is not None:
+        job.update(fields)
+        save_job(job_id, job)
+
+
+def save_job(job_id, job):
+    cache.set(job_key(job_id), job, getattr(settings, 'VISION_JOB_TTL', 60 * 60))
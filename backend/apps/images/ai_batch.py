@@ -0,0 +1,220 @@
+"""
+批量 AI 分析
+
+用户选择多张图片后创建 AIBatch，每张图片一条 AIBatchItem，进度保存在数据库中。
+run_ai_batch 任务每次处理一段（VISION_BATCH_CHUNK 张）待处理的图片，然后重新投递自己处理下一段：
+
+- 内容哈希已有分析结果（VisionResult）的图片直接使用缓存结果，不调用 API；
+  同一段中内容相同的图片只发送一张，其余的在下一段命中缓存
+- 每次请求前从 API Key 的令牌桶取令牌（见 ai.take_token），等待时间较长时结束本段，
+  按等待时间延迟投递下一段，不占用 worker
+- 请求在线程池中并发执行（不超过 VISION_API_MAX_CONCURRENCY），结果在主线程写回数据库
+- 可重试的错误保留为待处理，请求次数达到 VISION_BATCH_MAX_ATTEMPTS 后标记失败
+
+worker 重启后：每段开始前加的锁随过期时间释放，定时任务 resume_ai_batches
+重新投递超过 VISION_BATCH_STALE_SECONDS 没有进展的批次，从剩余的待处理图片继续。
+"""
+import logging
+import math
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import timedelta
+
+import requests
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, Q
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+LOCK_PREFIX = 'ai-batch-lock'
+# 令牌等待不超过该秒数时在任务中等待，否则延迟投递下一段
+MAX_INLINE_WAIT = 2
+# 并发名额已满或可重试错误后下一段的延迟（秒）
+RETRY_COUNTDOWN = 5
+ITEM_STATUSES = ('pending', 'success', 'cached', 'failed')
+
+
+def create_batch(owner, image_ids):
+    """
+    创建批量分析并在事务提交后投递
+
+    Args:
+        image_ids: 图片 ID 列表，只保留 owner 自己的图片
+
+    Returns:
+        AIBatch，没有可分析的图片时返回 None
+    """
+    from .models import AIBatch, AIBatchItem, Image
+
+    ids = list(
+        Image.objects.filter(owner=owner, id__in=image_ids).order_by('id').values_list('id', flat=True)
+    )
+    if not ids:
+        return None
+    with transaction.atomic():
+        batch = AIBatch.objects.create(owner=owner)
+        AIBatchItem.objects.bulk_create([AIBatchItem(batch=batch, image_id=image_id) for image_id in ids])
+        transaction.on_commit(lambda: dispatch_batch(batch.id))
+    return batch
+
+
+def dispatch_batch(batch_id, countdown=0):
+    from .tasks import run_ai_batch
+
+    run_ai_batch.apply_async(args=[batch_id], countdown=countdown)
+
+
+def with_progress(queryset):
+    """为 AIBatch 查询集添加各状态的图片数量（total、pending、success、cached、failed）"""
+    return queryset.annotate(
+        total=Count('items'),
+        **{status: Count('items', filter=Q(items__status=status)) for status in ITEM_STATUSES},
+    )
+
+
+def run_batch(batch_id):
+    """
+    处理批次的下一段，还有待处理的图片时重新投递
+
+    Returns:
+        dict: 本段处理结果
+    """
+    from .models import AIBatch
+    from apps.users.models import UserProfile
+
+    batch = AIBatch.objects.filter(id=batch_id, status='running').first()
+    if batch is None:
+        return {'status': 'skipped', 'batch_id': batch_id}
+
+    lock = f'{LOCK_PREFIX}:{batch_id}'
+    if not cache.add(lock, True, timeout=getattr(settings, 'VISION_BATCH_STALE_SECONDS', 10 * 60)):
+        # 同一批次已有任务在处理
+        return {'status': 'locked', 'batch_id': batch_id}
+    try:
+        profile = UserProfile.objects.filter(user_id=batch.owner_id).first()
+        if profile is None or not profile.has_vision_api_key:
+            batch.items.filter(status='pending').update(status='failed', detail='未配置 Vision API Key')
+            counts, countdown = {}, None
+        else:
+            counts, countdown = process_chunk(batch, profile.vision_api_key)
+    finally:
+        cache.delete(lock)
+
+    if batch.items.filter(status='pending').exists():
+        AIBatch.objects.filter(pk=batch.pk).update(updated_at=timezone.now())
+        dispatch_batch(batch.id, countdown or 0)
+    else:
+        AIBatch.objects.filter(pk=batch.pk, status='running').update(status='completed', updated_at=timezone.now())
+    return {'status': 'success', 'batch_id': batch_id, **counts}
+
+
+def process_chunk(batch, api_key):
+    """
+    处理一段待处理的图片
+
+    Returns:
+        tuple: (各结果的数量, 下一段的延迟秒数)
+    """
+    from .ai import (
+        ConcurrencyLimited, analyze_image, find_vision_results, is_retryable, save_vision_result, take_token,
+    )
+
+    chunk_size = getattr(settings, 'VISION_BATCH_CHUNK', 20)
+    items = list(batch.items.filter(status='pending').select_related('image').order_by('id')[:chunk_size])
+    counts = {'cached': 0, 'success': 0, 'failed': 0, 'deferred': 0}
+
+    # 已有分析结果的内容
+    cached = find_vision_results(item.image.content_hash for item in items)
+    to_send, sending = [], set()
+    for item in items:
+        content_hash = item.image.content_hash
+        if content_hash in cached:
+            result = cached[content_hash]
+            finish_item(item, 'cached', result.description, result.tags)
+            counts['cached'] += 1
+        elif not content_hash or content_hash not in sending:
+            sending.add(content_hash)
+            to_send.append(item)
+
+    countdown = None
+    workers = max(1, getattr(settings, 'VISION_API_MAX_CONCURRENCY', 2))
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {}
+        for item in to_send:
+            wait = take_token(api_key)
+            while 0 < wait <= MAX_INLINE_WAIT:
+                time.sleep(wait)
+                wait = take_token(api_key)
+            if wait:
+                countdown = math.ceil(wait)
+                break
+            item.attempts += 1
+            futures[pool.submit(analyze_image, item.image, api_key)] = item
+
+        for future in as_completed(futures):
+            item = futures[future]
+            try:
+                description, tags, _ = future.result()
+            except ConcurrencyLimited:
+                # 名额被单张分析占用，不计入请求次数
+                item.attempts -= 1
+                item.save(update_fields=['attempts'])
+                countdown = max(countdown or 0, RETRY_COUNTDOWN)
+                counts['deferred'] += 1
+            except requests.exceptions.RequestException as exc:
+                max_attempts = getattr(settings, 'VISION_BATCH_MAX_ATTEMPTS', 3)
+                if is_retryable(exc) and item.attempts < max_attempts:
+                    item.save(update_fields=['attempts'])
+                    countdown = max(countdown or 0, RETRY_COUNTDOWN * 2 ** (item.attempts - 1))
+                    counts['deferred'] += 1
+                else:
+                    fail_item(item, f'AI 服务请求失败: {exc}')
+                    counts['failed'] += 1
+            except Exception as exc:
+                # 图片读取失败或响应无法解析
+                fail_item(item, f'AI 分析失败: {exc}')
+                counts['failed'] += 1
+            else:
+                save_vision_result(item.image.content_hash, description, tags)
+                finish_item(item, 'success', description, tags)
+                counts['success'] += 1
+    return counts, countdown
+
+
+def finish_item(item, status, description, tags):
+    """写入分析结果并更新状态"""
+    from .ai import apply_ai_result
+
+    with transaction.atomic():
+        apply_ai_result(item.image, description, tags)
+        item.status = status
+        item.save(update_fields=['status', 'attempts'])
+
+
+def fail_item(item, detail):
+    logger.error(f"批量 AI 分析失败 (ID={item.image_id}): {detail}")
+    item.status = 'failed'
+    item.detail = detail[:255]
+    item.save(update_fields=['status', 'detail', 'attempts'])
+
+
+def resume_stale_batches():
+    """
+    重新投递长时间没有进展的批次（worker 重启导致后续投递丢失）
+
+    Returns:
+        int: 重新投递的批次数
+    """
+    from .models import AIBatch
+
+    stale_seconds = getattr(settings, 'VISION_BATCH_STALE_SECONDS', 10 * 60)
+    deadline = timezone.now() - timedelta(seconds=stale_seconds)
+    batch_ids = list(
+        AIBatch.objects.filter(status='running', updated_at__lt=deadline).values_list('id', flat=True)
+    )
+    for batch_id in batch_ids:
+        dispatch_batch(batch_id)
+    return len(batch_ids)
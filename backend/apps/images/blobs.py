@@ -0,0 +1,163 @@
+"""
+按内容哈希去重的原图存储
+
+相同字节的图片只保存一份：
+- 原图路径：blobs/{hash[:2]}/{hash[2:4]}/{hash}.{ext}；没有记录时总是重新写入，
+  同名旧文件（可能属于刚删除、正等待后台删除的 blob）存在时由存储另取文件名
+- 缩略图路径：thumbnails/blobs/{hash[:2]}/{hash[2:4]}/{hash}_thumb.jpg
+- ImageBlob.ref_count 记录引用该文件的图片数量，降为 0 时删除文件
+- 缩略图、多尺寸图片和解析后的 EXIF 保存在 ImageBlob 上，同一内容只处理一次
+
+文件删除不在请求中执行：删除记录的事务提交后，按 FILE_DELETE_BATCH_SIZE 分批投递
+delete_files_task 在后台删除。任务可重复执行，删除前确认路径没有重新被引用。
+"""
+import logging
+import os
+import threading
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.db.models import F
+
+logger = logging.getLogger(__name__)
+
+# defer_file_deletion 代码块中收集的待删除路径
+_deferred = threading.local()
+
+
+def blob_file_path(content_hash, ext):
+    """原图的内容寻址路径"""
+    return os.path.join('blobs', content_hash[:2], content_hash[2:4], f'{content_hash}.{ext}')
+
+
+def blob_thumbnail_path(content_hash):
+    """缩略图的内容寻址路径"""
+    return os.path.join('thumbnails', 'blobs', content_hash[:2], content_hash[2:4], f'{content_hash}_thumb.jpg')
+
+
+def acquire_blob(content, content_hash, ext, size):
+    """
+    获取内容对应的 ImageBlob 并增加引用计数，不存在时保存文件并创建
+
+    Args:
+        content: Django File 对象（仅在首次出现该内容时写入存储）
+        content_hash: 内容的 SHA-256
+        ext: 文件扩展名
+        size: 文件大小
+
+    Returns:
+        ImageBlob: 已增加引用计数的 blob
+    """
+    from .models import ImageBlob
+
+    with transaction.atomic():
+        if ImageBlob.objects.filter(content_hash=content_hash).update(ref_count=F('ref_count') + 1):
+            return ImageBlob.objects.get(content_hash=content_hash)
+
+        # 不复用磁盘上已有的同名文件：它可能已投递删除，删除任务只能确认已提交的引用
+        saved_path = default_storage.save(blob_file_path(content_hash, ext), content)
+
+        blob, created = ImageBlob.objects.get_or_create(
+            content_hash=content_hash,
+            defaults={'file_path': saved_path, 'size': size, 'ref_count': 1}
+        )
+        if not created:
+            # 并发上传了相同内容：使用已有记录，删除多写的文件
+            ImageBlob.objects.filter(pk=blob.pk).update(ref_count=F('ref_count') + 1)
+            blob.refresh_from_db()
+            if saved_path != blob.file_path:
+                default_storage.delete(saved_path)
+        return blob
+
+
+def release_blob(blob_id):
+    """
+    减少引用计数，降为 0 时删除记录，并在事务提交后删除文件
+    """
+    from .models import ImageBlob
+    from .renditions import rendition_paths
+
+    with transaction.atomic():
+        ImageBlob.objects.filter(pk=blob_id, ref_count__gt=0).update(ref_count=F('ref_count') - 1)
+        blob = ImageBlob.objects.filter(pk=blob_id, ref_count=0).first()
+        if blob is None:
+            return
+        paths = [blob.file_path, blob.thumbnail_path] + rendition_paths(blob.renditions)
+        blob.delete()
+    delete_files_on_commit(paths)
+
+
+def delete_files_on_commit(paths):
+    """
+    事务提交后在后台删除文件
+
+    在 defer_file_deletion() 代码块中调用时只收集路径，代码块结束时合并投递
+    """
+    paths = [path for path in paths if path]
+    if not paths:
+        return
+    stack = getattr(_deferred, 'stack', None)
+    if stack:
+        stack[-1].extend(paths)
+        return
+    transaction.on_commit(lambda: enqueue_file_deletion(paths))
+
+
+@contextmanager
+def defer_file_deletion():
+    """
+    合并代码块中（如批量删除图片时逐条触发的信号）所有待删除的文件，
+    代码块正常结束后只注册一次提交回调；发生异常时不删除
+    """
+    paths = []
+    stack = _deferred.__dict__.setdefault('stack', [])
+    stack.append(paths)
+    try:
+        yield
+    finally:
+        stack.pop()
+    delete_files_on_commit(paths)
+
+
+def enqueue_file_deletion(paths):
+    """分批投递删除任务，消息队列不可用时在当前进程删除"""
+    from .tasks import delete_files_task
+
+    paths = list(dict.fromkeys(paths))
+    batch_size = getattr(settings, 'FILE_DELETE_BATCH_SIZE', 500)
+    for start in range(0, len(paths), batch_size):
+        batch = paths[start:start + batch_size]
+        try:
+            delete_files_task.apply_async(args=[batch])
+        except Exception as e:
+            # 仍未删除的文件由孤立文件回收处理
+            logger.error(f"投递文件删除任务失败，直接删除 {len(batch)} 个文件: {e}")
+            delete_stored_files(batch)
+
+
+def delete_stored_files(paths):
+    """
+    删除存储中的文件（可重复执行）
+
+    已不存在的文件视为已删除；仍被引用的路径跳过（例如删除投递后又上传了相同内容，
+    新记录使用了同一个 blob 路径）
+
+    Returns:
+        tuple: (删除的文件数, 删除失败的路径列表)
+    """
+    from .gc import referenced_paths
+
+    in_use = referenced_paths(paths)
+    deleted, failed = 0, []
+    for path in paths:
+        if path in in_use:
+            continue
+        try:
+            default_storage.delete(path)
+            deleted += 1
+        except OSError as e:
+            logger.error(f"删除文件失败: {path}, 错误: {e}")
+            failed.append(path)
+    return deleted, failed
@@ -10,12 +10,13 @@ from PIL.ExifTags import TAGS, GPSTAGS
 import io
 
 
-def parse_exif(file):
+def parse_exif(file, size=None):
     """
     解析图片的 EXIF 信息
     
     Args:
         file: 文件对象或文件路径
+        size: 已知的图片尺寸 (width, height)，提供时不再用 PIL 打开文件
         
     Returns:
         dict: 包含解析出的 EXIF 信息
@@ -125,13 +126,16 @@ def parse_exif(file):
             exif_data['gps_longitude'] = gps_lon
         
         # 使用 PIL 获取图片尺寸（更可靠）
-        if hasattr(file, 'seek'):
-            file.seek(0)
-        try:
-            img = PILImage.open(file)
-            exif_data['width'], exif_data['height'] = img.size
-        except:
-            pass
+        if size is not None:
+            exif_data['width'], exif_data['height'] = size
+        else:
+            if hasattr(file, 'seek'):
+                file.seek(0)
+            try:
+                img = PILImage.open(file)
+                exif_data['width'], exif_data['height'] = img.size
+            except:
+                pass
         
     except Exception as e:
         print(f"EXIF 解析错误: {e}")
@@ -269,51 +273,82 @@ def generate_auto_tags(exif_data, image):
     return tags
 
 
-def apply_exif_to_image(image_instance):
+def exif_to_json(exif_data):
+    """将 EXIF 数据转换为可 JSON 序列化的字典（用于缓存到 ImageBlob）"""
+    data = dict(exif_data)
+    if data.get('datetime'):
+        data['datetime'] = data['datetime'].isoformat()
+    return data
+
+
+def exif_from_json(data):
+    """从 JSON 字典还原 EXIF 数据"""
+    exif_data = dict(data)
+    if exif_data.get('datetime'):
+        exif_data['datetime'] = datetime.fromisoformat(exif_data['datetime'])
+    return exif_data
+
+
+# set_exif_fields 修改的字段（批量更新时使用）
+EXIF_FIELDS = [
+    'exif_camera_make', 'exif_camera_model', 'exif_datetime', 'exif_exposure_time',
+    'exif_f_number', 'exif_iso', 'exif_focal_length', 'exif_gps_latitude',
+    'exif_gps_longitude', 'width', 'height', 'exif_parsed',
+]
+
+
+def set_exif_fields(image_instance, exif_data):
+    """
+    将 EXIF 数据写入 Image 实例的字段（不保存）
+    
+    Args:
+        image_instance: Image 模型实例
+        exif_data: parse_exif 返回的字典
+    """
+    image_instance.exif_camera_make = exif_data.get('camera_make', '')[:100]
+    image_instance.exif_camera_model = exif_data.get('camera_model', '')[:100]
+    image_instance.exif_datetime = exif_data.get('datetime')
+    image_instance.exif_exposure_time = exif_data.get('exposure_time', '')[:50]
+    image_instance.exif_f_number = exif_data.get('f_number', '')[:20]
+    image_instance.exif_iso = exif_data.get('iso')
+    image_instance.exif_focal_length = exif_data.get('focal_length', '')[:50]
+    image_instance.exif_gps_latitude = exif_data.get('gps_latitude')
+    image_instance.exif_gps_longitude = exif_data.get('gps_longitude')
+    
+    # 如果没有宽高信息，从 EXIF 获取
+    if not image_instance.width and exif_data.get('width'):
+        image_instance.width = exif_data['width']
+    if not image_instance.height and exif_data.get('height'):
+        image_instance.height = exif_data['height']
+    
+    image_instance.exif_parsed = True
+
+
+def apply_exif_to_image(image_instance, exif_data=None):
     """
     解析图片 EXIF 并应用到 Image 模型实例
     
     Args:
         image_instance: Image 模型实例
+        exif_data: 已解析的 EXIF 数据，提供时不再读取文件
     """
-    from apps.tags.models import Tag
-    from apps.images.models import ImageTag
+    from apps.images.models import attach_tags
     
     if not image_instance.file:
         return
     
     try:
         # 解析 EXIF
-        exif_data = parse_exif(image_instance.file)
+        if exif_data is None:
+            exif_data = parse_exif(image_instance.file)
         
         # 更新图片的 EXIF 字段
-        image_instance.exif_camera_make = exif_data.get('camera_make', '')[:100]
-        image_instance.exif_camera_model = exif_data.get('camera_model', '')[:100]
-        image_instance.exif_datetime = exif_data.get('datetime')
-        image_instance.exif_exposure_time = exif_data.get('exposure_time', '')[:50]
-        image_instance.exif_f_number = exif_data.get('f_number', '')[:20]
-        image_instance.exif_iso = exif_data.get('iso')
-        image_instance.exif_focal_length = exif_data.get('focal_length', '')[:50]
-        image_instance.exif_gps_latitude = exif_data.get('gps_latitude')
-        image_instance.exif_gps_longitude = exif_data.get('gps_longitude')
-        
-        # 如果没有宽高信息，从 EXIF 获取
-        if not image_instance.width and exif_data.get('width'):
-            image_instance.width = exif_data['width']
-        if not image_instance.height and exif_data.get('height'):
-            image_instance.height = exif_data['height']
-        
-        image_instance.exif_parsed = True
+        set_exif_fields(image_instance, exif_data)
         image_instance.save()
         
-        # 生成自动标签
+        # 生成自动标签（批量添加，已有的关联跳过）
         auto_tag_names = generate_auto_tags(exif_data, image_instance)
-        
-        for tag_name in auto_tag_names:
-            tag = Tag.get_or_create_tag(tag_name, tag_type='auto')
-            # 检查是否已存在关联
-            if not ImageTag.objects.filter(image=image_instance, tag=tag).exists():
-                ImageTag.objects.create(image=image_instance, tag=tag)
+        attach_tags({image_instance: auto_tag_names}, tag_type='auto')
         
         return exif_data
         
@@ -0,0 +1,340 @@
+"""
+孤立文件回收（增量）
+
+存储布局：
+- 原图：uploads/user_<id>/、blobs/aa/bb/
+- 缩略图：thumbnails/user_<id>/、thumbnails/blobs/aa/bb/
+- 多尺寸图片：renditions/uploads/user_<id>/、renditions/blobs/aa/bb/
+
+分片：从布局目录（blobs、renditions、thumbnails、uploads）向下，第一层不是布局目录的子目录为一个分片
+（如 uploads/user_5、thumbnails/blobs/aa、renditions/uploads/user_5）；布局目录中直接存放的文件单独作为一个分片。
+分片按路径顺序处理，每次运行从检查点之后的分片继续，处理 ORPHAN_GC_TIME_BUDGET 秒后保存检查点退出，
+全部分片处理完后下一次从头开始。
+
+分片内不构建路径集合，而是归并两个按路径（二进制顺序）排序的流：
+- 存储中的文件：逐个目录列出并排序
+- 数据库中引用的路径：Image.file / thumbnail、ImageBlob.file_path / thumbnail_path 按路径前缀分批读取
+  （路径列有索引），多尺寸图片路径由原图路径所在行的 renditions 展开；各来源用堆归并
+存储中有而数据库流中没有的文件为候选。候选必须早于 ORPHAN_GC_MIN_AGE 秒修改，删除前再按路径单独查询确认，
+扫描期间新上传、排序异常或 renditions 展开顺序不一致都只会产生多余的候选，不会误删。
+
+dry_run 只统计不删除；删除按 ORPHAN_GC_DELETE_RATE 个/秒限速。
+"""
+import heapq
+import logging
+import re
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from django.db import connection
+from django.db.models import F, Q
+from django.db.models.functions import Collate
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+LAYOUT_DIRS = ('blobs', 'renditions', 'thumbnails', 'uploads')
+CHECKPOINT_KEY = 'orphan-gc:checkpoint'
+REPORT_KEY = 'orphan-gc:last-report'
+# renditions/{原图路径去掉扩展名}_{宽度}w.{格式}
+RENDITION_PATH_RE = re.compile(r'^renditions/(.+)_\d+w\.[a-z0-9]+$')
+# 按字节顺序比较的排序规则，与 Python 字符串比较一致
+BINARY_COLLATIONS = {'sqlite': 'BINARY', 'postgresql': 'C', 'mysql': 'utf8mb4_bin'}
+
+
+class Shard:
+    """
+    一个分片
+
+    Attributes:
+        path: 分片目录
+        loose: 为 True 时只包含该目录中直接存放的文件，不包含子目录
+    """
+
+    def __init__(self, path, loose=False):
+        self.path = path
+        self.loose = loose
+
+    @property
+    def key(self):
+        """分片顺序（按路径各级名称比较）"""
+        return tuple(self.path.split('/'))
+
+    def contains(self, path):
+        prefix = self.path + '/'
+        return path.startswith(prefix) and not (self.loose and '/' in path[len(prefix):])
+
+    def __repr__(self):
+        return f"Shard({self.path!r}{', loose' if self.loose else ''})"
+
+
+def iter_shards(storage=None, path=None):
+    """按顺序列出分片"""
+    storage = storage or default_storage
+    if path is None:
+        for root in LAYOUT_DIRS:
+            yield from iter_shards(storage, root)
+        return
+    if not storage.exists(path):
+        return
+    dirs, files = storage.listdir(path)
+    if files:
+        yield Shard(path, loose=True)
+    for name in sorted(dirs):
+        child = f'{path}/{name}'
+        if name in LAYOUT_DIRS:
+            yield from iter_shards(storage, child)
+        else:
+            yield Shard(child)
+
+
+def iter_stored_files(shard, storage=None):
+    """
+    按路径的二进制顺序列出分片中的文件
+
+    每次只列出一个目录；目录按“名称/”参与排序，与完整路径的字符串顺序一致
+    """
+    storage = storage or default_storage
+
+    def walk(path, recursive):
+        dirs, files = storage.listdir(path)
+        entries = [(name, False) for name in files]
+        if recursive:
+            entries += [(name + '/', True) for name in dirs]
+        for name, is_dir in sorted(entries):
+            if is_dir:
+                yield from walk(path + '/' + name[:-1], True)
+            else:
+                yield f'{path}/{name}'
+
+    yield from walk(shard.path, not shard.loose)
+
+
+def _binary(field):
+    collation = BINARY_COLLATIONS.get(connection.vendor)
+    return Collate(F(field), collation) if collation else F(field)
+
+
+def iter_column(queryset, field, shard, batch_size, values=None):
+    """
+    按路径顺序分批读取某一列中属于分片的路径（键集分页，每批 batch_size 行）
+
+    Args:
+        values: 同时读取的其他列，提供时产出 (路径, 其他列...) 元组
+    """
+    prefix = shard.path + '/'
+    queryset = queryset.filter(**{f'{field}__startswith': prefix})
+    if shard.loose:
+        queryset = queryset.filter(**{f'{field}__regex': rf'^{re.escape(prefix)}[^/]+$'})
+    queryset = queryset.alias(gc_path=_binary(field)).order_by('gc_path')
+    columns = [field, *(values or [])]
+    last = None
+    while True:
+        page = queryset if last is None else queryset.filter(gc_path__gt=last)
+        rows = list(page.values_list(*columns)[:batch_size])
+        for row in rows:
+            yield row if values else row[0]
+        if len(rows) < batch_size:
+            return
+        last = rows[-1][0]
+
+
+def iter_rendition_paths(queryset, field, shard, batch_size):
+    """分片（renditions/ 下）中由原图所在行的 renditions 展开的路径"""
+    from .renditions import rendition_paths
+
+    base = Shard(shard.path[len('renditions/'):], shard.loose)
+    for _, renditions in iter_column(queryset, field, base, batch_size, values=['renditions']):
+        yield from sorted(path for path in rendition_paths(renditions) if shard.contains(path))
+
+
+def iter_referenced_paths(shard, batch_size=None):
+    """数据库中引用的属于分片的路径（按路径排序，可能重复）"""
+    from .models import Image, ImageBlob
+
+    batch_size = batch_size or getattr(settings, 'ORPHAN_GC_BATCH_SIZE', 1000)
+    sources = [
+        iter_column(Image.objects.all(), 'file', shard, batch_size),
+        iter_column(Image.objects.exclude(thumbnail=''), 'thumbnail', shard, batch_size),
+        iter_column(ImageBlob.objects.all(), 'file_path', shard, batch_size),
+        iter_column(ImageBlob.objects.exclude(thumbnail_path=''), 'thumbnail_path', shard, batch_size),
+    ]
+    if shard.path.startswith('renditions/'):
+        sources += [
+            iter_rendition_paths(Image.objects.exclude(renditions=[]), 'file', shard, batch_size),
+            iter_rendition_paths(ImageBlob.objects.exclude(renditions=[]), 'file_path', shard, batch_size),
+        ]
+    return heapq.merge(*sources)
+
+
+def merge_orphans(stored, referenced):
+    """
+    归并两个有序流，产出只在存储中出现的路径
+
+    Args:
+        stored: 存储中的文件路径（有序）
+        referenced: 数据库引用的路径（有序）
+    """
+    referenced = iter(referenced)
+    current = next(referenced, None)
+    for path in stored:
+        while current is not None and current < path:
+            current = next(referenced, None)
+        if current != path:
+            yield path
+
+
+def referenced_paths(paths):
+    """
+    批量确认 paths 中仍被引用的路径
+
+    原图和缩略图按列 IN 查询；多尺寸图片按原图路径（去掉扩展名）前缀找到所在行，检查其 renditions
+
+    Returns:
+        set: 仍被引用的路径
+    """
+    from .models import Image, ImageBlob
+    from .renditions import rendition_paths
+
+    paths = set(paths)
+    if not paths:
+        return set()
+    found = set()
+    columns = [(Image.objects, 'file'), (Image.objects, 'thumbnail'),
+               (ImageBlob.objects, 'file_path'), (ImageBlob.objects, 'thumbnail_path')]
+    for queryset, field in columns:
+        found.update(queryset.filter(**{f'{field}__in': paths}).values_list(field, flat=True))
+
+    stems = sorted({match.group(1) + '.' for match in map(RENDITION_PATH_RE.match, paths - found) if match})
+    for start in range(0, len(stems), 100):
+        chunk = stems[start:start + 100]
+        for queryset, field in [(Image.objects, 'file'), (ImageBlob.objects, 'file_path')]:
+            condition = Q()
+            for stem in chunk:
+                condition |= Q(**{f'{field}__startswith': stem})
+            for renditions in queryset.filter(condition).values_list('renditions', flat=True):
+                found.update(paths.intersection(rendition_paths(renditions)))
+    return found
+
+
+def is_referenced(path):
+    """按路径单独确认文件是否被引用（删除前调用）"""
+    return bool(referenced_paths([path]))
+
+
+class DeleteThrottle:
+    """按每秒删除数限速"""
+
+    def __init__(self, rate):
+        self.interval = 1 / rate if rate else 0
+        self.next_at = 0
+
+    def wait(self):
+        if not self.interval:
+            return
+        now = time.monotonic()
+        if self.next_at > now:
+            time.sleep(self.next_at - now)
+            now = self.next_at
+        self.next_at = now + self.interval
+
+
+def collect_shard(shard, report, dry_run=False, throttle=None, storage=None):
+    """回收一个分片中的孤立文件，结果累加到 report"""
+    storage = storage or default_storage
+    min_age = getattr(settings, 'ORPHAN_GC_MIN_AGE', 60 * 60)
+    deadline = timezone.now() - timedelta(seconds=min_age)
+
+    def counted(iterable, field):
+        for item in iterable:
+            report[field] += 1
+            yield item
+
+    stored = counted(iter_stored_files(shard, storage), 'files_scanned')
+    referenced = counted(iter_referenced_paths(shard), 'paths_read')
+    for path in merge_orphans(stored, referenced):
+        try:
+            if storage.get_modified_time(path) > deadline:
+                report['skipped_recent'] += 1
+                continue
+            if is_referenced(path):
+                continue
+            size = storage.size(path)
+        except OSError:
+            # 扫描期间已被删除
+            continue
+        report['orphans'] += 1
+        report['orphan_bytes'] += size
+        if dry_run:
+            logger.info(f"孤立文件（dry-run）: {path}")
+            continue
+        if throttle:
+            throttle.wait()
+        try:
+            storage.delete(path)
+        except OSError as e:
+            logger.error(f"清理文件失败: {path}, 错误: {e}")
+            report['errors'] += 1
+            continue
+        report['deleted'] += 1
+        logger.info(f"清理孤立文件: {path}")
+
+
+def collect_orphans(dry_run=False, full=False, max_shards=None, time_budget=None, delete_rate=None, storage=None):
+    """
+    增量回收孤立文件
+
+    Args:
+        dry_run: 只统计不删除
+        full: 从头扫描全部分片，不读取也不更新检查点
+        max_shards: 本次最多处理的分片数
+        time_budget: 本次运行时间（秒），处理完当前分片后超时即停止，默认 ORPHAN_GC_TIME_BUDGET
+        delete_rate: 每秒最多删除数，默认 ORPHAN_GC_DELETE_RATE，0 表示不限速
+
+    Returns:
+        dict: 扫描的分片数、文件数、数据库路径数、孤立文件数和大小、删除数、耗时与吞吐量，
+              以及是否完成一轮（completed）
+    """
+    if time_budget is None:
+        time_budget = getattr(settings, 'ORPHAN_GC_TIME_BUDGET', 5 * 60)
+    if delete_rate is None:
+        delete_rate = getattr(settings, 'ORPHAN_GC_DELETE_RATE', 50)
+    track = not (full or dry_run)
+    checkpoint = cache.get(CHECKPOINT_KEY) if track else None
+    resume_after = tuple(checkpoint.split('/')) if checkpoint else None
+
+    report = dict.fromkeys([
+        'shards', 'files_scanned', 'paths_read', 'orphans', 'orphan_bytes', 'deleted', 'skipped_recent', 'errors',
+    ], 0)
+    throttle = DeleteThrottle(delete_rate)
+    start = time.perf_counter()
+    completed = True
+    for shard in iter_shards(storage):
+        if resume_after is not None and shard.key <= resume_after:
+            continue
+        if (max_shards is not None and report['shards'] >= max_shards) or (
+            time_budget and time.perf_counter() - start >= time_budget
+        ):
+            completed = False
+            break
+        collect_shard(shard, report, dry_run=dry_run, throttle=throttle, storage=storage)
+        report['shards'] += 1
+        if track:
+            cache.set(CHECKPOINT_KEY, shard.path, timeout=None)
+    if track and completed:
+        cache.delete(CHECKPOINT_KEY)
+
+    elapsed = time.perf_counter() - start
+    report.update({
+        'dry_run': dry_run,
+        'completed': completed,
+        'checkpoint': cache.get(CHECKPOINT_KEY) if track else None,
+        'elapsed_seconds': round(elapsed, 3),
+        'files_per_second': round(report['files_scanned'] / elapsed, 1) if elapsed else None,
+    })
+    if not dry_run:
+        cache.set(REPORT_KEY, report, timeout=None)
+    return report
@@ -5,10 +5,15 @@
 """
 import os
 import uuid
+import hashlib
 from io import BytesIO
 from PIL import Image as PILImage, ImageEnhance, ImageFilter
-from django.core.files.base import ContentFile
+from django.core.files import File
 from django.conf import settings
+from django.db import transaction
+
+from .blobs import acquire_blob, delete_files_on_commit, release_blob
+from .renditions import rendition_paths
 
 
 class ImageEditor:
@@ -270,26 +275,36 @@ class ImageEditor:
         save_image.save(buffer, format=format, **save_options)
         buffer.seek(0)
         
-        # 删除旧文件
-        old_path = self.image_instance.file.path
-        if os.path.exists(old_path):
-            os.remove(old_path)
-        
-        # 保存新文件
-        self.image_instance.file.save(
-            self.image_instance.filename,
-            ContentFile(buffer.read()),
-            save=False
-        )
-        
-        # 更新图片尺寸
-        self.image_instance.width = self.pil_image.size[0]
-        self.image_instance.height = self.pil_image.size[1]
-        self.image_instance.size = self.image_instance.file.size
-        
-        # 重新生成缩略图
-        self.image_instance.thumbnail_generated = False
-        self.image_instance.save()
+        # 保存新内容（直接使用缓冲区，避免再复制一份字节串）
+        content_hash = hashlib.sha256(buffer.getbuffer()).hexdigest()
+        size = buffer.getbuffer().nbytes
+        ext = self.image_instance.filename.split('.')[-1].lower()
+        old_blob_id = self.image_instance.blob_id
+        old_paths = [self.image_instance.file.name, self.image_instance.thumbnail.name]
+        old_paths += rendition_paths(self.image_instance.renditions)
+        
+        with transaction.atomic():
+            blob = acquire_blob(File(buffer, name=self.image_instance.filename), content_hash, ext, size)
+            self.image_instance.blob = blob
+            self.image_instance.file.name = blob.file_path
+            self.image_instance.content_hash = content_hash
+            self.image_instance.size = size
+            
+            # 更新图片尺寸
+            self.image_instance.width = self.pil_image.size[0]
+            self.image_instance.height = self.pil_image.size[1]
+            
+            # 重新生成缩略图
+            self.image_instance.thumbnail.name = ''
+            self.image_instance.renditions = []
+            self.image_instance.thumbnail_generated = False
+            self.image_instance.save()
+            
+            # 释放旧文件：共享存储减少引用计数，旧数据直接删除
+            if old_blob_id:
+                release_blob(old_blob_id)
+            else:
+                delete_files_on_commit(old_paths)
         
         # 异步生成新缩略图
         try:
@@ -348,25 +363,32 @@ class ImageEditor:
         save_image.save(buffer, format=format, **save_options)
         buffer.seek(0)
         
-        # 创建新的 Image 实例
-        new_image = Image.objects.create(
-            owner=owner,
-            filename=new_filename,
-            size=buffer.getbuffer().nbytes,
-            width=self.pil_image.size[0],
-            height=self.pil_image.size[1],
-            is_public=False,  # 新图片默认为私有
-            description=f"编辑自: {original_name}",
-            processing_status='pending'
-        )
-        
-        # 保存文件
-        new_image.file.save(new_filename, ContentFile(buffer.read()), save=True)
+        # 保存文件（直接使用缓冲区，避免再复制一份字节串）
+        content_hash = hashlib.sha256(buffer.getbuffer()).hexdigest()
+        size = buffer.getbuffer().nbytes
+        
+        with transaction.atomic():
+            blob = acquire_blob(File(buffer, name=new_filename), content_hash, ext.lstrip('.').lower(), size)
+            
+            # 创建新的 Image 实例
+            new_image = Image.objects.create(
+                owner=owner,
+                file=blob.file_path,
+                blob=blob,
+                filename=new_filename,
+                size=size,
+                width=self.pil_image.size[0],
+                height=self.pil_image.size[1],
+                is_public=False,  # 新图片默认为私有
+                content_hash=content_hash,
+                description=f"编辑自: {original_name}",
+                processing_status='pending'
+            )
         
         # 异步处理
         try:
-            from .tasks import process_image_async
-            process_image_async.delay(new_image.id)
+            from .processing import schedule_image_processing
+            schedule_image_processing()
         except Exception:
             pass
         
@@ -0,0 +1,112 @@
+"""
+缩略图与多尺寸图片生成的基准测试
+
+对比全尺寸解码与降采样解码（JPEG draft / reduce）的单张耗时和峰值内存：
+
+    python manage.py benchmark_thumbnails
+    python manage.py benchmark_thumbnails --dir /path/to/photos --repeat 3
+
+未指定 --dir 时生成一组大尺寸 JPEG/PNG/WebP 测试图片。
+每次测量在独立的子进程中进行，峰值内存为子进程最大 RSS 相对处理前的增量。
+"""
+import multiprocessing
+import os
+import resource
+import tempfile
+import time
+from io import BytesIO
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from PIL import Image as PILImage
+
+from apps.images.renditions import decode_image, encode_renditions
+
+EXTENSIONS = ('.jpg', '.jpeg', '.png', '.webp')
+
+
+def process(path, reduced):
+    """执行一次与 generate_thumbnail 相同的解码、缩放和编码（结果只写入内存）"""
+    thumb_size = getattr(settings, 'THUMBNAIL_SIZE', (300, 300))
+    thumb_quality = getattr(settings, 'THUMBNAIL_QUALITY', 85)
+    with open(path, 'rb') as f:
+        img = decode_image(f, thumb_size, reduced=reduced)
+        for _ in encode_renditions(img):
+            pass
+        img.thumbnail(thumb_size, PILImage.Resampling.LANCZOS)
+        img.save(BytesIO(), format='JPEG', quality=thumb_quality, optimize=True)
+
+
+def measure(path, reduced, queue):
+    """子进程入口：返回 (耗时秒, 峰值内存增量 KB)"""
+    baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.perf_counter()
+    process(path, reduced)
+    elapsed = time.perf_counter() - start
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    queue.put((elapsed, peak - baseline))
+
+
+def make_corpus(directory, megapixels):
+    """生成测试图片：带渐变和噪声的 JPEG、PNG、WebP"""
+    width = int((megapixels * 1_000_000 * 3 / 2) ** 0.5)
+    height = width * 2 // 3
+    gradient = PILImage.linear_gradient('L').resize((width, height))
+    noise = PILImage.effect_noise((width, height), 40)
+    img = PILImage.merge('RGB', (gradient, noise, gradient.transpose(PILImage.Transpose.FLIP_LEFT_RIGHT)))
+    paths = []
+    for fmt, ext, options in [('JPEG', 'jpg', {'quality': 90}), ('PNG', 'png', {}), ('WEBP', 'webp', {'quality': 90})]:
+        path = os.path.join(directory, f'sample_{megapixels}mp.{ext}')
+        img.save(path, format=fmt, **options)
+        paths.append(path)
+    return paths
+
+
+class Command(BaseCommand):
+    help = '对比全尺寸解码与降采样解码生成缩略图和多尺寸图片的耗时与峰值内存'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dir', help='测试图片目录（默认生成测试图片）')
+        parser.add_argument('--megapixels', type=int, default=24, help='生成测试图片的像素数（百万）')
+        parser.add_argument('--repeat', type=int, default=3, help='每张图片每种模式的重复次数，取最小耗时')
+
+    def handle(self, *args, **options):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            if options['dir']:
+                paths = sorted(
+                    os.path.join(options['dir'], name) for name in os.listdir(options['dir'])
+                    if name.lower().endswith(EXTENSIONS)
+                )
+            else:
+                self.stdout.write(f"生成 {options['megapixels']}MP 测试图片...")
+                paths = make_corpus(temp_dir, options['megapixels'])
+            self.run(paths, options['repeat'])
+
+    def run(self, paths, repeat):
+        context = multiprocessing.get_context('fork')
+        self.stdout.write(f"{'文件':<28}{'模式':<8}{'耗时(ms)':>10}{'峰值内存(MB)':>14}")
+        totals = {False: [0.0, 0], True: [0.0, 0]}
+        for path in paths:
+            with PILImage.open(path) as img:
+                label = f'{os.path.basename(path)[:18]} {img.width}x{img.height}'
+            for reduced in (False, True):
+                results = []
+                for _ in range(repeat):
+                    queue = context.Queue()
+                    worker = context.Process(target=measure, args=(path, reduced, queue))
+                    worker.start()
+                    results.append(queue.get())
+                    worker.join()
+                elapsed = min(result[0] for result in results)
+                peak = max(result[1] for result in results)
+                totals[reduced][0] += elapsed
+                totals[reduced][1] = max(totals[reduced][1], peak)
+                mode = '降采样' if reduced else '全尺寸'
+                self.stdout.write(f'{label:<28}{mode:<8}{elapsed * 1000:>10.1f}{peak / 1024:>14.1f}')
+
+        if paths:
+            full, reduced = totals[False], totals[True]
+            self.stdout.write(self.style.SUCCESS(
+                f'平均耗时 {full[0] / len(paths) * 1000:.1f}ms → {reduced[0] / len(paths) * 1000:.1f}ms，'
+                f'峰值内存 {full[1] / 1024:.1f}MB → {reduced[1] / 1024:.1f}MB'
+            ))
@@ -0,0 +1,142 @@
+"""
+图片列表可见性查询的基准测试
+
+对比旧查询（OR 条件 + 标签 JOIN + DISTINCT）、当前默认查询（OR 条件 + 标签 ID 子查询）
+与可见性分支归并（IMAGE_VISIBILITY_MERGE）在第一页、深翻页（游标位于中部）和标签筛选下的耗时：
+
+    python manage.py benchmark_visibility
+    python manage.py benchmark_visibility --images 200000 --repeat 5
+
+测试数据在事务中批量写入，结束后回滚，不影响现有数据。
+"""
+import random
+import time
+from datetime import timedelta
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, Q
+from django.utils import timezone
+
+from apps.images.models import Image, ImageTag
+from apps.images.pagination import ImageKeysetPagination
+from apps.tags.models import Tag
+
+TAG_NAMES = ['风景', '人像', '城市', '夜景', '美食', '动物', '建筑', '旅行']
+
+
+class Rollback(Exception):
+    """用于回滚测试数据"""
+
+
+class Command(BaseCommand):
+    help = '对比 OR + DISTINCT、OR 单查询与可见性分支归并的图片列表查询耗时'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--images', type=int, default=1_000_000, help='测试图片数量')
+        parser.add_argument('--users', type=int, default=100, help='测试用户数量')
+        parser.add_argument('--page-size', type=int, default=30, help='每页数量')
+        parser.add_argument('--repeat', type=int, default=3, help='每个查询的重复次数，取最小耗时')
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                user, middle, tags = self.populate(options['images'], options['users'])
+                self.run(user, middle, [tags[0].name, tags[1].name], options['page_size'], options['repeat'])
+                raise Rollback
+        except Rollback:
+            pass
+
+    def populate(self, count, user_count, batch_size=10_000):
+        """批量写入测试数据，返回 (查询用户, 位于中部的上传时间, 标签)"""
+        self.stdout.write(f'写入 {count} 张测试图片...')
+        User = get_user_model()
+        suffix = timezone.now().strftime('%H%M%S%f')
+        users = User.objects.bulk_create([
+            User(username=f'bench_{suffix}_{i}', password='!') for i in range(user_count)
+        ])
+        tags = Tag.objects.bulk_create([Tag(name=f'{name}_{suffix}') for name in TAG_NAMES])
+        start = timezone.now() - timedelta(days=365)
+
+        rng = random.Random(0)
+        for offset in range(0, count, batch_size):
+            images = Image.objects.bulk_create([
+                Image(
+                    owner=users[rng.randrange(user_count)],
+                    file=f'uploads/bench/{i}.jpg',
+                    filename=f'{i}.jpg',
+                    size=rng.randrange(1, 10_000_000),
+                    is_public=rng.random() < 0.3,
+                    upload_time=start + timedelta(seconds=i * 30),
+                    processing_status='completed',
+                )
+                for i in range(offset, min(offset + batch_size, count))
+            ])
+            ImageTag.objects.bulk_create([
+                ImageTag(image=image, tag=tag)
+                for image in images
+                for tag in rng.sample(tags, rng.randrange(0, 4))
+            ], ignore_conflicts=True)
+        # bulk_create 不触发信号，手动写入标签使用次数
+        counts = dict(
+            ImageTag.objects.filter(tag__in=tags).values('tag_id').annotate(n=Count('id')).values_list('tag_id', 'n')
+        )
+        for tag in tags:
+            tag.usage_count = counts.get(tag.id, 0)
+        Tag.objects.bulk_update(tags, ['usage_count'])
+        return users[0], start + timedelta(seconds=count * 15), tags
+
+    def run(self, user, middle, tag_names, page_size, repeat):
+        paginator = ImageKeysetPagination()
+        paginator.page_size = page_size
+
+        def legacy(cursor=None, names=None):
+            queryset = Image.objects.filter(Q(owner=user) | Q(is_public=True))
+            for name in names or []:
+                queryset = queryset.filter(tags__name__iexact=name)
+            if cursor:
+                queryset = queryset.filter(upload_time__lt=cursor)
+            return list(queryset.distinct().order_by('-upload_time', '-id')[:page_size + 1])
+
+        def single(cursor=None, names=None):
+            queryset = Image.objects.visible_to(user).with_tags(names or [])
+            if cursor:
+                queryset = queryset.filter(upload_time__lt=cursor)
+            return list(queryset.order_by('-upload_time', '-id')[:page_size + 1])
+
+        def merged(cursor=None, names=None):
+            queryset = Image.objects.visible_to(user).with_tags(names or [])
+            if cursor:
+                queryset = queryset.filter(upload_time__lt=cursor)
+            queryset = queryset.order_by('-upload_time', '-id')
+            return paginator.merge_branches(queryset, queryset.visibility_branches(), 'upload_time', True)
+
+        cases = [
+            ('第一页', {}),
+            ('深翻页', {'cursor': middle}),
+            ('标签 AND', {'names': tag_names}),
+            ('标签 AND 深翻页', {'names': tag_names, 'cursor': middle}),
+        ]
+        self.stdout.write(f"{'查询':<14}{'OR+DISTINCT(ms)':>18}{'OR+子查询(ms)':>16}{'分支归并(ms)':>16}")
+        for label, kwargs in cases:
+            timings = []
+            expected = None
+            for query in (legacy, single, merged):
+                rows, elapsed = self.measure(query, kwargs, repeat)
+                ids = [image.id for image in rows]
+                if expected is not None and ids != expected:
+                    self.stderr.write(f'{label}: {query.__name__} 结果不一致')
+                expected = ids
+                timings.append(elapsed * 1000)
+            self.stdout.write(f'{label:<14}' + ''.join(f'{t:>{width}.1f}' for t, width in zip(timings, (18, 16, 16))))
+
+    def measure(self, query, kwargs, repeat):
+        """返回 (结果, 最小耗时秒)"""
+        best = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            rows = query(**kwargs)
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        return rows, best
@@ -0,0 +1,45 @@
+"""
+回收孤立文件
+
+扫描 uploads、blobs、thumbnails、renditions 中没有数据库记录引用的文件：
+
+    python manage.py collect_orphaned_files --dry-run     # 只统计
+    python manage.py collect_orphaned_files --full        # 一次扫描全部分片
+    python manage.py collect_orphaned_files --shards 10   # 从检查点继续处理 10 个分片
+"""
+from django.core.management.base import BaseCommand
+
+from apps.images.gc import collect_orphans
+
+
+class Command(BaseCommand):
+    help = '增量回收没有数据库记录引用的图片文件'
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='只统计，不删除文件')
+        parser.add_argument('--full', action='store_true', help='从头扫描全部分片，不使用检查点')
+        parser.add_argument('--shards', type=int, default=None, help='最多处理的分片数')
+        parser.add_argument('--rate', type=float, default=None, help='每秒最多删除的文件数')
+    
+    def handle(self, *args, **options):
+        full = options['full'] or options['dry_run']
+        report = collect_orphans(
+            dry_run=options['dry_run'],
+            full=full,
+            max_shards=options['shards'],
+            time_budget=0 if full else None,
+            delete_rate=options['rate'],
+        )
+        self.stdout.write(
+            f"分片 {report['shards']} 个，扫描文件 {report['files_scanned']} 个，"
+            f"数据库路径 {report['paths_read']} 条，耗时 {report['elapsed_seconds']} 秒"
+            f"（{report['files_per_second']} 文件/秒）"
+        )
+        action = '发现' if report['dry_run'] else '删除'
+        count = report['orphans'] if report['dry_run'] else report['deleted']
+        self.stdout.write(self.style.SUCCESS(
+            f"{action}孤立文件 {count} 个（{report['orphan_bytes']} 字节），"
+            f"跳过最近修改的文件 {report['skipped_recent']} 个"
+        ))
+        if not report['completed']:
+            self.stdout.write(f"未完成，下次从 {report['checkpoint']} 之后继续")
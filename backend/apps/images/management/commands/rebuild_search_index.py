@@ -0,0 +1,34 @@
+"""
+重建图片全文索引
+
+    python manage.py rebuild_search_index
+"""
+from django.core.management.base import BaseCommand
+
+from apps.images.models import Image
+from apps.images.search import get_search_backend
+
+
+class Command(BaseCommand):
+    help = '重建图片全文索引（文件名、描述、标签、相机信息）'
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help='每批处理的图片数量')
+    
+    def handle(self, *args, **options):
+        backend = get_search_backend()
+        batch_size = options['batch_size']
+        queryset = Image.objects.order_by('id').prefetch_related('tags')
+        
+        total = 0
+        batch = []
+        for image in queryset.iterator(chunk_size=batch_size):
+            batch.append(image)
+            if len(batch) >= batch_size:
+                backend.index(batch)
+                total += len(batch)
+                batch = []
+        backend.index(batch)
+        total += len(batch)
+        
+        self.stdout.write(self.style.SUCCESS(f'已重建 {total} 张图片的索引'))
@@ -0,0 +1,19 @@
+"""
+校正图片统计计数
+
+根据 images 表重新计算每个用户和全站的图片数量、公开数量和占用空间，
+用于数据迁移后或计数出现偏差时校正：
+
+    python manage.py reconcile_image_stats
+"""
+from django.core.management.base import BaseCommand
+
+from apps.images.stats import reconcile_image_stats
+
+
+class Command(BaseCommand):
+    help = '根据图片表校正图片统计计数'
+    
+    def handle(self, *args, **options):
+        corrected = reconcile_image_stats()
+        self.stdout.write(self.style.SUCCESS(f'已修正 {corrected} 行统计计数'))
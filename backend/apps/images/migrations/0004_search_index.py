@@ -0,0 +1,39 @@
+# Generated by Django 4.2.27 on 2026-10-18 20:05
+
+from django.db import migrations
+
+
+def create_search_index(apps, schema_editor):
+    """创建全文索引结构并写入已有图片"""
+    from apps.images.search import get_search_backend
+    
+    backend = get_search_backend(schema_editor.connection)
+    backend.setup(schema_editor)
+    
+    Image = apps.get_model('images', 'Image')
+    queryset = Image.objects.order_by('id').prefetch_related('tags')
+    batch = []
+    for image in queryset.iterator(chunk_size=500):
+        batch.append(image)
+        if len(batch) >= 500:
+            backend.index(batch)
+            batch = []
+    backend.index(batch)
+
+
+def drop_search_index(apps, schema_editor):
+    from apps.images.search import get_search_backend
+    
+    get_search_backend(schema_editor.connection).teardown(schema_editor)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('images', '0003_image_processing_status_image_thumbnail_and_more'),
+        ('tags', '0002_tag_usage_count'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
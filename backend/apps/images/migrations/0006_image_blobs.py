@@ -0,0 +1,37 @@
+# Generated by Django 4.2.27 on 2026-10-18 19:42
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('images', '0005_upload_pipeline'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImageBlob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('content_hash', models.CharField(max_length=64, unique=True, verbose_name='内容哈希(SHA-256)')),
+                ('file_path', models.CharField(max_length=255, verbose_name='文件路径')),
+                ('thumbnail_path', models.CharField(blank=True, default='', max_length=255, verbose_name='缩略图路径')),
+                ('size', models.PositiveIntegerField(verbose_name='文件大小(字节)')),
+                ('ref_count', models.PositiveIntegerField(default=0, verbose_name='引用计数')),
+                ('exif_data', models.JSONField(blank=True, null=True, verbose_name='EXIF 数据')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='创建时间')),
+            ],
+            options={
+                'verbose_name': '图片存储文件',
+                'verbose_name_plural': '图片存储文件',
+                'db_table': 'image_blobs',
+            },
+        ),
+        migrations.AddField(
+            model_name='image',
+            name='blob',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='images', to='images.imageblob', verbose_name='存储文件'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.2.27 on 2026-10-18 19:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('images', '0006_image_blobs'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='image',
+            name='renditions',
+            field=models.JSONField(blank=True, default=list, verbose_name='多尺寸图片'),
+        ),
+        migrations.AddField(
+            model_name='imageblob',
+            name='renditions',
+            field=models.JSONField(blank=True, default=list, verbose_name='多尺寸图片'),
+        ),
+    ]
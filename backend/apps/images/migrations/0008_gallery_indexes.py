@@ -0,0 +1,48 @@
+# Generated by Django 4.2.27 on 2026-10-18 19:57
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('images', '0007_image_renditions'),
+        ('tags', '0002_tag_usage_count'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='image',
+            index=models.Index(fields=['owner', '-upload_time', '-id'], name='images_owner_time_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='image',
+            index=models.Index(fields=['owner', 'is_public'], name='images_owner_public_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='image',
+            index=models.Index(fields=['-upload_time', '-id'], name='images_time_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='image',
+            index=models.Index(condition=models.Q(('is_public', True)), fields=['-upload_time', '-id'], name='images_public_time_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='image',
+            index=models.Index(condition=models.Q(('is_public', True)), fields=['filename', 'id'], name='images_public_name_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='image',
+            index=models.Index(condition=models.Q(('is_public', True)), fields=['size', 'id'], name='images_public_size_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='image',
+            index=models.Index(condition=models.Q(('processing_status', 'pending')), fields=['id'], name='images_pending_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='imagetag',
+            index=models.Index(fields=['tag', 'image'], name='image_tags_tag_image_idx'),
+        ),
+    ]
@@ -0,0 +1,62 @@
+# Generated by Django 4.2.27 on 2026-10-18 20:19
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Q, Sum
+
+
+def populate_image_stats(apps, schema_editor):
+    """根据已有图片初始化统计计数"""
+    Image = apps.get_model('images', 'Image')
+    ImageStats = apps.get_model('images', 'ImageStats')
+    
+    rows = Image.objects.order_by().values('owner_id').annotate(
+        image_count=Count('id'),
+        public_count=Count('id', filter=Q(is_public=True)),
+        total_size=Sum('size'),
+    )
+    stats = [
+        ImageStats(
+            owner_id=row['owner_id'],
+            image_count=row['image_count'],
+            public_count=row['public_count'],
+            total_size=row['total_size'] or 0,
+        )
+        for row in rows
+    ]
+    stats.append(ImageStats(
+        owner_id=None,
+        image_count=sum(row.image_count for row in stats),
+        public_count=sum(row.public_count for row in stats),
+        total_size=sum(row.total_size for row in stats),
+    ))
+    ImageStats.objects.bulk_create(stats, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('images', '0008_gallery_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImageStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('image_count', models.PositiveIntegerField(default=0, verbose_name='图片数量')),
+                ('public_count', models.PositiveIntegerField(default=0, verbose_name='公开图片数量')),
+                ('total_size', models.PositiveBigIntegerField(default=0, verbose_name='占用空间(字节)')),
+                ('owner', models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='image_stats', to=settings.AUTH_USER_MODEL, verbose_name='用户')),
+            ],
+            options={
+                'verbose_name': '图片统计',
+                'verbose_name_plural': '图片统计',
+                'db_table': 'image_stats',
+                'indexes': [models.Index(fields=['-image_count'], name='image_stats_count_idx')],
+            },
+        ),
+        migrations.RunPython(populate_image_stats, migrations.RunPython.noop),
+    ]
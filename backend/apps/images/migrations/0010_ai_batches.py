@@ -0,0 +1,77 @@
+# Generated by Django 4.2.27 on 2026-10-18 20:36
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('images', '0009_image_stats'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AIBatch',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('running', '进行中'), ('completed', '已完成'), ('cancelled', '已取消')], default='running', max_length=20, verbose_name='状态')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='创建时间')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='更新时间')),
+                ('owner', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ai_batches', to=settings.AUTH_USER_MODEL, verbose_name='所有者')),
+            ],
+            options={
+                'verbose_name': '批量 AI 分析',
+                'verbose_name_plural': '批量 AI 分析',
+                'db_table': 'ai_batches',
+                'ordering': ['-created_at'],
+            },
+        ),
+        migrations.CreateModel(
+            name='AIBatchItem',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('pending', '待处理'), ('success', '已完成'), ('cached', '使用缓存结果'), ('failed', '失败')], default='pending', max_length=20, verbose_name='状态')),
+                ('attempts', models.PositiveSmallIntegerField(default=0, verbose_name='请求次数')),
+                ('detail', models.CharField(blank=True, default='', max_length=255, verbose_name='失败原因')),
+                ('batch', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='items', to='images.aibatch', verbose_name='批次')),
+                ('image', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='images.image', verbose_name='图片')),
+            ],
+            options={
+                'verbose_name': '批量 AI 分析项',
+                'verbose_name_plural': '批量 AI 分析项',
+                'db_table': 'ai_batch_items',
+            },
+        ),
+        migrations.CreateModel(
+            name='VisionResult',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('content_hash', models.CharField(max_length=64, verbose_name='内容哈希(SHA-256)')),
+                ('model', models.CharField(max_length=100, verbose_name='模型')),
+                ('description', models.TextField(blank=True, default='', verbose_name='描述')),
+                ('tags', models.JSONField(blank=True, default=list, verbose_name='标签')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='创建时间')),
+            ],
+            options={
+                'verbose_name': 'AI 分析结果',
+                'verbose_name_plural': 'AI 分析结果',
+                'db_table': 'vision_results',
+                'constraints': [models.UniqueConstraint(fields=('content_hash', 'model'), name='vision_result_hash_model_uniq')],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='aibatch',
+            index=models.Index(fields=['status', 'updated_at'], name='ai_batch_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='aibatchitem',
+            index=models.Index(fields=['batch', 'status'], name='ai_batch_item_status_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='aibatchitem',
+            constraint=models.UniqueConstraint(fields=('batch', 'image'), name='ai_batch_item_uniq'),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 4.2.27 on 2026-10-18 20:42
+
+import apps.images.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('images', '0010_ai_batches'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='image',
+            name='file',
+            field=models.ImageField(db_index=True, upload_to=apps.images.models.image_upload_path, verbose_name='图片文件'),
+        ),
+        migrations.AlterField(
+            model_name='image',
+            name='thumbnail',
+            field=models.ImageField(blank=True, db_index=True, default='', upload_to=apps.images.models.thumbnail_upload_path, verbose_name='缩略图'),
+        ),
+        migrations.AlterField(
+            model_name='imageblob',
+            name='file_path',
+            field=models.CharField(db_index=True, max_length=255, verbose_name='文件路径'),
+        ),
+        migrations.AlterField(
+            model_name='imageblob',
+            name='thumbnail_path',
+            field=models.CharField(blank=True, db_index=True, default='', max_length=255, verbose_name='缩略图路径'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.27 on 2026-10-18 21:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('images', '0011_file_path_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='image',
+            name='processing_started_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='开始处理时间'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.27 on 2026-10-18 21:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('images', '0012_image_processing_started_at'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='image',
+            index=models.Index(condition=models.Q(('is_public', True)), fields=['id'], name='images_public_id_idx'),
+        ),
+    ]
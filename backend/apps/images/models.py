@@ -1,6 +1,9 @@
 from django.db import models
+from django.db.models.signals import pre_save, post_save, pre_delete, post_delete
+from django.dispatch import receiver
 from django.conf import settings
 import os
+import threading
 import uuid
 
 
@@ -8,14 +11,100 @@ def image_upload_path(instance, filename):
     """生成图片上传路径：uploads/user_{id}/{uuid}.{ext}"""
     ext = filename.split('.')[-1].lower()
     new_filename = f"{uuid.uuid4().hex}.{ext}"
-    return os.path.join('uploads', f'user_{instance.owner.id}', new_filename)
+    return os.path.join('uploads', f'user_{instance.owner_id}', new_filename)
 
 
 def thumbnail_upload_path(instance, filename):
     """生成缩略图上传路径：thumbnails/user_{id}/{uuid}_thumb.jpg"""
     ext = 'jpg'  # 缩略图统一使用 jpg 格式
     name_without_ext = os.path.splitext(filename)[0]
-    return os.path.join('thumbnails', f'user_{instance.owner.id}', f"{name_without_ext}.{ext}")
+    return os.path.join('thumbnails', f'user_{instance.owner_id}', f"{name_without_ext}.{ext}")
+
+
+class ImageQuerySet(models.QuerySet):
+    """
+    图片查询集
+    
+    - visible_to：用户可见的图片，记录可见性拆分，分页时两个分支分别走索引后合并
+    - with_tags：标签筛选编译为对标签 ID 的 IN 半连接，不产生重复行，不需要 DISTINCT
+    """
+    
+    # visible_to 的用户 ID，未调用时为 None
+    _visibility_owner_id = None
+    
+    def _clone(self):
+        clone = super()._clone()
+        clone._visibility_owner_id = self._visibility_owner_id
+        return clone
+    
+    def visible_to(self, user):
+        """用户自己的全部图片 + 其他用户的公开图片"""
+        queryset = self.filter(models.Q(owner=user) | models.Q(is_public=True))
+        queryset._visibility_owner_id = user.pk
+        return queryset
+    
+    def visibility_branches(self):
+        """
+        拆分为互不重叠的两个分支：自己的图片、其他用户的公开图片
+        
+        每个分支保留原查询的其他条件和排序，分别命中 (owner, upload_time) 索引和公开图片部分索引。
+        未调用 visible_to 时返回 None
+        """
+        owner_id = self._visibility_owner_id
+        if owner_id is None:
+            return None
+        return [
+            self.filter(owner_id=owner_id),
+            self.filter(is_public=True).exclude(owner_id=owner_id),
+        ]
+    
+    def with_tags(self, names, mode='and'):
+        """
+        按标签名称筛选
+        
+        名称先解析为标签 ID，再编译为一个 image_id IN (子查询)，
+        AND 模式按 image_id 分组，要求命中的标签数等于请求的标签数。
+        
+        AND 模式下所有标签都很常用时（使用次数均超过 TAG_FILTER_GROUPED_MAX），
+        分组需要聚合大量关联行，改为按标签 ID 逐个 EXISTS：
+        按排序索引扫描图片，取满一页即停止
+        
+        Args:
+            names: 标签名称列表（不区分大小写）
+            mode: 'and' 包含全部 / 'or' 包含任一 / 'not' 不包含任何
+        """
+        from apps.tags.models import Tag
+        
+        requested = {name.strip().lower() for name in names if name and name.strip()}
+        if not requested:
+            return self
+        tags = Tag.resolve_tags(requested)
+        tag_ids = {tag.id for tag in tags.values()}
+        tagged = ImageTag.objects.filter(tag_id__in=tag_ids).values('image_id')
+        
+        if mode == 'not':
+            return self.exclude(pk__in=tagged) if tag_ids else self
+        if mode == 'or':
+            return self.filter(pk__in=tagged) if tag_ids else self.none()
+        # AND：任一标签不存在时没有结果
+        if len(tags) < len(requested):
+            return self.none()
+        grouped_max = getattr(settings, 'TAG_FILTER_GROUPED_MAX', 5000)
+        # 缓存的标签不含计数（usage_count 延迟加载），最小使用次数用一条聚合查询取得
+        least_used = Tag.objects.filter(id__in=tag_ids).aggregate(least=models.Min('usage_count'))['least']
+        if least_used > grouped_max:
+            queryset = self
+            for tag_id in tag_ids:
+                queryset = queryset.filter(models.Exists(
+                    ImageTag.objects.filter(image=models.OuterRef('pk'), tag_id=tag_id)
+                ))
+            return queryset
+        matched = (
+            tagged.annotate(matched=models.Count('tag_id'))
+            .filter(matched=len(tag_ids))
+            .values('image_id')
+        )
+        return self.filter(pk__in=matched)
 
 
 class Image(models.Model):
@@ -30,20 +119,29 @@ class Image(models.Model):
         related_name='images',
         verbose_name='上传者'
     )
+    # 文件路径建索引：孤立文件回收按路径前缀有序读取（见 gc.py）
     file = models.ImageField(
         upload_to=image_upload_path,
+        db_index=True,
         verbose_name='图片文件'
     )
     thumbnail = models.ImageField(
         upload_to=thumbnail_upload_path,
         blank=True,
         default='',
+        db_index=True,
         verbose_name='缩略图'
     )
     thumbnail_generated = models.BooleanField(
         default=False,
         verbose_name='缩略图已生成'
     )
+    # 响应式多尺寸图片，格式见 renditions.py
+    renditions = models.JSONField(
+        default=list,
+        blank=True,
+        verbose_name='多尺寸图片'
+    )
     processing_status = models.CharField(
         max_length=20,
         choices=[
@@ -55,6 +153,12 @@ class Image(models.Model):
         default='pending',
         verbose_name='处理状态'
     )
+    # 进入 processing 状态的时间，超时未完成的图片由定期任务重新处理
+    processing_started_at = models.DateTimeField(
+        null=True,
+        blank=True,
+        verbose_name='开始处理时间'
+    )
     filename = models.CharField(
         max_length=255,
         verbose_name='原始文件名'
@@ -62,6 +166,22 @@ class Image(models.Model):
     size = models.PositiveIntegerField(
         verbose_name='文件大小(字节)'
     )
+    content_hash = models.CharField(
+        max_length=64,
+        blank=True,
+        default='',
+        db_index=True,
+        verbose_name='内容哈希(SHA-256)'
+    )
+    # 去重存储的原图；为空表示旧数据，文件独占存储在 uploads/ 下
+    blob = models.ForeignKey(
+        'ImageBlob',
+        on_delete=models.PROTECT,
+        null=True,
+        blank=True,
+        related_name='images',
+        verbose_name='存储文件'
+    )
     width = models.PositiveIntegerField(
         null=True,
         blank=True,
@@ -151,11 +271,41 @@ class Image(models.Model):
         verbose_name='EXIF已解析'
     )
     
+    objects = ImageQuerySet.as_manager()
+    
     class Meta:
         db_table = 'images'
         ordering = ['-upload_time']
         verbose_name = '图片'
         verbose_name_plural = '图片'
+        # 与列表查询的过滤条件和游标分页排序（排序字段 + id）对应；
+        # 公开图片使用部分索引，只包含 is_public 的行
+        indexes = [
+            models.Index(fields=['owner', '-upload_time', '-id'], name='images_owner_time_idx'),
+            models.Index(fields=['owner', 'is_public'], name='images_owner_public_idx'),
+            models.Index(fields=['-upload_time', '-id'], name='images_time_idx'),
+            models.Index(
+                fields=['-upload_time', '-id'], name='images_public_time_idx',
+                condition=models.Q(is_public=True)
+            ),
+            models.Index(
+                fields=['filename', 'id'], name='images_public_name_idx',
+                condition=models.Q(is_public=True)
+            ),
+            models.Index(
+                fields=['size', 'id'], name='images_public_size_idx',
+                condition=models.Q(is_public=True)
+            ),
+            # 首页随机抽样按 id 探测公开图片（见 sampling.py）
+            models.Index(
+                fields=['id'], name='images_public_id_idx',
+                condition=models.Q(is_public=True)
+            ),
+            models.Index(
+                fields=['id'], name='images_pending_idx',
+                condition=models.Q(processing_status='pending')
+            ),
+        ]
     
     def __str__(self):
         return f"{self.filename} - {self.owner.username}"
@@ -199,8 +349,562 @@ class ImageTag(models.Model):
     class Meta:
         db_table = 'image_tags'
         unique_together = ['image', 'tag']
+        # 按标签查图片（unique_together 已覆盖按图片查标签）
+        indexes = [
+            models.Index(fields=['tag', 'image'], name='image_tags_tag_image_idx'),
+        ]
         verbose_name = '图片标签'
         verbose_name_plural = '图片标签'
     
     def __str__(self):
         return f"{self.image.filename} - {self.tag.name}"
+
+
+def attach_tags(assignments, tag_type='user'):
+    """
+    批量为图片添加标签
+    
+    所有标签名一次解析（缺失的批量创建），关联记录用一条 INSERT 写入，已有的关联跳过。
+    bulk_create 不触发 ImageTag 信号，这里同步维护标签计数和全文索引，只计入实际插入的关联：
+    INSERT 与并发写入的关联冲突时整条回滚，重新查询已有关联后再插入其余的。
+    
+    Args:
+        assignments: {Image: [标签名称, ...]}
+        tag_type: 新建标签的类型
+    
+    Returns:
+        list: 新添加的 (Image, Tag) 列表
+    """
+    from django.db import IntegrityError, transaction
+    from apps.tags.models import Tag, adjust_tag_usage
+    from .search import index_images
+    
+    assignments = {image: names for image, names in assignments.items() if names}
+    if not assignments:
+        return []
+    
+    with transaction.atomic():
+        tags = Tag.get_or_create_tags(
+            [name for names in assignments.values() for name in names], tag_type=tag_type
+        )
+        existing = set(
+            ImageTag.objects.filter(image__in=list(assignments), tag__in=list(tags.values()))
+            .values_list('image_id', 'tag_id')
+        )
+        added = []
+        for image, names in assignments.items():
+            for name in names:
+                tag = tags.get(name.strip().lower()) if name else None
+                if tag is None or (image.id, tag.id) in existing:
+                    continue
+                existing.add((image.id, tag.id))
+                added.append((image, tag))
+        for attempt in range(3):
+            if not added:
+                return []
+            try:
+                with transaction.atomic():
+                    ImageTag.objects.bulk_create([ImageTag(image=image, tag=tag) for image, tag in added])
+                break
+            except IntegrityError:
+                if attempt == 2:
+                    raise
+                # 其他请求同时添加了部分关联，去掉这些关联后重试
+                existing = set(
+                    ImageTag.objects.filter(
+                        image__in={image for image, _ in added}, tag__in={tag for _, tag in added}
+                    ).values_list('image_id', 'tag_id')
+                )
+                added = [(image, tag) for image, tag in added if (image.id, tag.id) not in existing]
+        
+        adjust_tag_usage(
+            [(tag.id, image.owner_id) for image, tag in added], +1,
+            public=any(image.is_public for image, _ in added)
+        )
+        index_images({image.id for image, tag in added})
+    return added
+
+
+class ImageBlob(models.Model):
+    """按内容哈希去重存储的原图文件，多个 Image 可共享同一个 blob"""
+    
+    content_hash = models.CharField(
+        max_length=64,
+        unique=True,
+        verbose_name='内容哈希(SHA-256)'
+    )
+    file_path = models.CharField(
+        max_length=255,
+        db_index=True,
+        verbose_name='文件路径'
+    )
+    thumbnail_path = models.CharField(
+        max_length=255,
+        blank=True,
+        default='',
+        db_index=True,
+        verbose_name='缩略图路径'
+    )
+    renditions = models.JSONField(
+        default=list,
+        blank=True,
+        verbose_name='多尺寸图片'
+    )
+    size = models.PositiveIntegerField(
+        verbose_name='文件大小(字节)'
+    )
+    ref_count = models.PositiveIntegerField(
+        default=0,
+        verbose_name='引用计数'
+    )
+    # 解析后的 EXIF（JSON 格式），相同内容的图片直接复用
+    exif_data = models.JSONField(
+        null=True,
+        blank=True,
+        verbose_name='EXIF 数据'
+    )
+    created_at = models.DateTimeField(
+        auto_now_add=True,
+        verbose_name='创建时间'
+    )
+    
+    class Meta:
+        db_table = 'image_blobs'
+        verbose_name = '图片存储文件'
+        verbose_name_plural = '图片存储文件'
+    
+    def __str__(self):
+        return f"{self.content_hash[:12]} (引用 {self.ref_count})"
+
+
+class UploadSession(models.Model):
+    """分块续传会话"""
+    
+    id = models.UUIDField(
+        primary_key=True,
+        default=uuid.uuid4,
+        editable=False
+    )
+    owner = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name='upload_sessions',
+        verbose_name='上传者'
+    )
+    filename = models.CharField(
+        max_length=255,
+        verbose_name='原始文件名'
+    )
+    total_size = models.PositiveBigIntegerField(
+        verbose_name='文件总大小(字节)'
+    )
+    received_size = models.PositiveBigIntegerField(
+        default=0,
+        verbose_name='已接收字节数'
+    )
+    is_public = models.BooleanField(
+        default=False,
+        verbose_name='是否公开'
+    )
+    description = models.TextField(
+        blank=True,
+        default='',
+        verbose_name='描述'
+    )
+    tags = models.JSONField(
+        default=list,
+        blank=True,
+        verbose_name='标签'
+    )
+    image = models.ForeignKey(
+        Image,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='+',
+        verbose_name='生成的图片'
+    )
+    created_at = models.DateTimeField(
+        auto_now_add=True,
+        verbose_name='创建时间'
+    )
+    updated_at = models.DateTimeField(
+        auto_now=True,
+        verbose_name='更新时间'
+    )
+    
+    class Meta:
+        db_table = 'upload_sessions'
+        ordering = ['-created_at']
+        verbose_name = '分块上传会话'
+        verbose_name_plural = '分块上传会话'
+    
+    def __str__(self):
+        return f"{self.filename} ({self.received_size}/{self.total_size})"
+    
+    @property
+    def temp_path(self):
+        """临时文件路径"""
+        from .uploads import chunked_upload_path
+        return chunked_upload_path(self.id)
+    
+    @property
+    def is_complete(self):
+        return self.received_size >= self.total_size
+
+
+class ImageStats(models.Model):
+    """
+    图片统计计数（冗余计数）
+    
+    每个用户一行，owner 为空的一行为全站合计；由 Image 信号维护，
+    reconcile_image_stats 定期按 images 表校正
+    """
+    
+    owner = models.OneToOneField(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+        related_name='image_stats',
+        verbose_name='用户'
+    )
+    image_count = models.PositiveIntegerField(
+        default=0,
+        verbose_name='图片数量'
+    )
+    public_count = models.PositiveIntegerField(
+        default=0,
+        verbose_name='公开图片数量'
+    )
+    total_size = models.PositiveBigIntegerField(
+        default=0,
+        verbose_name='占用空间(字节)'
+    )
+    
+    class Meta:
+        db_table = 'image_stats'
+        verbose_name = '图片统计'
+        verbose_name_plural = '图片统计'
+        indexes = [
+            models.Index(fields=['-image_count'], name='image_stats_count_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.owner_id or '全站'}: {self.image_count}"
+    
+    @property
+    def private_count(self):
+        return self.image_count - self.public_count
+
+
+class VisionResult(models.Model):
+    """
+    Vision AI 分析结果缓存
+    
+    按图片内容哈希和模型保存，内容相同的图片不再重复发送给 Vision API
+    """
+    
+    content_hash = models.CharField(
+        max_length=64,
+        verbose_name='内容哈希(SHA-256)'
+    )
+    model = models.CharField(
+        max_length=100,
+        verbose_name='模型'
+    )
+    description = models.TextField(
+        blank=True,
+        default='',
+        verbose_name='描述'
+    )
+    tags = models.JSONField(
+        default=list,
+        blank=True,
+        verbose_name='标签'
+    )
+    created_at = models.DateTimeField(
+        auto_now_add=True,
+        verbose_name='创建时间'
+    )
+    
+    class Meta:
+        db_table = 'vision_results'
+        verbose_name = 'AI 分析结果'
+        verbose_name_plural = 'AI 分析结果'
+        constraints = [
+            models.UniqueConstraint(fields=['content_hash', 'model'], name='vision_result_hash_model_uniq'),
+        ]
+    
+    def __str__(self):
+        return f"{self.content_hash[:12]} ({self.model})"
+
+
+class AIBatch(models.Model):
+    """批量 AI 分析任务"""
+    
+    STATUS_CHOICES = [
+        ('running', '进行中'),
+        ('completed', '已完成'),
+        ('cancelled', '已取消'),
+    ]
+    
+    owner = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name='ai_batches',
+        verbose_name='所有者'
+    )
+    status = models.CharField(
+        max_length=20,
+        choices=STATUS_CHOICES,
+        default='running',
+        verbose_name='状态'
+    )
+    created_at = models.DateTimeField(
+        auto_now_add=True,
+        verbose_name='创建时间'
+    )
+    updated_at = models.DateTimeField(
+        auto_now=True,
+        verbose_name='更新时间'
+    )
+    
+    class Meta:
+        db_table = 'ai_batches'
+        ordering = ['-created_at']
+        verbose_name = '批量 AI 分析'
+        verbose_name_plural = '批量 AI 分析'
+        indexes = [
+            models.Index(fields=['status', 'updated_at'], name='ai_batch_status_idx'),
+        ]
+    
+    def __str__(self):
+        return f"批量 AI 分析 {self.id} ({self.status})"
+
+
+class AIBatchItem(models.Model):
+    """批量 AI 分析中的一张图片"""
+    
+    STATUS_CHOICES = [
+        ('pending', '待处理'),
+        ('success', '已完成'),
+        ('cached', '使用缓存结果'),
+        ('failed', '失败'),
+    ]
+    
+    batch = models.ForeignKey(
+        AIBatch,
+        on_delete=models.CASCADE,
+        related_name='items',
+        verbose_name='批次'
+    )
+    image = models.ForeignKey(
+        Image,
+        on_delete=models.CASCADE,
+        related_name='+',
+        verbose_name='图片'
+    )
+    status = models.CharField(
+        max_length=20,
+        choices=STATUS_CHOICES,
+        default='pending',
+        verbose_name='状态'
+    )
+    attempts = models.PositiveSmallIntegerField(
+        default=0,
+        verbose_name='请求次数'
+    )
+    detail = models.CharField(
+        max_length=255,
+        blank=True,
+        default='',
+        verbose_name='失败原因'
+    )
+    
+    class Meta:
+        db_table = 'ai_batch_items'
+        verbose_name = '批量 AI 分析项'
+        verbose_name_plural = '批量 AI 分析项'
+        constraints = [
+            models.UniqueConstraint(fields=['batch', 'image'], name='ai_batch_item_uniq'),
+        ]
+        indexes = [
+            models.Index(fields=['batch', 'status'], name='ai_batch_item_status_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.batch_id}/{self.image_id} ({self.status})"
+
+
+# 影响全文索引内容的字段
+SEARCH_INDEX_FIELDS = {'filename', 'description', 'exif_camera_make', 'exif_camera_model'}
+
+
+def _deletion_model(origin):
+    """返回触发删除的模型类（origin 可能是实例或查询集）"""
+    return getattr(origin, 'model', type(origin))
+
+
+# 删除图片（含级联）时收集的计数变化，见 collect_deleted_image
+_deleting = threading.local()
+
+
+def _deletion_state(origin):
+    """当前删除操作的收集状态；origin 不同说明是新的删除操作"""
+    if not hasattr(_deleting, 'images') or _deleting.origin is not origin:
+        _deleting.origin = origin
+        _deleting.images = {}
+        _deleting.image_tags = set()
+    return _deleting
+
+
+@receiver(post_save, sender=Image)
+def update_image_search_index(sender, instance, update_fields=None, raw=False, **kwargs):
+    """可检索字段变化时更新全文索引"""
+    if raw:
+        return
+    if update_fields is not None and not SEARCH_INDEX_FIELDS.intersection(update_fields):
+        return
+    from .search import get_search_backend
+    get_search_backend().index([instance])
+
+
+@receiver(post_delete, sender=Image)
+def release_image_files(sender, instance, **kwargs):
+    """删除图片后释放存储：共享 blob 减少引用计数，旧数据直接删除文件"""
+    from .blobs import delete_files_on_commit, release_blob
+    from .renditions import rendition_paths
+    if instance.blob_id:
+        release_blob(instance.blob_id)
+    else:
+        delete_files_on_commit(
+            [instance.file.name, instance.thumbnail.name] + rendition_paths(instance.renditions)
+        )
+
+
+@receiver(pre_save, sender=Image)
+def remember_image_stats_state(sender, instance, update_fields=None, raw=False, **kwargs):
+    """记录保存前影响统计的字段值，用于计算增量"""
+    from .stats import STATS_FIELDS
+    
+    instance._stats_previous = None
+    if raw or instance.pk is None or instance._state.adding:
+        return
+    if update_fields is not None and not {'owner', 'owner_id', 'is_public', 'size'} & set(update_fields):
+        return
+    previous = Image.objects.filter(pk=instance.pk).values_list(*STATS_FIELDS).first()
+    if previous is not None:
+        instance._stats_previous = (previous[0], previous[1], previous[2] or 0)
+
+
+@receiver(post_save, sender=Image)
+def update_image_stats(sender, instance, created, raw=False, **kwargs):
+    """创建图片或修改所有者、公开状态、大小后更新统计计数"""
+    from .stats import adjust_image_stats, image_stats_state, stats_changes
+    
+    if raw:
+        return
+    if created:
+        adjust_image_stats(stats_changes(None, image_stats_state(instance)))
+        return
+    previous = getattr(instance, '_stats_previous', None)
+    current = image_stats_state(instance)
+    if previous is not None and previous != current:
+        adjust_image_stats(stats_changes(previous, current))
+
+
+@receiver(pre_delete, sender=ImageTag)
+def collect_deleted_image_tag(sender, instance, origin=None, **kwargs):
+    """随图片（或用户）级联删除的标签关联先记录下来，计数在图片删除后一起调整"""
+    if origin is None or _deletion_model(origin)._meta.label in ('images.ImageTag', 'tags.Tag'):
+        return
+    _deletion_state(origin).image_tags.add((instance.tag_id, instance.image_id))
+
+
+@receiver(pre_delete, sender=Image)
+def collect_deleted_image(sender, instance, origin=None, **kwargs):
+    """记录将被删除的图片（Collector 先发送全部 pre_delete，再逐个删除并发送 post_delete）"""
+    from .stats import image_stats_state
+    _deletion_state(origin).images[instance.id] = image_stats_state(instance)
+
+
+@receiver(post_delete, sender=Image)
+def apply_deleted_image_counters(sender, instance, origin=None, **kwargs):
+    """
+    本次删除的第一个 post_delete 时一次调整标签计数和图片统计
+
+    级联删除的 ImageTag 信号不再逐条查询所有者、更新计数，统计计数也不再逐张更新
+    """
+    from apps.tags.models import adjust_tag_usage
+    from .stats import adjust_image_stats, stats_changes
+    
+    state = _deletion_state(origin)
+    image_tags, images = state.image_tags, state.images
+    if not images:
+        return
+    state.image_tags, state.images = set(), {}
+    adjust_tag_usage(
+        [(tag_id, images[image_id][0]) for tag_id, image_id in image_tags if image_id in images], -1,
+        public=any(images[image_id][1] for _, image_id in image_tags if image_id in images)
+    )
+    adjust_image_stats([change for before in images.values() for change in stats_changes(before, None)])
+
+
+@receiver(post_save, sender=Image)
+@receiver(post_delete, sender=Image)
+def touch_image_watermarks(sender, instance, raw=False, **kwargs):
+    """图片变化后推进所有者（含原所有者）和公开图片的列表水位线"""
+    from .watermarks import image_scopes, touch_watermarks
+    
+    if raw:
+        return
+    states = [(instance.owner_id, instance.is_public)]
+    previous = getattr(instance, '_stats_previous', None)
+    if previous is not None:
+        states.append(previous[:2])
+    touch_watermarks(image_scopes(states))
+
+
+@receiver(post_delete, sender=Image)
+def remove_image_search_index(sender, instance, **kwargs):
+    """删除图片时移除索引"""
+    from .search import remove_images
+    remove_images([instance.id])
+
+
+@receiver(post_save, sender=ImageTag)
+@receiver(post_delete, sender=ImageTag)
+def update_image_tags_search_index(sender, instance, origin=None, raw=False, **kwargs):
+    """图片标签变化时更新索引；随图片一起级联删除时跳过"""
+    if raw:
+        return
+    if origin is not None and _deletion_model(origin)._meta.label not in ('images.ImageTag', 'tags.Tag'):
+        return
+    from .search import index_images
+    index_images([instance.image_id])
+
+
+@receiver(pre_save, sender='tags.Tag')
+def remember_tag_name(sender, instance, update_fields=None, raw=False, **kwargs):
+    """记录保存前的标签名称，用于判断是否改名"""
+    instance._previous_name = None
+    if raw or instance.pk is None or instance._state.adding:
+        return
+    if update_fields is not None and 'name' not in update_fields:
+        return
+    instance._previous_name = sender.objects.filter(pk=instance.pk).values_list('name', flat=True).first()
+
+
+@receiver(post_save, sender='tags.Tag')
+def update_renamed_tag_search_index(sender, instance, created, raw=False, **kwargs):
+    """标签改名后在后台更新使用该标签的图片索引（只改颜色等不影响索引）"""
+    if created or raw:
+        return
+    previous = getattr(instance, '_previous_name', None)
+    if previous is None or previous == instance.name:
+        return
+    from django.db import transaction
+    from .search import schedule_tag_reindex
+    tag_id = instance.pk
+    transaction.on_commit(lambda: schedule_tag_reindex(tag_id))
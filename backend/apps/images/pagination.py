@@ -0,0 +1,178 @@
+"""
+图片列表分页
+
+基于 (排序字段, id) 的键集（游标）分页：
+- 游标为不透明的 base64 字符串，编码上一页最后一行的排序键
+- 每页只查询 page_size + 1 行，翻页深度不影响查询代价
+- 可见性查询（自己的图片 OR 公开图片）默认作为单条 OR 查询执行；
+  IMAGE_VISIBILITY_MERGE 为 True 时拆成两个分支分别按索引顺序取 page_size + 1 行，
+  在 Python 中归并。100 万张图片的基准测试（benchmark_visibility）中单条查询更快，
+  归并只留给实测 OR 查询退化为全表扫描的数据库
+"""
+import base64
+import heapq
+import json
+
+from django.conf import settings
+from django.db.models import Q, prefetch_related_objects
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+class ImageKeysetPagination(BasePagination):
+    """
+    图片键集分页
+
+    仅在请求携带 cursor 或 page_size 参数时启用，
+    否则保持原来的不分页列表响应，兼容旧客户端。
+
+    支持的排序键：upload_time / size / filename / search_rank（可加 '-' 表示倒序），
+    均以 id 作为第二排序键保证游标稳定。
+    """
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+    default_ordering = '-upload_time'
+
+    # 排序字段 -> 游标值的 (编码, 解码) 函数
+    ORDERING_FIELDS = {
+        'upload_time': (lambda v: v.isoformat(), parse_datetime),
+        'size': (int, int),
+        'filename': (str, str),
+        # 全文检索相关度（见 search.search_images）
+        'search_rank': (float, float),
+    }
+
+    # 可以在 Python 中归并的排序字段（filename 的排序规则依赖数据库，不归并）
+    MERGE_FIELDS = {'upload_time', 'size', 'search_rank'}
+
+    invalid_cursor_message = '无效的游标'
+
+    def __init__(self):
+        self.page_size = getattr(settings, 'IMAGE_PAGE_SIZE', 30)
+        self.max_page_size = getattr(settings, 'IMAGE_MAX_PAGE_SIZE', 100)
+        self.next_cursor = None
+
+    def paginate_queryset(self, queryset, request, view=None):
+        params = request.query_params
+        if self.cursor_query_param not in params and self.page_size_query_param not in params:
+            return None
+
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        ordering = self.get_ordering(queryset)
+        field = ordering.lstrip('-')
+        descending = ordering.startswith('-')
+
+        queryset = queryset.order_by(ordering, '-id' if descending else 'id')
+
+        cursor = self.decode_cursor(request, ordering)
+        if cursor is not None:
+            value, pk = cursor
+            lookup = 'lt' if descending else 'gt'
+            queryset = queryset.filter(
+                Q(**{f'{field}__{lookup}': value}) |
+                Q(**{field: value, f'id__{lookup}': pk})
+            )
+
+        # 多取一行用于判断是否还有下一页
+        branches = None
+        if getattr(settings, 'IMAGE_VISIBILITY_MERGE', False) and field in self.MERGE_FIELDS:
+            branches = queryset.visibility_branches()
+        if branches:
+            results = self.merge_branches(queryset, branches, field, descending)
+        else:
+            results = list(queryset[:self.page_size + 1])
+        if len(results) > self.page_size:
+            results = results[:self.page_size]
+            last = results[-1]
+            self.next_cursor = self.encode_cursor(ordering, getattr(last, field), last.id)
+        else:
+            self.next_cursor = None
+        return results
+
+    def merge_branches(self, queryset, branches, field, descending):
+        """
+        分别查询互不重叠的各分支并按 (排序字段, id) 归并
+
+        每个分支最多取 page_size + 1 行，预取在归并后对本页结果统一执行一次
+        """
+        limit = self.page_size + 1
+        rows = [list(branch.prefetch_related(None)[:limit]) for branch in branches]
+        merged = heapq.merge(
+            *rows, key=lambda image: (getattr(image, field), image.id), reverse=descending
+        )
+        results = list(merged)[:limit]
+        lookups = queryset._prefetch_related_lookups
+        if lookups:
+            prefetch_related_objects(results, *lookups)
+        return results
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'next_cursor': self.next_cursor,
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'next_cursor': {'type': 'string', 'nullable': True},
+                'results': schema,
+            },
+        }
+
+    def get_next_link(self):
+        if self.next_cursor is None:
+            return None
+        url = self.request.build_absolute_uri()
+        url = replace_query_param(url, self.page_size_query_param, self.page_size)
+        return replace_query_param(url, self.cursor_query_param, self.next_cursor)
+
+    def get_page_size(self, request):
+        """读取 page_size 参数，限制在 [1, max_page_size]"""
+        try:
+            size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return max(1, min(size, self.max_page_size))
+
+    def get_ordering(self, queryset):
+        """取查询集的第一个排序字段，不支持的排序退回默认值"""
+        ordering = queryset.query.order_by or queryset.model._meta.ordering
+        first = ordering[0] if ordering else self.default_ordering
+        if isinstance(first, str) and first.lstrip('-') in self.ORDERING_FIELDS:
+            return first
+        return self.default_ordering
+
+    def encode_cursor(self, ordering, value, pk):
+        """将排序键编码为不透明游标"""
+        encode, _ = self.ORDERING_FIELDS[ordering.lstrip('-')]
+        payload = json.dumps({'o': ordering, 'v': encode(value), 'id': pk}, separators=(',', ':'))
+        return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii').rstrip('=')
+
+    def decode_cursor(self, request, ordering):
+        """解析游标，返回 (排序字段值, id)；无游标时返回 None"""
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            padded = encoded + '=' * (-len(encoded) % 4)
+            payload = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')).decode('utf-8'))
+            # 排序方式变化后旧游标失效
+            if payload['o'] != ordering:
+                raise ValueError('ordering mismatch')
+            _, decode = self.ORDERING_FIELDS[ordering.lstrip('-')]
+            value = decode(payload['v'])
+            pk = int(payload['id'])
+        except (TypeError, ValueError, KeyError, UnicodeDecodeError):
+            raise NotFound(self.invalid_cursor_message)
+        if value is None:
+            raise NotFound(self.invalid_cursor_message)
+        return value, pk
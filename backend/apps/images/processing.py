@@ -0,0 +1,277 @@
+"""
+图片处理上下文与批量处理
+
+一次处理任务中缩略图、多尺寸图片和 EXIF 解析共用同一份数据：
+- 原图字节只从存储读取一次
+- PIL 只解析一次文件头（尺寸、方向），并复用于解码
+- EXIF 只解析一次
+各阶段耗时记录在 timings 中（毫秒），随任务结果返回
+
+批量处理：上传后图片保持 pending 状态，schedule_image_processing 在合并窗口内
+只投递一次 process_pending_images 任务。任务在线程池中并行生成文件
+（Pillow 解码、缩放、编码时释放 GIL），再按批用 bulk_update / bulk_create 写回数据库。
+一批处理出错时该批图片标记为失败；worker 中断后停留在 processing 超过
+IMAGE_PROCESSING_TIMEOUT 的图片由定期任务重新认领（见 reclaim_stale_processing）。
+"""
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import timedelta
+from io import BytesIO
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+from PIL import Image as PILImage
+
+logger = logging.getLogger(__name__)
+
+# 合并投递标记的缓存键
+BATCH_SCHEDULED_KEY = 'images:batch-processing-scheduled'
+# 批处理写回数据库的图片字段
+BATCH_UPDATE_FIELDS = ['thumbnail', 'renditions', 'thumbnail_generated', 'processing_status']
+
+
+class ImageProcessingContext:
+    """单张图片的处理上下文"""
+
+    def __init__(self, image):
+        self.image = image
+        self.timings = {}
+        self._data = None
+        self._header = None
+        self._size = None
+        self._exif_data = None
+
+    @contextmanager
+    def stage(self, name):
+        """记录一个阶段的耗时，同名阶段累加"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = (time.perf_counter() - start) * 1000
+            self.timings[name] = round(self.timings.get(name, 0) + elapsed, 2)
+
+    @property
+    def data(self):
+        """原图字节（首次访问时从存储读取）"""
+        if self._data is None:
+            with self.stage('read'):
+                with self.image.file.open('rb') as f:
+                    self._data = f.read()
+        return self._data
+
+    def source(self):
+        """基于原图字节的新文件对象"""
+        return BytesIO(self.data)
+
+    def open_header(self):
+        """打开原图并解析文件头（不解码像素）"""
+        if self._header is None:
+            with self.stage('header'):
+                self._header = PILImage.open(self.source())
+                self._size = self._header.size
+        return self._header
+
+    @property
+    def size(self):
+        """原图尺寸 (width, height)"""
+        if self._size is None:
+            try:
+                self.open_header()
+            except Exception:
+                self._size = (None, None)
+        return self._size
+
+    def decode(self, thumb_size):
+        """
+        解码为 RGB 图片（复用已解析的文件头）
+
+        解码会修改打开的图片对象（draft），解码后不再复用该对象
+        """
+        from .renditions import decode_image
+
+        header = self.open_header()
+        self._header = None
+        with self.stage('decode'):
+            return decode_image(header, thumb_size)
+
+    @property
+    def exif_data(self):
+        """解析后的 EXIF 数据（尺寸取自已解析的文件头）"""
+        if self._exif_data is None:
+            from .exif_utils import parse_exif
+
+            size = self.size
+            with self.stage('exif'):
+                self._exif_data = parse_exif(self.source(), size=size)
+        return self._exif_data
+
+
+def schedule_image_processing():
+    """
+    合并投递图片处理任务
+
+    待处理的图片以 pending 状态保存在数据库中，合并窗口内的多次上传只投递一次批处理任务
+    """
+    from .tasks import process_pending_images
+
+    window = getattr(settings, 'IMAGE_BATCH_WINDOW', 2)
+    if cache.add(BATCH_SCHEDULED_KEY, True, timeout=window):
+        process_pending_images.apply_async(countdown=window)
+
+
+def reclaim_stale_processing():
+    """
+    将处理超时的图片重新设为 pending（处理任务所在的 worker 中断）
+
+    Returns:
+        int: 重新设为 pending 的图片数
+    """
+    from .models import Image
+
+    timeout = getattr(settings, 'IMAGE_PROCESSING_TIMEOUT', 30 * 60)
+    deadline = timezone.now() - timedelta(seconds=timeout)
+    return Image.objects.filter(
+        Q(processing_started_at__lt=deadline) | Q(processing_started_at__isnull=True),
+        processing_status='processing',
+    ).update(processing_status='pending', processing_started_at=None)
+
+
+def compute_outputs(image, need_thumbnail, need_exif):
+    """
+    生成缩略图、多尺寸图片并解析 EXIF（线程池中执行，只访问存储，不访问数据库）
+
+    Returns:
+        dict: thumbnail、renditions、exif、timings、error
+    """
+    from .tasks import render_thumbnail
+
+    context = ImageProcessingContext(image)
+    result = {'thumbnail': None, 'renditions': None, 'exif': None, 'error': None}
+    try:
+        if need_thumbnail:
+            result['thumbnail'], result['renditions'] = render_thumbnail(image, context)
+        if need_exif:
+            result['exif'] = context.exif_data
+    except Exception as e:
+        logger.error(f"批量处理图片失败 (ID={image.id}): {e}")
+        result['error'] = str(e)
+    result['timings'] = context.timings
+    return result
+
+
+def process_image_batch(image_ids):
+    """
+    批量处理图片
+
+    内容相同的图片（共享 blob）只处理一次；每批图片在一个事务中写回，
+    自动标签用 bulk_create 创建，并手动维护标签计数和全文索引
+
+    Returns:
+        dict: 完成和失败的图片 ID，以及各阶段的累计耗时（毫秒）
+    """
+    from .models import Image
+
+    workers = getattr(settings, 'IMAGE_BATCH_WORKERS', 4)
+    write_size = getattr(settings, 'IMAGE_BATCH_WRITE_SIZE', 100)
+    image_ids = list(image_ids)
+    Image.objects.filter(id__in=image_ids).update(
+        processing_status='processing', processing_started_at=timezone.now()
+    )
+    images = list(Image.objects.filter(id__in=image_ids).select_related('blob').order_by('id'))
+
+    completed, failed = [], []
+    timings = {}
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for start in range(0, len(images), write_size):
+            chunk = images[start:start + write_size]
+            try:
+                jobs = {}
+                for image in chunk:
+                    key = output_key(image)
+                    if key in jobs:
+                        continue
+                    blob = image.blob
+                    need_thumbnail = not (blob and blob.thumbnail_path)
+                    need_exif = not (blob and blob.exif_data is not None)
+                    jobs[key] = pool.submit(compute_outputs, image, need_thumbnail, need_exif)
+                results = {key: future.result() for key, future in jobs.items()}
+                for result in results.values():
+                    for name, elapsed in result['timings'].items():
+                        timings[name] = round(timings.get(name, 0) + elapsed, 2)
+
+                start_write = time.perf_counter()
+                with transaction.atomic():
+                    done, errors = write_batch_results(chunk, results)
+                timings['write'] = round(timings.get('write', 0) + (time.perf_counter() - start_write) * 1000, 2)
+            except Exception as e:
+                # 该批图片不再停留在 processing 状态，其余批次继续处理
+                logger.exception(f"批量处理写回失败，{len(chunk)} 张图片标记为失败: {e}")
+                done, errors = [], [image.id for image in chunk]
+                Image.objects.filter(id__in=errors).update(processing_status='failed')
+            completed.extend(done)
+            failed.extend(errors)
+
+    return {'completed': completed, 'failed': failed, 'timings': timings}
+
+
+def output_key(image):
+    """同一 blob 的图片共用处理结果"""
+    return ('blob', image.blob_id) if image.blob_id else ('image', image.id)
+
+
+def write_batch_results(images, results):
+    """将一批处理结果写回数据库（调用方负责事务）"""
+    from .blobs import delete_files_on_commit
+    from .exif_utils import EXIF_FIELDS, exif_from_json, exif_to_json, generate_auto_tags, set_exif_fields
+    from .models import Image, ImageBlob, attach_tags
+    from .renditions import rendition_paths
+    from .search import index_images
+    from .watermarks import image_scopes, touch_watermarks
+
+    blobs = {}
+    auto_tags = {}
+    completed, failed = [], []
+    for image in images:
+        result = results[output_key(image)]
+        if result['error']:
+            image.processing_status = 'failed'
+            failed.append(image.id)
+            continue
+
+        blob = image.blob
+        thumbnail, renditions, exif_data = result['thumbnail'], result['renditions'], result['exif']
+        if blob:
+            # 新生成的结果记录到 blob，已有的结果直接复用
+            blob = blobs.setdefault(blob.pk, blob)
+            if thumbnail:
+                blob.thumbnail_path, blob.renditions = thumbnail, renditions
+            if exif_data is not None:
+                blob.exif_data = exif_to_json(exif_data)
+            thumbnail, renditions = blob.thumbnail_path, blob.renditions
+            exif_data = exif_from_json(blob.exif_data)
+        else:
+            delete_files_on_commit(rendition_paths(image.renditions))
+
+        image.thumbnail.name = thumbnail
+        image.renditions = renditions
+        image.thumbnail_generated = True
+        set_exif_fields(image, exif_data)
+        image.processing_status = 'completed'
+        auto_tags[image] = generate_auto_tags(exif_data, image)
+        completed.append(image.id)
+
+    Image.objects.bulk_update(images, BATCH_UPDATE_FIELDS + EXIF_FIELDS)
+    if blobs:
+        ImageBlob.objects.bulk_update(blobs.values(), ['thumbnail_path', 'renditions', 'exif_data'])
+
+    # 自动标签：所有图片的标签一次解析、一条 INSERT 写入
+    attach_tags(auto_tags, tag_type='auto')
+    transaction.on_commit(lambda: index_images(completed))
+    touch_watermarks(image_scopes((image.owner_id, image.is_public) for image in images))
+    return completed, failed
@@ -0,0 +1,206 @@
+"""
+响应式多尺寸图片（rendition）
+
+缩略图任务解码原图一次，按 IMAGE_RENDITION_WIDTHS 从大到小依次缩放，
+每个宽度输出 IMAGE_RENDITION_FORMATS 中 Pillow 支持的格式（WebP、AVIF）。
+
+解码时只解到输出需要的最大尺寸：JPEG 使用 draft() 在 DCT 阶段按 1/2、1/4、1/8 缩放，
+其他格式解码后先用 reduce() 整数倍降采样，最后再做高质量 LANCZOS 缩放。
+
+生成结果以列表形式保存在 Image.renditions（共享存储时同时保存在 ImageBlob.renditions）：
+    [{'width': 800, 'height': 600, 'format': 'webp', 'path': '...', 'size': 12345}, ...]
+"""
+import logging
+import math
+import os
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import default_storage
+from PIL import Image as PILImage, features
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_WIDTHS = (150, 300, 800, 1600)
+DEFAULT_FORMATS = ('avif', 'webp')
+DEFAULT_QUALITY = {'webp': 80, 'avif': 60}
+# Pillow 格式名与 features 检查名
+PIL_FORMATS = {'webp': 'WEBP', 'avif': 'AVIF'}
+# EXIF 方向标签及需要的旋转角度
+ORIENTATION_TAG = 0x0112
+ORIENTATION_ROTATIONS = {3: 180, 6: 270, 8: 90}
+
+
+def rendition_widths():
+    """配置的宽度阶梯（从大到小）"""
+    return sorted(set(getattr(settings, 'IMAGE_RENDITION_WIDTHS', DEFAULT_WIDTHS)), reverse=True)
+
+
+def rendition_formats():
+    """配置中当前 Pillow 支持编码的格式"""
+    formats = []
+    for fmt in getattr(settings, 'IMAGE_RENDITION_FORMATS', DEFAULT_FORMATS):
+        if fmt in PIL_FORMATS and features.check(fmt):
+            formats.append(fmt)
+    return formats
+
+
+def target_widths(original_width):
+    """
+    原图需要生成的宽度
+
+    不放大原图：大于原图宽度的档位只保留一个，使用原图宽度
+    """
+    widths = []
+    for width in rendition_widths():
+        width = min(width, original_width)
+        if width not in widths:
+            widths.append(width)
+    return widths
+
+
+def rendition_path(base_path, width, fmt):
+    """rendition 存储路径：renditions/{原图相对目录}/{文件名}_{宽度}w.{格式}"""
+    stem = os.path.splitext(base_path)[0]
+    return os.path.join('renditions', f'{stem}_{width}w.{fmt}')
+
+
+def decode_scale(width, height, thumb_size, renditions=True):
+    """
+    输出所需的最小解码比例（相对方向校正后的原图，不超过 1）
+
+    取最大一档 rendition 与缩略图中要求更高的一个；renditions 为 False 时只考虑 thumb_size
+    """
+    scale = min(thumb_size[0] / width, thumb_size[1] / height)
+    if renditions and rendition_formats():
+        scale = max(scale, min(max(rendition_widths()), width) / width)
+    return min(scale, 1.0)
+
+
+def decode_image(source, thumb_size, reduced=True, renditions=True):
+    """
+    解码原图为 RGB，供缩略图和各尺寸 rendition 共用
+
+    Args:
+        source: 可 seek 的文件对象，或已打开但未解码的 PIL 图片
+        thumb_size: 缩略图尺寸，决定所需的最小解码尺寸
+        reduced: 是否按输出尺寸降采样解码（基准测试时可关闭对比）
+        renditions: 解码尺寸是否需要满足最大一档 rendition
+
+    Returns:
+        PIL.Image: 已按 EXIF 方向校正的 RGB 图片
+    """
+    img = source if isinstance(source, PILImage.Image) else PILImage.open(source)
+    try:
+        orientation = img.getexif().get(ORIENTATION_TAG)
+    except Exception:
+        orientation = None
+    # 旋转 90° 时宽高互换
+    width, height = (img.height, img.width) if orientation in (6, 8) else img.size
+    scale = decode_scale(width, height, thumb_size, renditions)
+
+    if reduced and scale < 1:
+        if img.format == 'JPEG':
+            # 只在 DCT 阶段缩放，未解码前调用
+            img.draft('RGB', (math.ceil(img.width * scale), math.ceil(img.height * scale)))
+        else:
+            factor = int(1 / scale)
+            if factor >= 2:
+                if img.mode == 'P':
+                    img = img.convert('RGBA')
+                elif img.mode not in ('RGB', 'RGBA', 'L', 'LA'):
+                    img = img.convert('RGB')
+                img = img.reduce(factor)
+
+    # 保持 EXIF 方向信息
+    if orientation in ORIENTATION_ROTATIONS:
+        img = img.rotate(ORIENTATION_ROTATIONS[orientation], expand=True)
+
+    # 转换为 RGB（处理 RGBA 或其他模式），透明区域使用白色背景
+    if img.mode in ('RGBA', 'P', 'LA'):
+        background = PILImage.new('RGB', img.size, (255, 255, 255))
+        if img.mode == 'P':
+            img = img.convert('RGBA')
+        background.paste(img, mask=img.split()[-1])
+        img = background
+    elif img.mode != 'RGB':
+        img = img.convert('RGB')
+    return img
+
+
+def encode_renditions(img):
+    """
+    由已解码的 RGB 图片逐档缩放并编码
+
+    从最大宽度开始逐级缩放，每一档以上一档为输入
+
+    Yields:
+        tuple: (width, height, 格式, BytesIO)
+    """
+    formats = rendition_formats()
+    if not formats:
+        return
+    quality = {**DEFAULT_QUALITY, **getattr(settings, 'IMAGE_RENDITION_QUALITY', {})}
+
+    current = img
+    for width in target_widths(img.width):
+        if width != current.width:
+            height = max(1, round(current.height * width / current.width))
+            current = current.resize((width, height), PILImage.Resampling.LANCZOS)
+        for fmt in formats:
+            buffer = BytesIO()
+            current.save(buffer, format=PIL_FORMATS[fmt], quality=quality[fmt])
+            yield width, current.height, fmt, buffer
+
+
+def generate_renditions(img, base_path):
+    """
+    生成全部 rendition 并写入存储
+
+    Args:
+        img: decode_image() 返回的图片
+        base_path: 用于生成 rendition 路径的原图存储路径
+
+    Returns:
+        list: rendition 描述列表
+    """
+    renditions = []
+    for width, height, fmt, buffer in encode_renditions(img):
+        size = buffer.tell()
+        buffer.seek(0)
+        path = default_storage.save(
+            rendition_path(base_path, width, fmt), File(buffer, name=f'{width}w.{fmt}')
+        )
+        renditions.append({
+            'width': width,
+            'height': height,
+            'format': fmt,
+            'path': path,
+            'size': size,
+        })
+    renditions.sort(key=lambda item: (item['format'], item['width']))
+    return renditions
+
+
+def rendition_paths(renditions):
+    """rendition 列表中的文件路径"""
+    return [item['path'] for item in renditions or []]
+
+
+def build_srcset(renditions, build_url):
+    """
+    按格式组织 srcset
+
+    Returns:
+        dict: {格式: {'srcset': 'url 150w, url 300w', 'sources': [{'width', 'height', 'url'}]}}
+    """
+    result = {}
+    for item in renditions or []:
+        url = build_url(default_storage.url(item['path']))
+        entry = result.setdefault(item['format'], {'srcset': [], 'sources': []})
+        entry['srcset'].append(f"{url} {item['width']}w")
+        entry['sources'].append({'width': item['width'], 'height': item['height'], 'url': url})
+    for entry in result.values():
+        entry['srcset'] = ', '.join(entry['srcset'])
+    return result
@@ -0,0 +1,133 @@
+"""
+公开列表的共享响应缓存
+
+public 列表和首页随机图片的响应对所有访问者相同，序列化结果缓存在
+PUBLIC_RESPONSE_CACHE_ALIAS 指定的缓存中。缓存版本取自水位线，只有缓存由所有进程
+共享（CACHE_SHARED）时才启用；进程内存中的水位线看不到其他进程的写入，
+会一直返回旧版本，此时每次请求都直接生成响应。
+
+- 缓存键包含规范化后的查询参数、主机名，以及公开图片和标签的水位线（见 watermarks）
+- 公开图片创建、修改、打标签、设为私有或删除时水位线推进，缓存键随之变化，
+  旧版本不再被读取，等待过期淘汰，不需要逐个删除
+- 命中、未命中次数和耗时累计在默认缓存中（多进程共享），由 cache_stats 接口查看
+"""
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import cache, caches
+
+from .watermarks import PUBLIC_SCOPE, TAG_NAMES_SCOPE, get_watermarks
+
+RESPONSE_CACHE_PREFIX = 'public-response'
+METRICS_PREFIX = 'public-response-metrics'
+METRIC_FIELDS = ('hits', 'misses', 'hit_us', 'miss_us')
+
+
+def response_cache():
+    return caches[getattr(settings, 'PUBLIC_RESPONSE_CACHE_ALIAS', 'default')]
+
+
+def normalized_params(params, ignore=()):
+    """规范化查询参数：去掉空值和忽略的参数，按名称和值排序"""
+    items = []
+    for name in sorted(params.keys()):
+        if name in ignore:
+            continue
+        for value in sorted(params.getlist(name)):
+            if value != '':
+                items.append(f'{name}={value}')
+    return '&'.join(items)
+
+
+def response_cache_key(name, request, params=None):
+    """
+    生成缓存键
+
+    Args:
+        name: 缓存的接口名称
+        params: 规范化后的查询参数，默认取请求的全部查询参数
+    """
+    if params is None:
+        params = normalized_params(request.query_params)
+    version = '-'.join(repr(mark) for mark in get_watermarks([PUBLIC_SCOPE, TAG_NAMES_SCOPE]))
+    source = '|'.join([params, request.get_host(), request.META.get('HTTP_ACCEPT', '')])
+    digest = hashlib.md5(source.encode('utf-8')).hexdigest()
+    return f'{RESPONSE_CACHE_PREFIX}:{name}:{version}:{digest}'
+
+
+def cached_response_data(name, request, render, params=None, timeout=None):
+    """
+    读取缓存的响应数据，未命中时调用 render() 生成并写入
+
+    Args:
+        render: 返回可缓存（可 pickle）的响应数据的函数
+        timeout: 缓存时间（秒），默认 PUBLIC_RESPONSE_CACHE_TTL
+
+    Returns:
+        响应数据
+    """
+    if not getattr(settings, 'CACHE_SHARED', False):
+        return render()
+    start = time.perf_counter()
+    backend = response_cache()
+    key = response_cache_key(name, request, params)
+    data = backend.get(key)
+    hit = data is not None
+    if not hit:
+        data = render()
+        if timeout is None:
+            timeout = getattr(settings, 'PUBLIC_RESPONSE_CACHE_TTL', 300)
+        backend.set(key, data, timeout)
+    elapsed_us = int((time.perf_counter() - start) * 1_000_000)
+    record_metrics(name, hit, elapsed_us)
+    return data
+
+
+def _metric_key(name, field):
+    return f'{METRICS_PREFIX}:{name}:{field}'
+
+
+def _incr(key, delta):
+    try:
+        cache.incr(key, delta)
+    except ValueError:
+        if not cache.add(key, delta, timeout=None):
+            cache.incr(key, delta)
+
+
+def record_metrics(name, hit, elapsed_us):
+    """累计命中次数和耗时"""
+    if hit:
+        _incr(_metric_key(name, 'hits'), 1)
+        _incr(_metric_key(name, 'hit_us'), elapsed_us)
+    else:
+        _incr(_metric_key(name, 'misses'), 1)
+        _incr(_metric_key(name, 'miss_us'), elapsed_us)
+
+
+def response_cache_stats(names):
+    """
+    各接口的命中率和平均耗时
+
+    Returns:
+        dict: {接口名称: {'hits', 'misses', 'hit_rate', 'avg_hit_ms', 'avg_miss_ms'}}
+    """
+    keys = [_metric_key(name, field) for name in names for field in METRIC_FIELDS]
+    values = cache.get_many(keys)
+    result = {}
+    for name in names:
+        hits, misses, hit_us, miss_us = (values.get(_metric_key(name, field), 0) for field in METRIC_FIELDS)
+        total = hits + misses
+        result[name] = {
+            'hits': hits,
+            'misses': misses,
+            'hit_rate': round(hits / total, 4) if total else None,
+            'avg_hit_ms': round(hit_us / hits / 1000, 3) if hits else None,
+            'avg_miss_ms': round(miss_us / misses / 1000, 3) if misses else None,
+        }
+    return result
+
+
+def reset_response_cache_stats(names):
+    cache.delete_many([_metric_key(name, field) for name in names for field in METRIC_FIELDS])
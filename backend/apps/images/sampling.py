@@ -0,0 +1,89 @@
+"""
+公开图片随机抽样（首页轮播）
+
+不使用 ORDER BY RANDOM()（需要扫描并排序全部公开图片），而是在公开图片的 id 范围内随机取点，
+每个点用公开图片的 id 部分索引（images_public_id_idx）找到 id 不小于它的第一张公开图片，
+私有图片不在索引中，探测不会扫过它们；查询次数与 count 成正比，与图库大小无关。
+
+抽样不均匀：一张公开图片被抽中的概率与它之前（上一张公开图片之后）的 id 空缺成正比，
+空缺包括私有图片和已删除的图片。例如批量上传大量私有图片后的第一张公开图片，
+会在轮播中明显多于其他图片；每次请求内的结果仍然不重复。
+
+序列化后的响应存入公开列表响应缓存（见 response_cache，公开图片变化后失效），最多保留
+RANDOM_IMAGES_CACHE_TTL 秒；同一 count 保留 RANDOM_IMAGES_CACHE_VARIANTS 组不同的结果，
+每次请求随机返回其中一组，匿名访问首页的负载不随访问量和图库大小增长。
+"""
+import random
+
+from django.conf import settings
+
+
+def public_id_bounds():
+    """公开图片的最小和最大 id（沿主键顺序找到第一张公开图片即停止）"""
+    from .models import Image
+
+    public = Image.objects.filter(is_public=True)
+    low = public.order_by('id').values_list('id', flat=True).first()
+    if low is None:
+        return None
+    high = public.order_by('-id').values_list('id', flat=True).first()
+    return low, high
+
+
+def sample_public_ids(count, rng=random):
+    """
+    随机抽取最多 count 个不重复的公开图片 id
+
+    最多探测 3 * count 次；公开图片很少时探测结果重复，不足的部分按 id 顺序补齐
+    """
+    from .models import Image
+
+    bounds = public_id_bounds()
+    if bounds is None:
+        return []
+    low, high = bounds
+    public = Image.objects.filter(is_public=True)
+
+    ids = []
+    for _ in range(count * 3):
+        if len(ids) >= count:
+            break
+        probe = rng.randint(low, high)
+        found = public.filter(id__gte=probe).order_by('id').values_list('id', flat=True).first()
+        if found is not None and found not in ids:
+            ids.append(found)
+
+    if len(ids) < count:
+        ids.extend(
+            public.exclude(id__in=ids).order_by('id').values_list('id', flat=True)[:count - len(ids)]
+        )
+    return ids
+
+
+def random_images_count(value):
+    """解析 count 参数，限制在 [1, RANDOM_IMAGES_MAX_COUNT]"""
+    maximum = getattr(settings, 'RANDOM_IMAGES_MAX_COUNT', 20)
+    try:
+        count = int(value)
+    except (TypeError, ValueError):
+        count = 6
+    return max(1, min(count, maximum))
+
+
+def cached_random_response(count, request, build):
+    """
+    获取缓存的随机图片响应数据
+
+    Args:
+        count: 图片数量
+        request: 当前请求（缓存键包含主机名，序列化结果包含绝对 URL）
+        build: 未命中缓存时生成序列化数据的函数，参数为图片 id 列表
+    """
+    from .response_cache import cached_response_data
+
+    variants = getattr(settings, 'RANDOM_IMAGES_CACHE_VARIANTS', 4)
+    params = f'count={count}&variant={random.randrange(max(variants, 1))}'
+    return cached_response_data(
+        'random', request, lambda: build(sample_public_ids(count)), params=params,
+        timeout=getattr(settings, 'RANDOM_IMAGES_CACHE_TTL', 60),
+    )
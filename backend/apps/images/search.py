@@ -0,0 +1,307 @@
+"""
+图片全文检索
+
+索引内容：文件名、描述、标签名、相机品牌/型号
+- SQLite：FTS5 虚拟表 image_search_fts，rowid 即图片 ID，按 bm25 排序
+- PostgreSQL：image_search_documents 表中的加权 tsvector + GIN 索引，按 ts_rank 排序
+- 其他数据库：退化为 icontains 匹配
+
+中文没有空格分词，写入索引和查询前统一做 CJK 单字 + 双字切分，
+两个后端共用同一套分词结果。
+
+检索结果附带 search_rank 注解，值越小越相关。
+"""
+import logging
+import re
+
+from django.db import connection
+from django.db.models import FloatField, Q, Value
+from django.db.models.expressions import RawSQL
+
+# 各字段权重：文件名 > 标签 > 相机 ≈ 描述
+FIELD_WEIGHTS = {
+    'filename': 4.0,
+    'tags': 2.0,
+    'camera': 1.0,
+    'description': 1.0,
+}
+
+CJK_RUN = re.compile(r'[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uac00-\ud7af]+')
+WORD = re.compile(r'[^\W_]+')
+
+logger = logging.getLogger(__name__)
+
+
+def segment(text):
+    """
+    切分文本为检索词
+
+    CJK 连续字符输出单字和相邻双字，其余文字按字母数字切分并转小写
+    """
+    tokens = []
+    pos = 0
+    text = text or ''
+    for match in CJK_RUN.finditer(text):
+        tokens.extend(WORD.findall(text[pos:match.start()].lower()))
+        run = match.group()
+        tokens.extend(run)
+        tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+        pos = match.end()
+    tokens.extend(WORD.findall(text[pos:].lower()))
+    return tokens
+
+
+def query_terms(text):
+    """
+    切分查询文本，返回 (检索词, 是否前缀匹配) 列表
+
+    CJK 连续字符只取双字（单个字时取单字），非 CJK 词按前缀匹配
+    """
+    terms = []
+    pos = 0
+    text = text or ''
+    for match in CJK_RUN.finditer(text):
+        terms.extend((word, True) for word in WORD.findall(text[pos:match.start()].lower()))
+        run = match.group()
+        if len(run) == 1:
+            terms.append((run, False))
+        else:
+            terms.extend((run[i:i + 2], False) for i in range(len(run) - 1))
+        pos = match.end()
+    terms.extend((word, True) for word in WORD.findall(text[pos:].lower()))
+    # 去重并保持顺序
+    return list(dict.fromkeys(terms))
+
+
+def build_document(image, tag_names=None):
+    """
+    生成图片的索引文档（各字段为切分后以空格连接的文本）
+
+    Args:
+        image: Image 模型实例
+        tag_names: 标签名称列表，未提供时从数据库读取
+    """
+    if tag_names is None:
+        tag_names = [tag.name for tag in image.tags.all()]
+    camera = f'{image.exif_camera_make} {image.exif_camera_model}'
+    return {
+        'filename': ' '.join(segment(image.filename)),
+        'description': ' '.join(segment(image.description)),
+        'tags': ' '.join(segment(' '.join(tag_names))),
+        'camera': ' '.join(segment(camera)),
+    }
+
+
+class FallbackSearchBackend:
+    """不支持全文检索的数据库：使用 icontains 匹配"""
+
+    vendor = None
+
+    def setup(self, schema_editor):
+        pass
+
+    def teardown(self, schema_editor):
+        pass
+
+    def index(self, images):
+        pass
+
+    def remove(self, image_ids):
+        pass
+
+    def search(self, queryset, text):
+        return queryset.filter(
+            Q(filename__icontains=text) | Q(description__icontains=text)
+        ).annotate(search_rank=Value(0.0, output_field=FloatField()))
+
+
+class SQLiteSearchBackend(FallbackSearchBackend):
+    """SQLite FTS5 后端"""
+
+    vendor = 'sqlite'
+    table = 'image_search_fts'
+
+    def setup(self, schema_editor):
+        schema_editor.execute(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {self.table} USING fts5("
+            f"filename, description, tags, camera, "
+            f"tokenize='unicode61 remove_diacritics 2')"
+        )
+
+    def teardown(self, schema_editor):
+        schema_editor.execute(f'DROP TABLE IF EXISTS {self.table}')
+
+    def index(self, images):
+        rows = []
+        for image in images:
+            doc = build_document(image)
+            rows.append((image.id, doc['filename'], doc['description'], doc['tags'], doc['camera']))
+        if not rows:
+            return
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                f'DELETE FROM {self.table} WHERE rowid = %s', [(row[0],) for row in rows]
+            )
+            cursor.executemany(
+                f'INSERT INTO {self.table} (rowid, filename, description, tags, camera) '
+                f'VALUES (%s, %s, %s, %s, %s)',
+                rows
+            )
+
+    def remove(self, image_ids):
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                f'DELETE FROM {self.table} WHERE rowid = %s', [(pk,) for pk in image_ids]
+            )
+
+    def match_expression(self, text):
+        parts = []
+        for term, prefix in query_terms(text):
+            parts.append(f'"{term}"*' if prefix else f'"{term}"')
+        return ' '.join(parts)
+
+    def search(self, queryset, text):
+        expression = self.match_expression(text)
+        if not expression:
+            return queryset.none()
+        weights = ', '.join(
+            str(FIELD_WEIGHTS[field]) for field in ['filename', 'description', 'tags', 'camera']
+        )
+        table = queryset.model._meta.db_table
+        return queryset.filter(
+            id__in=RawSQL(f'SELECT rowid FROM {self.table} WHERE {self.table} MATCH %s', [expression])
+        ).annotate(search_rank=RawSQL(
+            f'(SELECT bm25({self.table}, {weights}) FROM {self.table} '
+            f'WHERE {self.table} MATCH %s AND rowid = {table}.id)',
+            [expression],
+            output_field=FloatField()
+        ))
+
+
+class PostgresSearchBackend(FallbackSearchBackend):
+    """PostgreSQL tsvector 后端"""
+
+    vendor = 'postgresql'
+    table = 'image_search_documents'
+    # ts_rank 的权重数组顺序为 {D, C, B, A}
+    WEIGHT_LABELS = {'filename': 'A', 'tags': 'B', 'camera': 'C', 'description': 'D'}
+
+    def setup(self, schema_editor):
+        schema_editor.execute(
+            f'CREATE TABLE IF NOT EXISTS {self.table} ('
+            f'image_id bigint PRIMARY KEY REFERENCES images(id) ON DELETE CASCADE, '
+            f'document tsvector NOT NULL)'
+        )
+        schema_editor.execute(
+            f'CREATE INDEX IF NOT EXISTS {self.table}_gin ON {self.table} USING GIN (document)'
+        )
+
+    def teardown(self, schema_editor):
+        schema_editor.execute(f'DROP TABLE IF EXISTS {self.table}')
+
+    def index(self, images):
+        vector = ' || '.join(
+            f"setweight(to_tsvector('simple', %s), '{label}')"
+            for label in self.WEIGHT_LABELS.values()
+        )
+        rows = []
+        for image in images:
+            doc = build_document(image)
+            rows.append([image.id] + [doc[field] for field in self.WEIGHT_LABELS])
+        if not rows:
+            return
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                f'INSERT INTO {self.table} (image_id, document) VALUES (%s, {vector}) '
+                f'ON CONFLICT (image_id) DO UPDATE SET document = EXCLUDED.document',
+                rows
+            )
+
+    def remove(self, image_ids):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {self.table} WHERE image_id = ANY(%s)', [list(image_ids)])
+
+    def tsquery(self, text):
+        return ' & '.join(
+            f'{term}:*' if prefix else term for term, prefix in query_terms(text)
+        )
+
+    def search(self, queryset, text):
+        query = self.tsquery(text)
+        if not query:
+            return queryset.none()
+        weights = '{' + ', '.join(
+            str(FIELD_WEIGHTS[field] / FIELD_WEIGHTS['filename'])
+            for field in ['description', 'camera', 'tags', 'filename']
+        ) + '}'
+        table = queryset.model._meta.db_table
+        return queryset.filter(
+            id__in=RawSQL(
+                f"SELECT image_id FROM {self.table} WHERE document @@ to_tsquery('simple', %s)",
+                [query]
+            )
+        ).annotate(search_rank=RawSQL(
+            # 取负值，使两个后端都是越小越相关
+            f"(SELECT -ts_rank('{weights}'::float4[], document, to_tsquery('simple', %s)) "
+            f"FROM {self.table} WHERE image_id = {table}.id)",
+            [query],
+            output_field=FloatField()
+        ))
+
+
+BACKENDS = {backend.vendor: backend for backend in [SQLiteSearchBackend, PostgresSearchBackend]}
+
+
+def get_search_backend(using_connection=None):
+    """根据数据库类型返回检索后端实例"""
+    vendor = (using_connection or connection).vendor
+    return BACKENDS.get(vendor, FallbackSearchBackend)()
+
+
+def search_images(queryset, text):
+    """
+    全文检索图片
+
+    Returns:
+        过滤后并附带 search_rank 注解、按相关度排序的查询集
+    """
+    return get_search_backend().search(queryset, text).order_by('search_rank', 'id')
+
+
+def index_images(image_ids):
+    """重建指定图片的索引文档"""
+    from .models import Image
+
+    images = Image.objects.filter(id__in=list(image_ids)).prefetch_related('tags')
+    get_search_backend().index(images)
+
+
+def index_tag_images(tag_id, batch_size=500):
+    """
+    分批重建使用该标签的图片索引（标签改名后）
+
+    Returns:
+        int: 重建的图片数
+    """
+    from .models import ImageTag
+
+    image_ids = list(ImageTag.objects.filter(tag_id=tag_id).order_by('image_id').values_list('image_id', flat=True))
+    for start in range(0, len(image_ids), batch_size):
+        index_images(image_ids[start:start + batch_size])
+    return len(image_ids)
+
+
+def schedule_tag_reindex(tag_id):
+    """投递标签改名后的重建索引任务，消息队列不可用时直接重建"""
+    from .tasks import reindex_tag_images_task
+
+    try:
+        reindex_tag_images_task.delay(tag_id)
+    except Exception as e:
+        logger.error(f"投递标签索引重建任务失败 (标签 ID={tag_id})，直接重建: {e}")
+        index_tag_images(tag_id)
+
+
+def remove_images(image_ids):
+    """从索引中移除图片"""
+    get_search_backend().remove(list(image_ids))
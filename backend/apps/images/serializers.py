@@ -1,5 +1,10 @@
+from django.conf import settings
+from django.db.models import Prefetch
 from rest_framework import serializers
-from .models import Image, ImageTag
+from .models import AIBatch, Image, ImageTag, UploadSession
+from .renditions import build_srcset
+from .uploads import create_uploaded_image, hash_file, sniff_image_size
+from apps.tags.models import Tag
 from apps.tags.serializers import TagSerializer
 
 
@@ -15,11 +20,62 @@ class ImageTagSerializer(serializers.ModelSerializer):
         read_only_fields = ['id', 'created_at']
 
 
-class ImageSerializer(serializers.ModelSerializer):
+def absolute_url_builder(request):
+    """
+    build_absolute_uri 的列表版本
+    
+    站点前缀只计算一次，以 / 开头的路径直接拼接，其他地址交给 build_absolute_uri
+    """
+    prefix = request.build_absolute_uri('/')[:-1]
+    
+    def build(location):
+        if location.startswith('/') and not location.startswith('//'):
+            return prefix + location
+        return request.build_absolute_uri(location)
+    return build
+
+
+class SparseFieldsetMixin:
+    """
+    稀疏字段集
+    
+    - ?fields=id,thumbnail_url：只输出指定字段
+    - ?omit=exif_info,tag_list：不输出指定字段
+    未知的字段名忽略；未输出的 SerializerMethodField 不会计算
+    """
+    
+    def get_fields(self):
+        fields = super().get_fields()
+        request = self.context.get('request')
+        if request is None:
+            return fields
+        only = split_field_names(request.query_params.get('fields'))
+        omit = split_field_names(request.query_params.get('omit'))
+        if only:
+            fields = {name: field for name, field in fields.items() if name in only}
+        for name in omit:
+            fields.pop(name, None)
+        return fields
+    
+    def build_url(self, location):
+        """生成绝对 URL（同一次序列化共用站点前缀）"""
+        request = self.context['request']
+        builder = self.context.get('_url_builder')
+        if builder is None:
+            builder = self.context['_url_builder'] = absolute_url_builder(request)
+        return builder(location)
+
+
+def split_field_names(value):
+    return {name.strip() for name in (value or '').split(',') if name.strip()}
+
+
+class ImageSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     """图片序列化器"""
     owner_username = serializers.CharField(source='owner.username', read_only=True)
     file_url = serializers.SerializerMethodField()
     thumbnail_url = serializers.SerializerMethodField()
+    renditions = serializers.SerializerMethodField()
     tags = TagSerializer(many=True, read_only=True)
     tag_list = serializers.SerializerMethodField()
     exif_info = serializers.SerializerMethodField()
@@ -27,7 +83,7 @@ class ImageSerializer(serializers.ModelSerializer):
     class Meta:
         model = Image
         fields = [
-            'id', 'filename', 'file', 'file_url', 'thumbnail_url',
+            'id', 'filename', 'file', 'file_url', 'thumbnail_url', 'renditions',
             'thumbnail_generated', 'processing_status', 'size', 
             'width', 'height', 'upload_time', 'is_public', 
             'description', 'owner', 'owner_username',
@@ -36,21 +92,38 @@ class ImageSerializer(serializers.ModelSerializer):
         ]
         read_only_fields = ['id', 'owner', 'size', 'width', 'height', 'upload_time', 'filename', 'exif_parsed', 'thumbnail_generated', 'processing_status']
     
+    @staticmethod
+    def setup_eager_loading(queryset):
+        """
+        预取序列化所需的关联数据
+
+        owner 通过 JOIN 获取，标签（含冗余的使用次数）通过一次预取查询获取，
+        列表序列化的查询数与图片数量无关
+        """
+        return queryset.select_related('owner').prefetch_related('tags')
+    
     def get_file_url(self, obj):
         """获取完整的文件URL"""
         request = self.context.get('request')
         if obj.file and request:
-            return request.build_absolute_uri(obj.file.url)
+            return self.build_url(obj.file.url)
         return None
     
     def get_thumbnail_url(self, obj):
         """获取缩略图URL"""
         request = self.context.get('request')
         if obj.thumbnail and obj.thumbnail_generated and request:
-            return request.build_absolute_uri(obj.thumbnail.url)
+            return self.build_url(obj.thumbnail.url)
         # 如果没有缩略图，返回原图URL作为备选
         return self.get_file_url(obj)
     
+    def get_renditions(self, obj):
+        """获取按格式分组的多尺寸图片（srcset 格式）"""
+        request = self.context.get('request')
+        if not request:
+            return {}
+        return build_srcset(obj.renditions, self.build_url)
+    
     def get_tag_list(self, obj):
         """获取标签名称列表"""
         return [tag.name for tag in obj.tags.all()]
@@ -72,6 +145,39 @@ class ImageSerializer(serializers.ModelSerializer):
         }
 
 
+class ImageCompactSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
+    """
+    图片列表的紧凑表示（缩略图网格）
+    
+    只包含 id、缩略图 URL、尺寸和标签 ID，通过 ?view=compact 启用
+    """
+    thumbnail_url = serializers.SerializerMethodField()
+    tag_ids = serializers.SerializerMethodField()
+    
+    class Meta:
+        model = Image
+        fields = ['id', 'thumbnail_url', 'width', 'height', 'tag_ids']
+        read_only_fields = fields
+    
+    @staticmethod
+    def setup_eager_loading(queryset):
+        """只预取标签 ID，不需要 owner"""
+        return queryset.prefetch_related(Prefetch('tags', queryset=Tag.objects.only('id')))
+    
+    def get_thumbnail_url(self, obj):
+        request = self.context.get('request')
+        if not request:
+            return None
+        if obj.thumbnail and obj.thumbnail_generated:
+            return self.build_url(obj.thumbnail.url)
+        if obj.file:
+            return self.build_url(obj.file.url)
+        return None
+    
+    def get_tag_ids(self, obj):
+        return [tag.id for tag in obj.tags.all()]
+
+
 class ImageUploadSerializer(serializers.ModelSerializer):
     """图片上传序列化器"""
     tags = serializers.ListField(
@@ -86,78 +192,126 @@ class ImageUploadSerializer(serializers.ModelSerializer):
     
     def validate_file(self, value):
         """验证上传的文件"""
-        # 检查文件扩展名
-        filename = value.name
-        ext = filename.split('.')[-1].lower()
-        
-        if ext not in Image.ALLOWED_EXTENSIONS:
-            raise serializers.ValidationError(
-                f"不支持的文件格式。允许的格式: {', '.join(Image.ALLOWED_EXTENSIONS)}"
-            )
-        
-        # 检查文件大小（最大 10MB）
-        max_size = 10 * 1024 * 1024
-        if value.size > max_size:
-            raise serializers.ValidationError(
-                f"文件大小超过限制。最大允许: {max_size // (1024 * 1024)}MB"
-            )
-        
+        validate_image_upload(value.name, value.size)
         return value
     
     def create(self, validated_data):
         """创建图片记录"""
         file = validated_data['file']
-        user_tags = validated_data.pop('tags', [])
         
-        # 获取图片尺寸
-        from PIL import Image as PILImage
-        try:
-            img = PILImage.open(file)
-            width, height = img.size
-        except Exception:
-            width, height = None, None
+        # 上传处理器已在接收时计算哈希并读取尺寸，这里只做兜底
+        content_hash = getattr(file, 'content_hash', None) or hash_file(file)
+        width, height = getattr(file, 'image_size', (None, None))
+        if width is None:
+            width, height = sniff_image_size(file)
         
-        # 重置文件指针
-        file.seek(0)
-        
-        image = Image.objects.create(
+        return create_uploaded_image(
             owner=validated_data['owner'],
             file=file,
             filename=file.name,
             size=file.size,
+            content_hash=content_hash,
             width=width,
             height=height,
             is_public=validated_data.get('is_public', False),
             description=validated_data.get('description', ''),
-            processing_status='pending'  # 初始状态为等待处理
+            tag_names=validated_data.get('tags', []),
         )
-        
-        # 添加用户指定的标签（同步处理，因为用户需要立即看到）
-        if user_tags:
-            from apps.tags.models import Tag
-            for tag_name in user_tags:
-                tag = Tag.get_or_create_tag(tag_name.strip(), tag_type='user')
-                if not ImageTag.objects.filter(image=image, tag=tag).exists():
-                    ImageTag.objects.create(image=image, tag=tag)
-        
-        # 触发异步处理任务（缩略图生成、EXIF解析、AI标注）
-        try:
-            from .tasks import process_image_async
-            process_image_async.delay(image.id)
-        except Exception as e:
-            # 如果 Celery 不可用，则同步处理作为降级方案
-            print(f"异步任务触发失败，使用同步处理: {e}")
-            from .exif_utils import apply_exif_to_image
-            try:
-                apply_exif_to_image(image)
-                image.processing_status = 'completed'
-                image.save(update_fields=['processing_status'])
-            except Exception as ex:
-                print(f"同步 EXIF 解析失败: {ex}")
-                image.processing_status = 'failed'
-                image.save(update_fields=['processing_status'])
-        
-        return image
+
+
+class UploadSessionSerializer(serializers.ModelSerializer):
+    """分块上传会话序列化器"""
+    size = serializers.IntegerField(source='total_size', min_value=1)
+    tags = serializers.ListField(
+        child=serializers.CharField(max_length=100),
+        required=False,
+        default=list
+    )
+    chunk_size = serializers.SerializerMethodField()
+    
+    class Meta:
+        model = UploadSession
+        fields = [
+            'id', 'filename', 'size', 'received_size', 'chunk_size',
+            'is_public', 'description', 'tags', 'image', 'created_at'
+        ]
+        read_only_fields = ['id', 'received_size', 'image', 'created_at']
+    
+    def get_chunk_size(self, obj):
+        """建议的分块大小"""
+        return upload_chunk_size()
+    
+    def validate(self, attrs):
+        validate_image_upload(
+            attrs['filename'],
+            attrs['total_size'],
+            max_size=getattr(settings, 'CHUNKED_UPLOAD_MAX_SIZE', 50 * 1024 * 1024)
+        )
+        return attrs
+
+
+def upload_chunk_size():
+    """分块上传的单块大小上限"""
+    return getattr(settings, 'CHUNKED_UPLOAD_CHUNK_SIZE', 2 * 1024 * 1024)
+
+
+def validate_image_upload(filename, size, max_size=None):
+    """检查文件扩展名和大小"""
+    ext = filename.split('.')[-1].lower()
+    if ext not in Image.ALLOWED_EXTENSIONS:
+        raise serializers.ValidationError(
+            f"不支持的文件格式。允许的格式: {', '.join(Image.ALLOWED_EXTENSIONS)}"
+        )
+    
+    # 检查文件大小（默认最大 10MB）
+    if max_size is None:
+        max_size = getattr(settings, 'IMAGE_MAX_UPLOAD_SIZE', 10 * 1024 * 1024)
+    if size > max_size:
+        raise serializers.ValidationError(
+            f"文件大小超过限制。最大允许: {max_size // (1024 * 1024)}MB"
+        )
+
+
+class AIBatchSerializer(serializers.ModelSerializer):
+    """
+    批量 AI 分析序列化器
+    
+    各状态的图片数量由 ai_batch.with_progress 注解，失败的图片预取到 failed_items
+    """
+    image_ids = serializers.ListField(
+        child=serializers.IntegerField(),
+        write_only=True,
+        allow_empty=False
+    )
+    total = serializers.IntegerField(read_only=True)
+    pending = serializers.IntegerField(read_only=True)
+    success = serializers.IntegerField(read_only=True)
+    cached = serializers.IntegerField(read_only=True)
+    failed = serializers.IntegerField(read_only=True)
+    progress = serializers.SerializerMethodField()
+    failures = serializers.SerializerMethodField()
+    
+    class Meta:
+        model = AIBatch
+        fields = [
+            'id', 'status', 'image_ids', 'total', 'pending', 'success', 'cached', 'failed',
+            'progress', 'failures', 'created_at', 'updated_at'
+        ]
+        read_only_fields = ['id', 'status', 'created_at', 'updated_at']
+    
+    def get_progress(self, obj):
+        """已处理的比例（0-1）"""
+        return round((obj.total - obj.pending) / obj.total, 4) if obj.total else 1
+    
+    def get_failures(self, obj):
+        return [{'image': item.image_id, 'detail': item.detail} for item in getattr(obj, 'failed_items', [])]
+    
+    def validate_image_ids(self, value):
+        maximum = getattr(settings, 'VISION_BATCH_MAX_IMAGES', 500)
+        value = list(dict.fromkeys(value))
+        if len(value) > maximum:
+            raise serializers.ValidationError(f'单次最多分析 {maximum} 张图片')
+        return value
 
 
 class ImageTagAddSerializer(serializers.Serializer):
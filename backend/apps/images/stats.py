@@ -0,0 +1,159 @@
+"""
+图片统计计数
+
+ImageStats 保存每个用户和全站的图片数量、公开数量和占用空间，
+统计接口直接读取计数行，不再对 images 表执行 COUNT。
+
+- 计数由 Image 的 pre_save / post_save 信号在同一事务中增量更新
+  （创建、公开状态变化、文件大小变化、更换所有者）；删除时按一次删除操作汇总后更新一次
+- bulk_create / QuerySet.update 不触发信号，绕过信号的写入需要调用 adjust_image_stats，
+  遗漏的偏差由定时任务 reconcile_image_stats 校正
+"""
+from collections import defaultdict
+
+from django.db import transaction
+from django.db.models import Count, F, Q, Sum
+from django.db.models.functions import Greatest
+
+# 影响统计的图片字段
+STATS_FIELDS = ('owner_id', 'is_public', 'size')
+
+
+def image_stats_state(image):
+    """图片对统计的贡献：(owner_id, is_public, size)"""
+    return image.owner_id, image.is_public, image.size or 0
+
+
+def stats_changes(before, after):
+    """
+    计算一张图片从 before 状态变为 after 状态时的计数增量
+
+    Args:
+        before / after: image_stats_state() 的结果，None 表示不存在
+
+    Returns:
+        list: [(owner_id, 图片数增量, 公开数增量, 空间增量)]
+    """
+    changes = []
+    if before is not None:
+        owner_id, is_public, size = before
+        changes.append((owner_id, -1, -int(is_public), -size))
+    if after is not None:
+        owner_id, is_public, size = after
+        changes.append((owner_id, 1, int(is_public), size))
+    return changes
+
+
+def adjust_image_stats(changes):
+    """
+    批量调整统计计数
+
+    同一用户的多个增量合并为一条 UPDATE，全站合计行同时更新；
+    新增图片时先用 bulk_create（忽略冲突）补齐缺失的用户统计行再 UPDATE，
+    同一新用户并发上传时不会重复插入
+
+    Args:
+        changes: [(owner_id, 图片数增量, 公开数增量, 空间增量)]
+    """
+    from .models import ImageStats
+
+    per_owner = defaultdict(lambda: [0, 0, 0])
+    for owner_id, count, public, size in changes:
+        for totals in (per_owner[owner_id], per_owner[None]):
+            totals[0] += count
+            totals[1] += public
+            totals[2] += size
+
+    def shifted(field, n):
+        if n >= 0:
+            return F(field) + n
+        return Greatest(F(field) + n, 0)
+
+    with transaction.atomic():
+        ImageStats.objects.bulk_create(
+            [ImageStats(owner_id=owner_id) for owner_id, totals in per_owner.items()
+             if owner_id is not None and totals[0] > 0],
+            ignore_conflicts=True
+        )
+        for owner_id, (count, public, size) in per_owner.items():
+            if not (count or public or size):
+                continue
+            updated = ImageStats.objects.filter(owner_id=owner_id).update(
+                image_count=shifted('image_count', count),
+                public_count=shifted('public_count', public),
+                total_size=shifted('total_size', size),
+            )
+            # 全站合计行由迁移创建（owner 为空不受唯一约束保护，不用 bulk_create）
+            if not updated and count > 0:
+                ImageStats.objects.create(
+                    owner_id=owner_id,
+                    image_count=count,
+                    public_count=max(public, 0),
+                    total_size=max(size, 0),
+                )
+
+
+def get_image_stats(owner=None):
+    """读取用户（owner 为空时为全站）的统计计数，不存在时返回全为 0 的对象"""
+    from .models import ImageStats
+
+    owner_id = owner.pk if owner is not None else None
+    return ImageStats.objects.filter(owner_id=owner_id).first() or ImageStats(owner_id=owner_id)
+
+
+def top_uploaders(limit=10):
+    """图片数量最多的用户"""
+    from .models import ImageStats
+
+    rows = (
+        ImageStats.objects.filter(owner__isnull=False, image_count__gt=0)
+        .select_related('owner')
+        .order_by('-image_count')[:limit]
+    )
+    return [
+        {
+            'id': row.owner_id,
+            'username': row.owner.username,
+            'image_count': row.image_count,
+            'total_size': row.total_size,
+        }
+        for row in rows
+    ]
+
+
+def reconcile_image_stats():
+    """
+    按 images 表重新计算统计并修正有偏差的计数行
+
+    Returns:
+        int: 修正的行数
+    """
+    from .models import Image, ImageStats
+
+    with transaction.atomic():
+        actual = {
+            row['owner_id']: (row['image_count'], row['public_count'], row['total_size'] or 0)
+            for row in Image.objects.order_by().values('owner_id').annotate(
+                image_count=Count('id'),
+                public_count=Count('id', filter=Q(is_public=True)),
+                total_size=Sum('size'),
+            )
+        }
+        totals = [sum(values[i] for values in actual.values()) for i in range(3)]
+        actual[None] = tuple(totals)
+
+        existing = {row.owner_id: row for row in ImageStats.objects.select_for_update()}
+        changed, created = [], []
+        for owner_id in actual.keys() | existing.keys():
+            values = actual.get(owner_id, (0, 0, 0))
+            row = existing.get(owner_id)
+            if row is None:
+                created.append(ImageStats(
+                    owner_id=owner_id, image_count=values[0], public_count=values[1], total_size=values[2]
+                ))
+            elif (row.image_count, row.public_count, row.total_size) != values:
+                row.image_count, row.public_count, row.total_size = values
+                changed.append(row)
+        ImageStats.objects.bulk_create(created)
+        ImageStats.objects.bulk_update(changed, ['image_count', 'public_count', 'total_size'])
+    return len(changed) + len(created)
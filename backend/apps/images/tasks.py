@@ -2,17 +2,20 @@
 图片处理异步任务
 
 包含：
-- 缩略图生成
+- 缩略图与响应式多尺寸图片生成
+- 批量处理（合并投递的上传）
 - EXIF 解析
-- AI 标注（预留）
+- AI 描述与标签生成
 """
 import os
 import logging
 from celery import shared_task
 from django.conf import settings
+from django.utils import timezone
 from PIL import Image as PILImage
 from io import BytesIO
-from django.core.files.base import ContentFile
+from django.core.files import File
+from django.core.files.storage import default_storage
 
 logger = logging.getLogger(__name__)
 
@@ -26,8 +29,11 @@ def process_image_async(self, image_id):
     1. 生成缩略图
     2. 解析 EXIF
     3. 生成自动标签
+    
+    各步骤共用一个处理上下文，原图只读取一次，任务结果中包含各阶段耗时（毫秒）
     """
     from apps.images.models import Image
+    from apps.images.processing import ImageProcessingContext
     
     try:
         image = Image.objects.get(id=image_id)
@@ -35,20 +41,23 @@ def process_image_async(self, image_id):
         
         # 更新状态为处理中
         image.processing_status = 'processing'
-        image.save(update_fields=['processing_status'])
+        image.processing_started_at = timezone.now()
+        image.save(update_fields=['processing_status', 'processing_started_at'])
         
-        # 1. 生成缩略图
-        generate_thumbnail(image)
+        context = ImageProcessingContext(image)
         
-        # 2. 解析 EXIF 并生成自动标签
-        parse_exif_and_generate_tags(image)
+        # 1. 生成缩略图（相同内容已有缩略图时直接复用）
+        generate_thumbnail(image, context)
+        
+        # 2. 解析 EXIF 并生成自动标签（相同内容已解析过时直接复用）
+        parse_exif_and_generate_tags(image, context)
         
         # 更新状态为完成
         image.processing_status = 'completed'
         image.save(update_fields=['processing_status'])
         
-        logger.info(f"图片处理完成: {image.filename} (ID: {image_id})")
-        return {'status': 'success', 'image_id': image_id}
+        logger.info(f"图片处理完成: {image.filename} (ID: {image_id}), 耗时: {context.timings}")
+        return {'status': 'success', 'image_id': image_id, 'timings': context.timings}
         
     except Image.DoesNotExist:
         logger.error(f"图片不存在: ID={image_id}")
@@ -66,6 +75,71 @@ def process_image_async(self, image_id):
         raise self.retry(exc=exc, countdown=60)
 
 
+@shared_task(bind=True, max_retries=3)
+def process_images_batch(self, image_ids):
+    """
+    批量处理图片任务
+    
+    在线程池中生成缩略图和解析 EXIF，按批写回数据库
+    """
+    from apps.images.processing import process_image_batch
+    
+    try:
+        result = process_image_batch(image_ids)
+        logger.info(
+            f"批量处理完成: 成功 {len(result['completed'])} 张，失败 {len(result['failed'])} 张，"
+            f"耗时: {result['timings']}"
+        )
+        return {'status': 'success', **result}
+    except Exception as exc:
+        logger.error(f"批量处理图片失败: {exc}")
+        raise self.retry(exc=exc, countdown=60)
+
+
+@shared_task
+def process_pending_images():
+    """
+    处理等待中的图片（上传后合并投递，也作为定期任务兜底）
+    
+    每次最多处理 IMAGE_BATCH_SIZE 张，还有剩余时继续投递；
+    处理超时（worker 中断）的图片先重新设为 pending
+    """
+    from django.db import transaction
+    from apps.images.models import Image
+    from apps.images.processing import process_image_batch, reclaim_stale_processing
+    
+    batch_size = getattr(settings, 'IMAGE_BATCH_SIZE', 200)
+    
+    reclaimed = reclaim_stale_processing()
+    if reclaimed:
+        logger.warning(f"重新处理超时的图片 {reclaimed} 张")
+    
+    # 认领待处理的图片（支持的数据库上跳过其他任务已锁定的行）
+    with transaction.atomic():
+        image_ids = list(
+            Image.objects.select_for_update(skip_locked=True)
+            .filter(processing_status='pending')
+            .order_by('id')
+            .values_list('id', flat=True)[:batch_size]
+        )
+        Image.objects.filter(id__in=image_ids).update(
+            processing_status='processing', processing_started_at=timezone.now()
+        )
+    
+    if not image_ids:
+        return {'status': 'success', 'completed': [], 'failed': [], 'timings': {}}
+    
+    result = process_image_batch(image_ids)
+    logger.info(
+        f"处理等待中的图片: 成功 {len(result['completed'])} 张，失败 {len(result['failed'])} 张，"
+        f"耗时: {result['timings']}"
+    )
+    
+    if len(image_ids) >= batch_size:
+        process_pending_images.delay()
+    return {'status': 'success', **result}
+
+
 @shared_task(bind=True, max_retries=3)
 def generate_thumbnail_task(self, image_id):
     """异步生成缩略图任务"""
@@ -100,100 +174,189 @@ def parse_exif_task(self, image_id):
         raise self.retry(exc=exc, countdown=30)
 
 
-@shared_task(bind=True, max_retries=3)
-def ai_analyze_image_task(self, image_id):
+@shared_task(bind=True, max_retries=5)
+def ai_analyze_image_task(self, image_id, job_id=None):
     """
-    AI 分析图片任务（预留）
+    AI 分析图片任务：生成描述和标签
     
-    TODO: 接入 AI 模型进行图片内容识别
+    使用图片所有者配置的 Vision API Key；同一 Key 的并发名额已满或请求失败时稍后重试，
+    任务状态写入 job_id 对应的任务记录
     """
+    import requests
+    from apps.images.ai import (
+        ConcurrencyLimited, api_key_slot, apply_ai_result, find_vision_results, is_retryable,
+        request_description, save_vision_result, update_job, vision_image_jpeg,
+    )
     from apps.images.models import Image
+    from apps.users.models import UserProfile
+    
+    def fail(detail):
+        logger.error(f"AI 分析失败 (ID={image_id}): {detail}")
+        if job_id:
+            update_job(job_id, status='failed', detail=detail)
+        return {'status': 'error', 'message': detail}
     
     try:
         image = Image.objects.get(id=image_id)
-        logger.info(f"AI 分析任务（预留）: {image.filename}")
-        
-        # TODO: 调用 AI API 分析图片
-        # 1. 读取图片文件
-        # 2. 调用远程 AI 模型 API
-        # 3. 解析返回的标签
-        # 4. 写入数据库
-        
-        return {'status': 'success', 'image_id': image_id, 'message': 'AI功能待实现'}
     except Image.DoesNotExist:
-        logger.error(f"图片不存在: ID={image_id}")
-        return {'status': 'error', 'message': '图片不存在'}
+        return fail('图片不存在')
+    
+    profile = UserProfile.objects.filter(user_id=image.owner_id).first()
+    if profile is None or not profile.has_vision_api_key:
+        return fail('请先在个人设置中配置 Vision API Key')
+    
+    # 内容相同的图片已分析过时直接使用缓存结果
+    cached = find_vision_results([image.content_hash]).get(image.content_hash)
+    if cached is not None:
+        added_tags = apply_ai_result(image, cached.description, cached.tags)
+        if job_id:
+            update_job(job_id, status='success', description=cached.description, tags=added_tags, cached=True)
+        return {'status': 'success', 'image_id': image_id, 'description': cached.description,
+                'tags': added_tags, 'cached': True}
+    
+    if job_id:
+        update_job(job_id, status='running')
+    try:
+        jpeg = vision_image_jpeg(image)
     except Exception as exc:
-        logger.error(f"AI 分析失败: {exc}")
-        raise self.retry(exc=exc, countdown=60)
+        return fail(f'读取图片失败: {exc}')
+    try:
+        with api_key_slot(profile.vision_api_key):
+            description, tags, call = request_description(profile.vision_api_key, jpeg)
+    except ConcurrencyLimited as exc:
+        # 等待同一 Key 的其他请求完成，不计入失败重试次数
+        raise self.retry(exc=exc, countdown=5, max_retries=None)
+    except (ValueError, KeyError, IndexError, TypeError) as exc:
+        # 包括响应体不是 JSON（requests 的 JSONDecodeError 同时是 ValueError）
+        return fail(f'AI 响应解析失败: {exc}')
+    except requests.exceptions.RequestException as exc:
+        if is_retryable(exc) and self.request.retries < self.max_retries:
+            raise self.retry(exc=exc, countdown=2 ** self.request.retries * 5)
+        return fail(f'AI 服务请求失败: {exc}')
+    
+    save_vision_result(image.content_hash, description, tags)
+    added_tags = apply_ai_result(image, description, tags)
+    if job_id:
+        update_job(job_id, status='success', description=description, tags=added_tags, metrics=call)
+    logger.info(f"AI 描述生成完成: {image.filename}")
+    return {
+        'status': 'success', 'image_id': image_id, 'description': description, 'tags': added_tags,
+        'metrics': call,
+    }
 
 
-def generate_thumbnail(image):
+@shared_task
+def run_ai_batch(batch_id):
+    """批量 AI 分析：处理一段待处理的图片，未完成时重新投递自己"""
+    from apps.images.ai_batch import run_batch
+    
+    return run_batch(batch_id)
+
+
+@shared_task
+def resume_ai_batches():
+    """重新投递长时间没有进展的批量 AI 分析（定期任务）"""
+    from apps.images.ai_batch import resume_stale_batches
+    
+    resumed = resume_stale_batches()
+    if resumed:
+        logger.info(f"重新投递批量 AI 分析 {resumed} 个")
+    return {'status': 'success', 'resumed': resumed}
+
+
+def render_thumbnail(image, context=None):
     """
-    生成缩略图
+    生成缩略图和多尺寸图片并写入存储（不写数据库）
+    
+    原图只解码一次，缩略图与各尺寸 WebP/AVIF 都由同一份解码结果缩放得到。
+    image.blob 需已加载，批处理时在线程池中调用
     
     Args:
         image: Image 模型实例
+        context: 处理上下文，未提供时新建
+    
+    Returns:
+        tuple: (缩略图路径, rendition 列表)
     """
-    if not image.file:
-        logger.warning(f"图片文件不存在: ID={image.id}")
-        return
+    from apps.images.blobs import blob_thumbnail_path
+    from apps.images.processing import ImageProcessingContext
+    from apps.images.renditions import generate_renditions
     
-    try:
-        # 获取缩略图尺寸配置
-        thumb_size = getattr(settings, 'THUMBNAIL_SIZE', (300, 300))
-        thumb_quality = getattr(settings, 'THUMBNAIL_QUALITY', 85)
-        
-        # 打开原图
-        image.file.seek(0)
-        img = PILImage.open(image.file)
-        
-        # 保持 EXIF 方向信息
-        try:
-            from PIL import ExifTags
-            for orientation in ExifTags.TAGS.keys():
-                if ExifTags.TAGS[orientation] == 'Orientation':
-                    break
-            exif = img._getexif()
-            if exif:
-                orientation_value = exif.get(orientation)
-                if orientation_value == 3:
-                    img = img.rotate(180, expand=True)
-                elif orientation_value == 6:
-                    img = img.rotate(270, expand=True)
-                elif orientation_value == 8:
-                    img = img.rotate(90, expand=True)
-        except (AttributeError, KeyError, IndexError):
-            pass
-        
-        # 转换为 RGB（处理 RGBA 或其他模式）
-        if img.mode in ('RGBA', 'P', 'LA'):
-            # 创建白色背景
-            background = PILImage.new('RGB', img.size, (255, 255, 255))
-            if img.mode == 'P':
-                img = img.convert('RGBA')
-            background.paste(img, mask=img.split()[-1] if img.mode in ('RGBA', 'LA') else None)
-            img = background
-        elif img.mode != 'RGB':
-            img = img.convert('RGB')
-        
-        # 生成缩略图（保持比例）
+    # 获取缩略图尺寸配置
+    thumb_size = getattr(settings, 'THUMBNAIL_SIZE', (300, 300))
+    thumb_quality = getattr(settings, 'THUMBNAIL_QUALITY', 85)
+    
+    # 解码原图（按输出所需的最大尺寸降采样解码，并校正方向、转换为 RGB）
+    context = context or ImageProcessingContext(image)
+    img = context.decode(thumb_size)
+    
+    # 生成多尺寸图片（每档由上一档缩放，不修改 img）
+    blob = image.blob
+    base_path = blob.file_path if blob else image.file.name
+    with context.stage('renditions'):
+        renditions = generate_renditions(img, base_path)
+    
+    # 生成缩略图（保持比例）
+    with context.stage('thumbnail'):
         img.thumbnail(thumb_size, PILImage.Resampling.LANCZOS)
         
         # 保存到内存
         thumb_io = BytesIO()
         img.save(thumb_io, format='JPEG', quality=thumb_quality, optimize=True)
-        thumb_io.seek(0)
-        
-        # 生成缩略图文件名
-        original_name = os.path.basename(image.file.name)
-        name_without_ext = os.path.splitext(original_name)[0]
-        thumb_filename = f"{name_without_ext}_thumb.jpg"
+    
+    # 生成缩略图文件名
+    original_name = os.path.basename(image.file.name)
+    name_without_ext = os.path.splitext(original_name)[0]
+    thumb_filename = f"{name_without_ext}_thumb.jpg"
+    
+    # 共享存储：缩略图按内容寻址保存；否则保存到用户缩略图目录
+    if blob:
+        thumb_path = blob_thumbnail_path(blob.content_hash)
+    else:
+        thumb_path = image.thumbnail.field.generate_filename(image, thumb_filename)
+    thumb_path = default_storage.save(thumb_path, File(thumb_io, name=thumb_filename))
+    return thumb_path, renditions
+
+
+def generate_thumbnail(image, context=None):
+    """
+    生成缩略图和响应式多尺寸图片并保存到图片记录
+    
+    Args:
+        image: Image 模型实例
+        context: 处理上下文，未提供时新建
+    """
+    from apps.images.blobs import delete_files_on_commit
+    from apps.images.models import ImageBlob
+    from apps.images.renditions import rendition_paths
+    
+    if not image.file:
+        logger.warning(f"图片文件不存在: ID={image.id}")
+        return
+    
+    # 共享存储的图片：同一内容的缩略图只生成一次
+    blob = image.blob
+    if blob and blob.thumbnail_path:
+        image.thumbnail.name = blob.thumbnail_path
+        image.renditions = blob.renditions
+        image.thumbnail_generated = True
+        image.save(update_fields=['thumbnail', 'renditions', 'thumbnail_generated'])
+        logger.info(f"复用已有缩略图: {image.filename}")
+        return
+    
+    try:
+        thumb_path, renditions = render_thumbnail(image, context)
         
-        # 保存缩略图
-        image.thumbnail.save(thumb_filename, ContentFile(thumb_io.read()), save=False)
+        if blob:
+            # 记录到 blob 供相同内容的图片复用
+            ImageBlob.objects.filter(pk=blob.pk).update(thumbnail_path=thumb_path, renditions=renditions)
+        else:
+            # 重新生成时删除上一次的多尺寸图片
+            delete_files_on_commit(rendition_paths(image.renditions))
+        image.thumbnail.name = thumb_path
+        image.renditions = renditions
         image.thumbnail_generated = True
-        image.save(update_fields=['thumbnail', 'thumbnail_generated'])
+        image.save(update_fields=['thumbnail', 'renditions', 'thumbnail_generated'])
         
         logger.info(f"缩略图生成成功: {image.filename}")
         
@@ -202,17 +365,29 @@ def generate_thumbnail(image):
         raise
 
 
-def parse_exif_and_generate_tags(image):
+def parse_exif_and_generate_tags(image, context=None):
     """
     解析 EXIF 并生成自动标签
     
     Args:
         image: Image 模型实例
+        context: 处理上下文，未提供时新建
     """
-    from apps.images.exif_utils import apply_exif_to_image
+    from apps.images.exif_utils import apply_exif_to_image, exif_from_json, exif_to_json
+    from apps.images.models import ImageBlob
+    from apps.images.processing import ImageProcessingContext
     
     try:
-        apply_exif_to_image(image)
+        blob = image.blob
+        if blob and blob.exif_data is not None:
+            apply_exif_to_image(image, exif_data=exif_from_json(blob.exif_data))
+            logger.info(f"复用已解析的 EXIF: {image.filename}")
+            return
+        
+        context = context or ImageProcessingContext(image)
+        exif_data = apply_exif_to_image(image, exif_data=context.exif_data)
+        if blob and exif_data is not None:
+            ImageBlob.objects.filter(pk=blob.pk).update(exif_data=exif_to_json(exif_data))
         logger.info(f"EXIF 解析完成: {image.filename}")
     except Exception as e:
         logger.error(f"EXIF 解析失败 (ID={image.id}): {e}")
@@ -220,40 +395,86 @@ def parse_exif_and_generate_tags(image):
 
 
 @shared_task
-def cleanup_orphaned_files():
+def reindex_tag_images_task(tag_id):
+    """标签改名后分批重建使用该标签的图片索引"""
+    from apps.images.search import index_tag_images
+    
+    indexed = index_tag_images(tag_id)
+    return {'status': 'success', 'tag_id': tag_id, 'indexed': indexed}
+
+
+@shared_task(bind=True, max_retries=3)
+def delete_files_task(self, paths):
+    """
+    删除存储中的文件（删除记录的事务提交后投递）
+    
+    原图、缩略图和多尺寸图片一起分批删除；可重复执行，删除失败的路径稍后重试
+    """
+    from apps.images.blobs import delete_stored_files
+    
+    deleted, failed = delete_stored_files(paths)
+    if failed:
+        raise self.retry(args=[failed], countdown=60)
+    return {'status': 'success', 'deleted': deleted}
+
+
+@shared_task
+def cleanup_orphaned_files(dry_run=False):
     """
     清理孤立文件（定期任务）
     
-    清理没有数据库记录对应的图片文件
+    增量回收没有数据库记录引用的原图、缩略图和多尺寸图片：每次从检查点继续处理一部分分片，
+    详见 apps.images.gc
     """
-    from apps.images.models import Image
+    from apps.images.gc import collect_orphans
     
-    media_root = settings.MEDIA_ROOT
-    uploads_dir = os.path.join(media_root, 'uploads')
+    report = collect_orphans(dry_run=dry_run)
+    logger.info(
+        f"孤立文件回收: 分片 {report['shards']} 个, 扫描 {report['files_scanned']} 个文件 "
+        f"({report['files_per_second']}/s), 孤立 {report['orphans']} 个, 删除 {report['deleted']} 个"
+    )
+    return {'status': 'success', **report}
+
+
+@shared_task
+def cleanup_stale_upload_sessions():
+    """
+    清理过期的分块上传会话（定期任务）
     
-    if not os.path.exists(uploads_dir):
-        return {'status': 'success', 'cleaned': 0}
+    删除超过 CHUNKED_UPLOAD_EXPIRE_HOURS 未更新的会话（未完成的和已完成的）及其残留的临时文件
+    """
+    from datetime import timedelta
+    from apps.images.models import UploadSession
+    
+    expire_hours = getattr(settings, 'CHUNKED_UPLOAD_EXPIRE_HOURS', 24)
+    deadline = timezone.now() - timedelta(hours=expire_hours)
+    stale = UploadSession.objects.filter(updated_at__lt=deadline)
     
     cleaned_count = 0
+    for session in stale:
+        try:
+            if os.path.exists(session.temp_path):
+                os.remove(session.temp_path)
+        except OSError as e:
+            logger.error(f"删除分块临时文件失败: {session.temp_path}, 错误: {e}")
+            continue
+        session.delete()
+        cleaned_count += 1
     
-    # 获取所有数据库中的文件路径
-    db_files = set(Image.objects.values_list('file', flat=True))
-    db_thumbnails = set(Image.objects.exclude(thumbnail='').values_list('thumbnail', flat=True))
-    all_db_files = db_files | db_thumbnails
-    
-    # 遍历上传目录
-    for root, dirs, files in os.walk(uploads_dir):
-        for filename in files:
-            file_path = os.path.join(root, filename)
-            relative_path = os.path.relpath(file_path, media_root)
-            
-            if relative_path not in all_db_files:
-                try:
-                    os.remove(file_path)
-                    cleaned_count += 1
-                    logger.info(f"清理孤立文件: {relative_path}")
-                except OSError as e:
-                    logger.error(f"清理文件失败: {relative_path}, 错误: {e}")
-    
-    logger.info(f"清理完成，共清理 {cleaned_count} 个文件")
+    logger.info(f"清理过期分块上传会话 {cleaned_count} 个")
     return {'status': 'success', 'cleaned': cleaned_count}
+
+
+@shared_task
+def reconcile_image_stats():
+    """
+    校正图片统计计数（定期任务）
+    
+    按 images 表重新计算每个用户和全站的计数，修正信号未覆盖的写入造成的偏差
+    """
+    from apps.images.stats import reconcile_image_stats as reconcile
+    
+    corrected = reconcile()
+    if corrected:
+        logger.warning(f"图片统计计数存在偏差，已修正 {corrected} 行")
+    return {'status': 'success', 'corrected': corrected}
@@ -1,3 +1,1614 @@
-from django.test import TestCase
+import hashlib
+import os
+import shutil
+import tempfile
+import time
+from datetime import timedelta
+from io import BytesIO
+from unittest import addModuleCleanup, mock, skipUnless
 
-# Create your tests here.
+from django.contrib.auth import get_user_model
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection
+from django.db.models import Q
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from django.utils.http import http_date
+from rest_framework.test import APIClient
+
+from apps.tags.cache import tag_cache
+from apps.tags.models import Tag
+from .models import Image, ImageTag, attach_tags
+from .processing import BATCH_SCHEDULED_KEY, schedule_image_processing
+from .response_cache import response_cache_stats
+from .sampling import sample_public_ids
+from .stats import get_image_stats, reconcile_image_stats
+
+User = get_user_model()
+
+
+def make_jpeg(size=(64, 48), color=(200, 30, 30)):
+    """生成 JPEG 字节"""
+    from PIL import Image as PILImage
+    buffer = BytesIO()
+    PILImage.new('RGB', size, color).save(buffer, format='JPEG')
+    return buffer.getvalue()
+
+
+def clear_caches():
+    """清空水位线、响应缓存等共享缓存和进程内的标签缓存"""
+    for alias in settings.CACHES:
+        caches[alias].clear()
+    tag_cache.clear()
+
+
+def setUpModule():
+    """文件删除任务在提交回调中同步执行，不连接消息队列"""
+    from .tasks import delete_files_task
+
+    patcher = mock.patch.object(
+        delete_files_task, 'apply_async', side_effect=lambda args=None, **kwargs: delete_files_task.apply(args=args)
+    )
+    patcher.start()
+    addModuleCleanup(patcher.stop)
+
+
+def make_image(owner, **kwargs):
+    """创建不带实际文件的图片记录"""
+    defaults = {
+        'file': f'uploads/user_{owner.id}/test.jpg',
+        'filename': 'test.jpg',
+        'size': 1024,
+        'width': 100,
+        'height': 100,
+    }
+    defaults.update(kwargs)
+    return Image.objects.create(owner=owner, **defaults)
+
+
+class ImageKeysetPaginationTests(TestCase):
+    """图片列表游标分页"""
+
+    def setUp(self):
+        clear_caches()
+        self.addCleanup(clear_caches)
+        self.user = User.objects.create_user(username='alice', password='pass12345')
+        self.other = User.objects.create_user(username='bob', password='pass12345')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        # 大小有重复，用于验证 id 作为第二排序键
+        for i in range(5):
+            make_image(self.user, filename=f'a{i}.jpg', size=100 * (i % 2))
+        for i in range(4):
+            make_image(self.other, filename=f'b{i}.jpg', size=100 * (i % 3), is_public=True)
+        make_image(self.other, filename='private.jpg')
+
+    def collect_pages(self, url, params):
+        ids = []
+        response = self.client.get(url, params)
+        while True:
+            self.assertEqual(response.status_code, 200)
+            self.assertLessEqual(len(response.data['results']), params['page_size'])
+            ids.extend(item['id'] for item in response.data['results'])
+            if not response.data['next']:
+                return ids
+            response = self.client.get(response.data['next'])
+
+    def test_pages_cover_listing_in_order(self):
+        for ordering in ['-upload_time', 'upload_time', 'size', '-size', 'filename', '-filename']:
+            with self.subTest(ordering=ordering):
+                full = self.client.get('/api/images/', {'ordering': ordering}).data
+                field = ordering.lstrip('-')
+                expected = sorted(
+                    full,
+                    key=lambda item: (item[field], item['id']),
+                    reverse=ordering.startswith('-'),
+                )
+                ids = self.collect_pages('/api/images/', {'ordering': ordering, 'page_size': 4})
+                self.assertEqual(ids, [item['id'] for item in expected])
+                self.assertEqual(len(ids), 9)
+
+    def test_my_images_paginated(self):
+        ids = self.collect_pages('/api/my-images/', {'page_size': 2})
+        expected = list(
+            Image.objects.filter(owner=self.user).order_by('-upload_time', '-id').values_list('id', flat=True)
+        )
+        self.assertEqual(ids, expected)
+
+    def test_public_paginated(self):
+        ids = self.collect_pages('/api/images/public/', {'page_size': 3})
+        self.assertEqual(len(ids), 4)
+
+    def test_unpaginated_without_params(self):
+        response = self.client.get('/api/images/')
+        self.assertIsInstance(response.data, list)
+
+    def test_invalid_cursor(self):
+        response = self.client.get('/api/images/', {'cursor': 'not-a-cursor'})
+        self.assertEqual(response.status_code, 404)
+
+    def test_cursor_rejected_for_other_ordering(self):
+        first = self.client.get('/api/images/', {'page_size': 2, 'ordering': 'size'})
+        cursor = first.data['next_cursor']
+        response = self.client.get('/api/images/', {'cursor': cursor, 'ordering': '-size'})
+        self.assertEqual(response.status_code, 404)
+
+
+class ImageVisibilityQueryTests(TestCase):
+    """可见性分支归并与标签子查询筛选的结果与 OR + JOIN + DISTINCT 查询一致"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='alice', password='pass12345')
+        self.other = User.objects.create_user(username='bob', password='pass12345')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        landscape, city, night = (Tag.objects.create(name=name) for name in ['风景', '城市', '夜景'])
+        for i in range(12):
+            owner = self.user if i % 3 == 0 else self.other
+            image = make_image(owner, filename=f'{i}.jpg', size=i % 4, is_public=i % 2 == 0)
+            tags = [tag for j, tag in enumerate([landscape, city, night]) if i % (j + 2) == 0]
+            for tag in tags:
+                ImageTag.objects.create(image=image, tag=tag)
+
+    def legacy_ids(self, ordering, tags=None, mode='and'):
+        queryset = Image.objects.filter(Q(owner=self.user) | Q(is_public=True))
+        if tags:
+            if mode == 'or':
+                queryset = queryset.filter(tags__name__in=tags)
+            elif mode == 'not':
+                queryset = queryset.exclude(tags__name__in=tags)
+            else:
+                for name in tags:
+                    queryset = queryset.filter(tags__name__iexact=name)
+        tiebreak = '-id' if ordering.startswith('-') else 'id'
+        return list(queryset.distinct().order_by(ordering, tiebreak).values_list('id', flat=True))
+
+    def page_ids(self, params):
+        ids = []
+        response = self.client.get('/api/images/', {**params, 'page_size': 3})
+        while True:
+            self.assertEqual(response.status_code, 200)
+            ids.extend(item['id'] for item in response.data['results'])
+            if not response.data['next']:
+                return ids
+            response = self.client.get(response.data['next'])
+
+    def test_matches_legacy_query(self):
+        cases = [
+            ('-upload_time', None, 'and'),
+            ('size', None, 'and'),
+            ('-size', ['风景'], 'or'),
+            ('-upload_time', ['风景', '城市'], 'and'),
+            ('-upload_time', ['风景', '夜景'], 'or'),
+            ('upload_time', ['城市'], 'not'),
+            ('filename', ['夜景'], 'not'),
+        ]
+        for ordering, tags, mode in cases:
+            with self.subTest(ordering=ordering, tags=tags, mode=mode):
+                params = {'ordering': ordering, 'tag_mode': mode}
+                if tags:
+                    params['tags'] = ','.join(tags)
+                expected = self.legacy_ids(ordering, tags, mode)
+                self.assertTrue(expected)
+                self.assertEqual(self.page_ids(params), expected)
+
+    @override_settings(IMAGE_VISIBILITY_MERGE=True)
+    def test_merged_branches_match_legacy_query(self):
+        self.test_matches_legacy_query()
+
+    @override_settings(TAG_FILTER_GROUPED_MAX=0)
+    def test_common_tags_use_exists(self):
+        self.assertNotIn('GROUP BY', str(Image.objects.with_tags(['风景', '城市']).query).upper())
+        self.test_matches_legacy_query()
+
+    def test_tag_names_case_insensitive(self):
+        image = make_image(self.user, filename='sunset.jpg')
+        ImageTag.objects.create(image=image, tag=Tag.objects.create(name='sunset'))
+        for mode in ['and', 'or']:
+            with self.subTest(mode=mode):
+                response = self.client.get('/api/images/', {'tags': 'Sunset, SUNSET', 'tag_mode': mode})
+                self.assertEqual([item['id'] for item in response.data], [image.id])
+        response = self.client.get('/api/images/', {'tags': 'sunset,不存在', 'tag_mode': 'and'})
+        self.assertEqual(response.data, [])
+        response = self.client.get('/api/images/', {'tags': '不存在', 'tag_mode': 'not'})
+        self.assertEqual(len(response.data), len(self.legacy_ids('id')))
+
+    def test_warm_cache_single_count_query(self):
+        names = ['风景', '城市', '夜景']
+        tag_cache.clear()
+        self.addCleanup(tag_cache.clear)
+        with self.captureOnCommitCallbacks(execute=True):
+            Tag.resolve_tags(names)
+        # 标签从缓存解析，最小使用次数用一条聚合查询取得，不逐个加载 usage_count
+        with self.assertNumQueries(1):
+            Image.objects.with_tags(names)
+
+    def test_and_mode_single_grouped_subquery(self):
+        queryset = Image.objects.with_tags(['风景', '城市', '夜景'])
+        sql = str(queryset.query).upper()
+        self.assertEqual(sql.count('IMAGE_TAGS'), 1)
+        self.assertIn('GROUP BY', sql)
+        self.assertIn('HAVING', sql)
+        self.assertNotIn('"TAGS"', sql)
+
+    def test_branches_do_not_overlap(self):
+        own, public = Image.objects.visible_to(self.user).visibility_branches()
+        own_ids = set(own.values_list('id', flat=True))
+        public_ids = set(public.values_list('id', flat=True))
+        self.assertFalse(own_ids & public_ids)
+        self.assertEqual(own_ids | public_ids, set(self.legacy_ids('id')))
+        self.assertIsNone(Image.objects.all().visibility_branches())
+
+
+class ImageSparseFieldsetTests(TestCase):
+    """稀疏字段集与紧凑列表表示"""
+
+    def setUp(self):
+        clear_caches()
+        self.addCleanup(clear_caches)
+        self.user = User.objects.create_user(username='alice', password='pass12345')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        for i in range(10):
+            image = make_image(
+                self.user, filename=f'{i}.jpg', is_public=True, description='描述' * 20,
+                exif_parsed=True, exif_camera_make='Canon', exif_camera_model='EOS R5',
+            )
+            attach_tags({image: ['风景', '城市', f'标签{i}']})
+
+    def test_fields_and_omit(self):
+        response = self.client.get('/api/images/', {'fields': 'id,thumbnail_url,unknown'})
+        self.assertEqual(set(response.data[0]), {'id', 'thumbnail_url'})
+
+        response = self.client.get('/api/my-images/', {'omit': 'exif_info,tags,tag_list'})
+        self.assertNotIn('exif_info', response.data[0])
+        self.assertNotIn('tags', response.data[0])
+        self.assertIn('file_url', response.data[0])
+
+    def test_compact_view(self):
+        full = self.client.get('/api/images/public/', {'page_size': 10}).data['results']
+        compact = self.client.get('/api/images/public/', {'page_size': 10, 'view': 'compact'}).data['results']
+        self.assertEqual([item['id'] for item in compact], [item['id'] for item in full])
+        for full_item, item in zip(full, compact):
+            self.assertEqual(set(item), {'id', 'thumbnail_url', 'width', 'height', 'tag_ids'})
+            self.assertEqual(item['thumbnail_url'], full_item['thumbnail_url'])
+            self.assertEqual(sorted(item['tag_ids']), sorted(tag['id'] for tag in full_item['tags']))
+
+        full_size = len(self.client.get('/api/images/').content)
+        compact_size = len(self.client.get('/api/images/', {'view': 'compact'}).content)
+        self.assertGreater(full_size, compact_size * 4)
+
+    def test_compact_query_count(self):
+        with CaptureQueriesContext(connection) as ctx:
+            self.client.get('/api/my-images/', {'view': 'compact'})
+        image_queries = [q['sql'] for q in ctx.captured_queries if 'images' in q['sql']]
+        self.assertFalse([sql for sql in image_queries if 'auth_user' in sql])
+        self.assertLessEqual(len(ctx.captured_queries), 2)
+
+
+class ImageListQueryCountTests(TestCase):
+    """列表序列化的查询数不随图片数量增长"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='alice', password='pass12345')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        tags = [Tag.objects.create(name=f'tag{i}') for i in range(6)]
+        for i in range(40):
+            image = make_image(self.user, filename=f'{i}.jpg', is_public=True)
+            for tag in tags[i % 3:i % 3 + 3]:
+                ImageTag.objects.create(image=image, tag=tag)
+
+    def count_queries(self, url, params):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200)
+        return len(ctx.captured_queries)
+
+    def test_query_count_constant(self):
+        for url in ['/api/images/', '/api/images/public/', '/api/my-images/']:
+            with self.subTest(url=url):
+                small = self.count_queries(url, {'page_size': 5})
+                large = self.count_queries(url, {'page_size': 40})
+                self.assertEqual(small, large)
+
+    def test_tag_counts(self):
+        response = self.client.get('/api/images/', {'page_size': 1, 'ordering': 'upload_time'})
+        tags = response.data['results'][0]['tags']
+        self.assertEqual(
+            {tag['name']: tag['image_count'] for tag in tags},
+            {'tag0': 14, 'tag1': 27, 'tag2': 40},
+        )
+
+
+class ImageSearchTests(TestCase):
+    """全文检索"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='alice', password='pass12345')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.cat = make_image(self.user, filename='IMG_2024.jpg', description='一只小猫在草地上晒太阳')
+        self.dog = make_image(self.user, filename='dog.png', description='公园里的狗', exif_camera_make='Canon')
+        self.sunset = make_image(self.user, filename='sunset.jpg', description='海边日落')
+
+    def search(self, text, **params):
+        response = self.client.get('/api/images/', {'search': text, **params})
+        self.assertEqual(response.status_code, 200)
+        results = response.data['results'] if 'results' in response.data else response.data
+        return [item['id'] for item in results]
+
+    def test_cjk_and_latin_terms(self):
+        self.assertEqual(self.search('小猫'), [self.cat.id])
+        self.assertEqual(self.search('猫'), [self.cat.id])
+        self.assertEqual(self.search('草地 晒太阳'), [self.cat.id])
+        self.assertEqual(self.search('2024'), [self.cat.id])
+        self.assertEqual(self.search('canon'), [self.dog.id])
+        self.assertEqual(self.search('大象'), [])
+
+    def test_index_follows_updates(self):
+        self.sunset.description = '海边的小猫'
+        self.sunset.save()
+        tag = Tag.objects.create(name='萌宠')
+        ImageTag.objects.create(image=self.dog, tag=tag)
+        self.assertEqual(sorted(self.search('小猫')), sorted([self.cat.id, self.sunset.id]))
+        self.assertEqual(self.search('萌宠'), [self.dog.id])
+
+        ImageTag.objects.filter(image=self.dog, tag=tag).delete()
+        self.assertEqual(self.search('萌宠'), [])
+        self.cat.delete()
+        self.assertEqual(self.search('小猫'), [self.sunset.id])
+
+    def test_tag_rename_reindexes_in_background(self):
+        from .tasks import reindex_tag_images_task
+
+        tag = Tag.objects.create(name='萌宠')
+        ImageTag.objects.create(image=self.dog, tag=tag)
+        admin = User.objects.create_user(username='admin', password='pass12345', is_staff=True)
+        self.client.force_authenticate(admin)
+        with mock.patch.object(reindex_tag_images_task, 'delay') as delay:
+            # 只改颜色不重建索引
+            with self.captureOnCommitCallbacks(execute=True):
+                self.client.patch(f'/api/tags/{tag.id}/', {'color': '#ff0000'}, format='json')
+            delay.assert_not_called()
+            with self.captureOnCommitCallbacks(execute=True):
+                self.client.patch(f'/api/tags/{tag.id}/', {'name': '宠物'}, format='json')
+            delay.assert_called_once_with(tag.id)
+        self.client.force_authenticate(self.user)
+        self.assertEqual(self.search('宠物'), [])
+
+        self.assertEqual(reindex_tag_images_task.apply(args=[tag.id]).get()['indexed'], 1)
+        self.assertEqual(self.search('宠物'), [self.dog.id])
+        self.assertEqual(self.search('萌宠'), [])
+
+    def test_ranked_by_relevance(self):
+        # 文件名命中的权重高于描述
+        named = make_image(self.user, filename='小猫.jpg', description='照片')
+        self.assertEqual(self.search('小猫')[0], named.id)
+        self.assertEqual(self.search('小猫', page_size=1), [named.id])
+
+        ids = []
+        response = self.client.get('/api/images/', {'search': '小猫', 'page_size': 1})
+        while True:
+            ids.extend(item['id'] for item in response.data['results'])
+            if not response.data['next']:
+                break
+            response = self.client.get(response.data['next'])
+        self.assertEqual(ids, self.search('小猫'))
+
+
+class ImageRandomSamplingTests(TestCase):
+    """首页随机图片：按 id 探测抽样，数量受限，响应缓存"""
+
+    def setUp(self):
+        clear_caches()
+        self.addCleanup(clear_caches)
+        owner = User.objects.create_user(username='alice', password='pass12345')
+        self.public_ids = {make_image(owner, filename=f'{i}.jpg', is_public=True).id for i in range(30)}
+        for i in range(10):
+            make_image(owner, filename=f'private{i}.jpg')
+        self.client = APIClient()
+
+    def test_samples_distinct_public_images(self):
+        for count in [1, 6, 30]:
+            with self.subTest(count=count):
+                ids = sample_public_ids(count)
+                self.assertEqual(len(ids), count)
+                self.assertEqual(len(set(ids)), count)
+                self.assertLessEqual(set(ids), self.public_ids)
+        self.assertEqual(len(sample_public_ids(50)), 30)
+
+    def test_query_count_independent_of_library_size(self):
+        with CaptureQueriesContext(connection) as ctx:
+            sample_public_ids(6)
+        # 两次边界查询 + 最多 3 * count 次探测 + 一次补齐
+        self.assertLessEqual(len(ctx.captured_queries), 2 + 18 + 1)
+
+    @override_settings(RANDOM_IMAGES_MAX_COUNT=5, RANDOM_IMAGES_CACHE_VARIANTS=1, CACHE_SHARED=True)
+    def test_count_capped_and_response_cached(self):
+        response = self.client.get('/api/images/random/', {'count': 100})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data), 5)
+        self.assertLessEqual({item['id'] for item in response.data}, self.public_ids)
+        with self.assertNumQueries(0):
+            cached = self.client.get('/api/images/random/', {'count': 100})
+        self.assertEqual(cached.data, response.data)
+        self.assertEqual(self.client.get('/api/images/random/', {'count': 'x'}).status_code, 200)
+
+    def test_no_public_images(self):
+        Image.objects.filter(is_public=True).delete()
+        self.assertEqual(self.client.get('/api/images/random/').data, [])
+
+
+class ImageStatsTests(TestCase):
+    """统计计数随图片创建、修改、删除增量维护，统计接口只读取计数行"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='alice', password='pass12345')
+        self.other = User.objects.create_user(username='bob', password='pass12345')
+        self.admin = User.objects.create_user(username='admin', password='pass12345', is_staff=True)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def assertCounts(self, owner, image_count, public_count, total_size):
+        stats = get_image_stats(owner)
+        self.assertEqual((stats.image_count, stats.public_count, stats.total_size),
+                         (image_count, public_count, total_size))
+
+    def test_counters_follow_changes(self):
+        first = make_image(self.user, size=100, is_public=True)
+        second = make_image(self.user, size=50)
+        make_image(self.other, size=10, is_public=True)
+        self.assertCounts(self.user, 2, 1, 150)
+        self.assertCounts(None, 3, 2, 160)
+
+        second.is_public = True
+        second.save(update_fields=['is_public'])
+        self.assertCounts(self.user, 2, 2, 150)
+
+        first.size = 300
+        first.owner = self.other
+        first.save()
+        self.assertCounts(self.user, 1, 1, 50)
+        self.assertCounts(self.other, 2, 2, 310)
+
+        # 不涉及统计字段的保存不查询旧值
+        with self.assertNumQueries(1):
+            first.save(update_fields=['processing_status'])
+
+        Image.objects.filter(owner=self.other).delete()
+        self.assertCounts(self.other, 0, 0, 0)
+        self.assertCounts(None, 1, 1, 50)
+        self.assertEqual(reconcile_image_stats(), 0)
+
+    def test_delete_adjusts_once(self):
+        from .models import ImageStats
+
+        for i in range(10):
+            make_image(self.user if i % 2 else self.other, size=10, is_public=i < 4)
+        with CaptureQueriesContext(connection) as ctx:
+            Image.objects.all().delete()
+        updates = [q for q in ctx.captured_queries if q['sql'].startswith('UPDATE "image_stats"')]
+        # 每个用户和全站合计行各一条 UPDATE，与删除的图片数无关
+        self.assertEqual(len(updates), 3)
+        self.assertCounts(self.user, 0, 0, 0)
+        self.assertCounts(None, 0, 0, 0)
+
+        # 删除用户时级联删除的图片不会重新创建该用户的统计行
+        make_image(self.user, size=10)
+        user_id = self.user.id
+        self.user.delete()
+        self.assertFalse(ImageStats.objects.filter(owner_id=user_id).exists())
+        self.assertCounts(None, 0, 0, 0)
+
+    def test_first_upload_with_existing_row(self):
+        from .models import ImageStats
+
+        # 并发的第一次上传已创建统计行
+        ImageStats.objects.create(owner=self.user)
+        make_image(self.user, size=10)
+        self.assertEqual(ImageStats.objects.filter(owner=self.user).count(), 1)
+        self.assertCounts(self.user, 1, 0, 10)
+
+    def test_reconcile_fixes_drift(self):
+        make_image(self.user, size=100, is_public=True)
+        # QuerySet.update 不触发信号
+        Image.objects.filter(owner=self.user).update(is_public=False, size=70)
+        self.assertCounts(self.user, 1, 1, 100)
+        self.assertEqual(reconcile_image_stats(), 2)
+        self.assertCounts(self.user, 1, 0, 70)
+        self.assertCounts(None, 1, 0, 70)
+
+    def test_stats_endpoints_constant_queries(self):
+        for i in range(3):
+            make_image(self.user, size=10, is_public=i == 0)
+        make_image(self.other, size=5)
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get('/api/images/stats/')
+        self.assertFalse([q for q in ctx.captured_queries if 'FROM "images"' in q['sql']])
+        self.assertEqual(response.data, {
+            'my_total': 3, 'my_public': 1, 'my_private': 2, 'my_size': 30, 'all_public': 1,
+        })
+
+        self.client.force_authenticate(self.admin)
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get('/api/admin/images/stats/')
+        self.assertFalse([q for q in ctx.captured_queries if 'FROM "images"' in q['sql']])
+        self.assertEqual(response.data['total_images'], 4)
+        self.assertEqual(response.data['private_images'], 3)
+        self.assertEqual(response.data['total_size'], 35)
+        self.assertEqual(
+            [(row['username'], row['image_count']) for row in response.data['top_users']],
+            [('alice', 3), ('bob', 1)],
+        )
+
+
+@override_settings(CACHE_SHARED=True)
+class ConditionalRequestTests(TestCase):
+    """列表接口由变更水位线生成 ETag / Last-Modified，未变化时返回 304"""
+
+    def setUp(self):
+        clear_caches()
+        self.addCleanup(clear_caches)
+        self.user = User.objects.create_user(username='alice', password='pass12345')
+        self.other = User.objects.create_user(username='bob', password='pass12345')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.image = make_image(self.user)
+            make_image(self.other, is_public=True)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def revalidate(self, url, response):
+        return self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+
+    def test_not_modified_without_queries(self):
+        for url in ['/api/images/', '/api/my-images/', '/api/images/public/',
+                    f'/api/images/{self.image.id}/', '/api/tags/', '/api/tags/popular/']:
+            with self.subTest(url=url):
+                response = self.client.get(url)
+                self.assertEqual(response.status_code, 200)
+                self.assertIn('Last-Modified', response)
+                with self.assertNumQueries(0):
+                    self.assertEqual(self.revalidate(url, response).status_code, 304)
+                modified_since = self.client.get(url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+                self.assertEqual(modified_since.status_code, 304)
+
+    def test_validators_follow_scope_changes(self):
+        listing = self.client.get('/api/images/')
+        mine = self.client.get('/api/my-images/')
+        public = self.client.get('/api/images/public/')
+
+        # 其他用户的私有图片不影响当前用户可见的列表
+        with self.captureOnCommitCallbacks(execute=True):
+            make_image(self.other)
+        self.assertEqual(self.revalidate('/api/images/', listing).status_code, 304)
+
+        # 其他用户的公开图片改变可见列表和公开列表，不影响“我的图片”
+        with self.captureOnCommitCallbacks(execute=True):
+            make_image(self.other, is_public=True)
+        self.assertEqual(self.revalidate('/api/images/', listing).status_code, 200)
+        self.assertEqual(self.revalidate('/api/images/public/', public).status_code, 200)
+        self.assertEqual(self.revalidate('/api/my-images/', mine).status_code, 304)
+
+        # 标签变化影响标签列表和图片列表
+        tags = self.client.get('/api/tags/')
+        mine = self.client.get('/api/my-images/')
+        with self.captureOnCommitCallbacks(execute=True):
+            attach_tags({self.image: ['风景']})
+        self.assertEqual(self.revalidate('/api/tags/', tags).status_code, 200)
+        self.assertEqual(self.revalidate('/api/my-images/', mine).status_code, 200)
+
+    def test_validators_per_user(self):
+        response = self.client.get('/api/my-images/')
+        self.client.force_authenticate(self.other)
+        self.assertEqual(self.revalidate('/api/my-images/', response).status_code, 200)
+
+    @override_settings(CACHE_SHARED=False)
+    def test_no_validators_without_shared_cache(self):
+        response = self.client.get('/api/my-images/')
+        self.assertNotIn('ETag', response)
+        self.assertNotIn('Last-Modified', response)
+        modified_since = self.client.get('/api/my-images/', HTTP_IF_MODIFIED_SINCE=http_date(time.time() + 60))
+        self.assertEqual(modified_since.status_code, 200)
+
+
+@override_settings(CACHE_SHARED=True)
+class PublicResponseCacheTests(TestCase):
+    """公开列表共享响应缓存：按规范化参数命中，公开图片变化后换版本"""
+
+    def setUp(self):
+        clear_caches()
+        self.addCleanup(clear_caches)
+        self.user = User.objects.create_user(username='alice', password='pass12345')
+        self.admin = User.objects.create_user(username='admin', password='pass12345', is_staff=True)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.image = make_image(self.user, is_public=True, size=1)
+            make_image(self.user, is_public=True, size=2)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def public_ids(self, **params):
+        return [item['id'] for item in self.client.get('/api/images/public/', params).data['results']]
+
+    def test_hit_with_normalized_params(self):
+        first = self.client.get('/api/images/public/?page_size=5&ordering=size&search=')
+        with self.assertNumQueries(0):
+            second = self.client.get('/api/images/public/?ordering=size&page_size=5')
+        self.assertEqual(first.data, second.data)
+        stats = response_cache_stats(['public'])['public']
+        self.assertEqual((stats['hits'], stats['misses']), (1, 1))
+        self.assertIsNotNone(stats['avg_hit_ms'])
+
+    def test_version_bump_on_public_changes(self):
+        ids = self.public_ids(page_size=10)
+        self.assertEqual(len(ids), 2)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            created = make_image(self.user, is_public=True)
+        self.assertIn(created.id, self.public_ids(page_size=10))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            attach_tags({self.image: ['风景']})
+        item = next(item for item in self.client.get('/api/images/public/', {'page_size': 10}).data['results']
+                    if item['id'] == self.image.id)
+        self.assertEqual(item['tag_list'], ['风景'])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            created.is_public = False
+            created.save(update_fields=['is_public'])
+        self.assertNotIn(created.id, self.public_ids(page_size=10))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.image.delete()
+        self.assertNotIn(self.image.id, self.public_ids(page_size=10))
+
+    def test_private_tagging_keeps_public_version(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            private = make_image(self.user)
+        self.public_ids(page_size=10)
+        with self.captureOnCommitCallbacks(execute=True):
+            attach_tags({private: ['风景']})
+        with self.assertNumQueries(0):
+            self.public_ids(page_size=10)
+        with self.captureOnCommitCallbacks(execute=True):
+            attach_tags({self.image: ['风景']})
+        stats = response_cache_stats(['public'])['public']
+        self.public_ids(page_size=10)
+        self.assertEqual(response_cache_stats(['public'])['public']['misses'], stats['misses'] + 1)
+
+    @override_settings(CACHE_SHARED=False)
+    def test_disabled_without_shared_cache(self):
+        self.public_ids(page_size=10)
+        with CaptureQueriesContext(connection) as ctx:
+            self.public_ids(page_size=10)
+        self.assertGreater(len(ctx.captured_queries), 0)
+        self.assertEqual(response_cache_stats(['public'])['public']['misses'], 0)
+
+    def test_random_invalidated_by_delete(self):
+        self.client.force_authenticate(None)
+        with override_settings(RANDOM_IMAGES_CACHE_VARIANTS=1):
+            self.assertEqual(len(self.client.get('/api/images/random/').data), 2)
+            with self.captureOnCommitCallbacks(execute=True):
+                self.image.delete()
+            self.assertEqual(len(self.client.get('/api/images/random/').data), 1)
+
+    def test_stats_endpoint(self):
+        self.client.get('/api/images/public/')
+        self.client.force_authenticate(self.admin)
+        response = self.client.get('/api/admin/images/cache_stats/')
+        self.assertEqual(response.data['public']['misses'], 1)
+        self.assertIn('random', response.data)
+
+
+class MediaTestCase(TestCase):
+    """使用临时 MEDIA_ROOT，并以 mock 代替处理任务投递"""
+
+    def setUp(self):
+        super().setUp()
+        self.media_root = tempfile.mkdtemp()
+        settings_override = override_settings(
+            MEDIA_ROOT=self.media_root,
+            CHUNKED_UPLOAD_TEMP_DIR=f'{self.media_root}/tmp',
+        )
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        # 提交回调中写入的标签缓存随测试回滚失效
+        self.addCleanup(tag_cache.clear)
+        patcher = mock.patch('apps.images.processing.schedule_image_processing')
+        self.schedule = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.user = User.objects.create_user(username='alice', password='pass12345')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+
+class ImageUploadTests(MediaTestCase):
+    """上传流水线"""
+
+    def test_multipart_upload_hashes_and_sniffs(self):
+        data = make_jpeg((320, 200))
+        upload = SimpleUploadedFile('photo.jpg', data, content_type='image/jpeg')
+        response = self.client.post('/api/images/', {'file': upload, 'tags': ['旅行']}, format='multipart')
+        self.assertEqual(response.status_code, 201)
+
+        image = Image.objects.get(id=response.data['id'])
+        self.assertEqual(image.content_hash, hashlib.sha256(data).hexdigest())
+        self.assertEqual((image.width, image.height), (320, 200))
+        self.assertEqual(image.size, len(data))
+        self.assertEqual(list(image.tags.values_list('name', flat=True)), ['旅行'])
+        self.schedule.assert_called_once_with()
+
+    def test_chunked_upload_resume(self):
+        data = make_jpeg((800, 600))
+        session = self.client.post('/api/uploads/', {
+            'filename': 'big.jpg', 'size': len(data), 'tags': ['风景'], 'is_public': True,
+        }, format='json').data
+        url = f"/api/uploads/{session['id']}/"
+        half = len(data) // 2
+
+        response = self.client.put(url + 'chunk/', data[:half], content_type='application/octet-stream',
+                                   HTTP_UPLOAD_OFFSET='0')
+        self.assertEqual(response.data['received_size'], half)
+
+        # 偏移量错误时返回当前进度
+        response = self.client.put(url + 'chunk/', data[half:], content_type='application/octet-stream',
+                                   HTTP_UPLOAD_OFFSET='0')
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.data['received_size'], half)
+
+        self.assertEqual(self.client.post(url + 'complete/').status_code, 400)
+
+        offset = self.client.get(url).data['received_size']
+        self.client.put(url + 'chunk/', data[offset:], content_type='application/octet-stream',
+                        HTTP_UPLOAD_OFFSET=str(offset))
+        response = self.client.post(url + 'complete/')
+        self.assertEqual(response.status_code, 201)
+
+        image = Image.objects.get(id=response.data['id'])
+        self.assertTrue(image.is_public)
+        self.assertEqual(image.content_hash, hashlib.sha256(data).hexdigest())
+        self.assertEqual((image.width, image.height), (800, 600))
+        with image.file.open('rb') as f:
+            self.assertEqual(f.read(), data)
+
+    def test_temp_files_removed(self):
+        from datetime import timedelta
+        from .models import UploadSession
+        from .tasks import cleanup_stale_upload_sessions
+
+        data = make_jpeg((200, 100))
+        sessions = []
+        for _ in range(2):
+            session = self.client.post('/api/uploads/', {'filename': 'same.jpg', 'size': len(data)}, format='json').data
+            url = f"/api/uploads/{session['id']}/"
+            self.client.put(url + 'chunk/', data, content_type='application/octet-stream', HTTP_UPLOAD_OFFSET='0')
+            self.assertEqual(self.client.post(url + 'complete/').status_code, 201)
+            sessions.append(UploadSession.objects.get(id=session['id']))
+        # 第二次上传复用已有 blob，临时文件同样被删除
+        self.assertEqual(len({session.image.blob_id for session in sessions}), 1)
+        for session in sessions:
+            self.assertFalse(os.path.exists(session.temp_path))
+
+        # 过期会话（包括已完成的）连同残留的临时文件一起清理
+        leftover = sessions[1].temp_path
+        with open(leftover, 'wb') as f:
+            f.write(b'partial')
+        UploadSession.objects.update(updated_at=timezone.now() - timedelta(days=2))
+        self.assertEqual(cleanup_stale_upload_sessions.apply().get()['cleaned'], 2)
+        self.assertFalse(os.path.exists(leftover))
+        self.assertFalse(UploadSession.objects.exists())
+
+    def test_chunk_size_limit(self):
+        data = make_jpeg()
+        session = self.client.post('/api/uploads/', {'filename': 'a.jpg', 'size': len(data)}, format='json').data
+        response = self.client.put(f"/api/uploads/{session['id']}/chunk/", data + b'extra',
+                                   content_type='application/octet-stream', HTTP_UPLOAD_OFFSET='0')
+        self.assertEqual(response.status_code, 413)
+
+    def test_rejects_bad_extension(self):
+        response = self.client.post('/api/uploads/', {'filename': 'a.exe', 'size': 10}, format='json')
+        self.assertEqual(response.status_code, 400)
+
+
+class ImageBlobDedupTests(MediaTestCase):
+    """按内容哈希去重存储"""
+
+    def setUp(self):
+        super().setUp()
+        self.bob = User.objects.create_user(username='bob', password='pass12345')
+        self.data = make_jpeg((120, 80))
+
+    def upload(self, user, name='photo.jpg'):
+        self.client.force_authenticate(user)
+        upload = SimpleUploadedFile(name, self.data, content_type='image/jpeg')
+        response = self.client.post('/api/images/', {'file': upload}, format='multipart')
+        self.assertEqual(response.status_code, 201)
+        return Image.objects.get(id=response.data['id'])
+
+    def test_same_content_shares_blob(self):
+        from .models import ImageBlob
+
+        first = self.upload(self.user)
+        second = self.upload(self.bob, name='copy.jpg')
+        self.assertEqual(first.blob_id, second.blob_id)
+        self.assertEqual(first.file.name, second.file.name)
+        blob = ImageBlob.objects.get()
+        self.assertEqual(blob.ref_count, 2)
+        path = first.file.path
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.force_authenticate(self.user)
+            self.assertEqual(self.client.delete(f'/api/images/{first.id}/').status_code, 204)
+        blob.refresh_from_db()
+        self.assertEqual(blob.ref_count, 1)
+        self.assertTrue(os.path.exists(path))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            second.delete()
+        self.assertFalse(ImageBlob.objects.exists())
+        self.assertFalse(os.path.exists(path))
+
+    def test_processing_reused_for_duplicate(self):
+        from .tasks import generate_thumbnail, parse_exif_and_generate_tags
+
+        first = self.upload(self.user)
+        generate_thumbnail(first)
+        parse_exif_and_generate_tags(first)
+        first.blob.refresh_from_db()
+        self.assertTrue(first.blob.thumbnail_path)
+        self.assertIsNotNone(first.blob.exif_data)
+
+        second = self.upload(self.bob)
+        with mock.patch('apps.images.tasks.PILImage.open') as pil_open:
+            generate_thumbnail(second)
+            parse_exif_and_generate_tags(second)
+        pil_open.assert_not_called()
+        self.assertEqual(second.thumbnail.name, first.blob.thumbnail_path)
+
+
+class ImageRenditionTests(MediaTestCase):
+    """响应式多尺寸图片"""
+
+    @override_settings(IMAGE_RENDITION_WIDTHS=[150, 300, 800], IMAGE_RENDITION_FORMATS=['webp'])
+    def test_ladder_generated_in_one_decode(self):
+        from PIL import Image as PILImage
+        from .tasks import generate_thumbnail
+
+        upload = SimpleUploadedFile('wide.jpg', make_jpeg((500, 250)), content_type='image/jpeg')
+        image = Image.objects.get(id=self.client.post('/api/images/', {'file': upload}, format='multipart').data['id'])
+        with mock.patch('apps.images.tasks.PILImage.open', wraps=PILImage.open) as pil_open:
+            generate_thumbnail(image)
+        self.assertEqual(pil_open.call_count, 1)
+
+        # 不放大原图：800 档使用原图宽度
+        self.assertEqual(
+            [(item['width'], item['height']) for item in image.renditions],
+            [(150, 75), (300, 150), (500, 250)],
+        )
+        for item in image.renditions:
+            self.assertTrue(item['path'].endswith('.webp'))
+            self.assertTrue(os.path.exists(os.path.join(self.media_root, item['path'])))
+
+        data = self.client.get(f'/api/images/{image.id}/').data['renditions']
+        self.assertEqual(list(data), ['webp'])
+        self.assertEqual([source['width'] for source in data['webp']['sources']], [150, 300, 500])
+        self.assertIn(' 150w, ', data['webp']['srcset'])
+
+        # 删除最后一个引用时一并删除多尺寸图片
+        paths = [os.path.join(self.media_root, item['path']) for item in image.renditions]
+        with self.captureOnCommitCallbacks(execute=True):
+            image.delete()
+        self.assertFalse(any(os.path.exists(path) for path in paths))
+
+    @override_settings(IMAGE_RENDITION_WIDTHS=[150, 300], IMAGE_RENDITION_FORMATS=['webp'])
+    def test_reduced_decoding(self):
+        from PIL import Image as PILImage
+        from .renditions import decode_image
+
+        for fmt in ['JPEG', 'PNG']:
+            with self.subTest(fmt=fmt):
+                buffer = BytesIO()
+                PILImage.new('RGB', (2400, 1200), (10, 120, 200)).save(buffer, format=fmt)
+                full = decode_image(BytesIO(buffer.getvalue()), (300, 300), reduced=False)
+                reduced = decode_image(BytesIO(buffer.getvalue()), (300, 300))
+                self.assertEqual(full.size, (2400, 1200))
+                # 只降到输出所需的最大宽度（300）以上
+                self.assertLess(reduced.width, 1200)
+                self.assertGreaterEqual(reduced.width, 300)
+                self.assertEqual(reduced.mode, 'RGB')
+
+
+class ImageProcessingContextTests(MediaTestCase):
+    """处理任务共用一次读取"""
+
+    def test_original_read_once(self):
+        from django.core.files.storage import FileSystemStorage
+        from PIL import Image as PILImage
+        from .tasks import process_image_async
+
+        upload = SimpleUploadedFile('photo.jpg', make_jpeg((640, 480)), content_type='image/jpeg')
+        image_id = self.client.post('/api/images/', {'file': upload}, format='multipart').data['id']
+
+        storage_open = FileSystemStorage._open
+        with mock.patch.object(FileSystemStorage, '_open', autospec=True, side_effect=storage_open) as opened, \
+                mock.patch('apps.images.tasks.PILImage.open', wraps=PILImage.open) as pil_open:
+            result = process_image_async.apply(args=[image_id]).get()
+        self.assertEqual(opened.call_count, 1)
+        self.assertEqual(pil_open.call_count, 1)
+
+        self.assertEqual(result['status'], 'success')
+        for stage in ['read', 'header', 'decode', 'renditions', 'thumbnail', 'exif']:
+            self.assertIn(stage, result['timings'])
+        image = Image.objects.get(id=image_id)
+        self.assertTrue(image.thumbnail_generated)
+        self.assertTrue(image.exif_parsed)
+        self.assertEqual(image.processing_status, 'completed')
+
+
+class ImageBatchProcessingTests(MediaTestCase):
+    """合并投递与批量处理"""
+
+    def upload(self, data, name='photo.jpg'):
+        upload = SimpleUploadedFile(name, data, content_type='image/jpeg')
+        return self.client.post('/api/images/', {'file': upload}, format='multipart').data['id']
+
+    def test_enqueues_coalesced(self):
+        cache.delete(BATCH_SCHEDULED_KEY)
+        self.addCleanup(cache.delete, BATCH_SCHEDULED_KEY)
+        with mock.patch('apps.images.tasks.process_pending_images.apply_async') as apply_async:
+            for _ in range(5):
+                schedule_image_processing()
+        apply_async.assert_called_once()
+
+    @override_settings(IMAGE_RENDITION_FORMATS=['webp'], IMAGE_BATCH_WRITE_SIZE=2)
+    def test_pending_images_processed_in_batches(self):
+        from apps.tags.models import Tag
+        from .tasks import process_pending_images
+
+        same = make_jpeg((640, 480))
+        ids = [self.upload(same), self.upload(same, 'copy.jpg'), self.upload(make_jpeg((300, 500), (0, 0, 255)))]
+        missing = make_image(self.user, filename='missing.jpg').id
+
+        with self.captureOnCommitCallbacks(execute=True):
+            result = process_pending_images.apply().get()
+        self.assertEqual(sorted(result['completed']), ids)
+        self.assertEqual(result['failed'], [missing])
+        # 各阶段耗时累计后随任务结果返回
+        self.assertTrue({'read', 'decode', 'exif', 'write'} <= result['timings'].keys())
+
+        images = Image.objects.in_bulk(ids + [missing])
+        self.assertEqual(images[missing].processing_status, 'failed')
+        first, copy, portrait = (images[pk] for pk in ids)
+        for image in (first, copy, portrait):
+            self.assertEqual(image.processing_status, 'completed')
+            self.assertTrue(image.thumbnail_generated)
+            self.assertTrue(image.exif_parsed)
+            self.assertTrue(image.renditions)
+        # 相同内容只处理一次
+        self.assertEqual(first.thumbnail.name, copy.thumbnail.name)
+        self.assertEqual(first.blob.thumbnail_path, first.thumbnail.name)
+
+        # 自动标签通过 bulk_create 创建，计数和索引同步更新
+        self.assertEqual(set(portrait.tags.values_list('name', flat=True)), {'竖向'})
+        self.assertEqual(Tag.objects.get(name='横向').usage_count, 2)
+        response = self.client.get('/api/images/', {'search': '竖向'})
+        self.assertEqual([item['id'] for item in response.data], [portrait.id])
+
+
+    def test_chunk_failure_and_stale_processing(self):
+        from .tasks import process_pending_images
+
+        ids = [self.upload(make_jpeg()), self.upload(make_jpeg(color=(0, 255, 0)), 'green.jpg')]
+        with mock.patch('apps.images.processing.write_batch_results', side_effect=RuntimeError('db')):
+            result = process_pending_images.apply().get()
+        self.assertEqual(sorted(result['failed']), ids)
+        self.assertEqual(set(Image.objects.filter(id__in=ids).values_list('processing_status', flat=True)), {'failed'})
+
+        # worker 中断后停留在 processing 的图片超时后重新处理
+        stale = timezone.now() - timedelta(hours=1)
+        Image.objects.filter(id=ids[0]).update(processing_status='processing', processing_started_at=stale)
+        Image.objects.filter(id=ids[1]).update(processing_status='processing', processing_started_at=timezone.now())
+        with self.captureOnCommitCallbacks(execute=True):
+            result = process_pending_images.apply().get()
+        self.assertEqual(result['completed'], ids[:1])
+        self.assertEqual(Image.objects.get(id=ids[1]).processing_status, 'processing')
+
+
+class VisionAPIStub:
+    """本地 Vision API：记录请求头，按 status 返回固定结果"""
+
+    def __init__(self, content):
+        import json
+        import threading
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+        stub = self
+        self.status = 200
+        self.requests = []
+        body = json.dumps({'choices': [{'message': {'content': content}}]}).encode('utf-8')
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_POST(self):
+                payload = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+                stub.requests.append((dict(self.headers), payload))
+                data = body if stub.status == 200 else b'{}'
+                self.send_response(stub.status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f'http://127.0.0.1:{self.server.server_port}/v1/chat/completions'
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class VisionTestCase(MediaTestCase):
+    """使用本地 Vision API，当前用户已配置 API Key 并上传了一张图片"""
+
+    def setUp(self):
+        super().setUp()
+        clear_caches()
+        self.addCleanup(clear_caches)
+        self.stub = VisionAPIStub('{"description": "湖边的日落", "tags": ["风景", "日落"]}')
+        self.addCleanup(self.stub.close)
+        settings_override = override_settings(VISION_API_URL=self.stub.url)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        profile = self.user.profile
+        profile.vision_api_key = 'sk-test'
+        profile.save()
+        upload = SimpleUploadedFile('photo.jpg', make_jpeg(), content_type='image/jpeg')
+        self.image = Image.objects.get(
+            id=self.client.post('/api/images/', {'file': upload}, format='multipart').data['id']
+        )
+
+
+class AIDescriptionTests(VisionTestCase):
+    """AI 描述任务：接口返回任务标识，Celery 任务调用 Vision API 并写回结果"""
+
+    def generate(self):
+        from .tasks import ai_analyze_image_task
+
+        with mock.patch.object(ai_analyze_image_task, 'delay',
+                               side_effect=lambda *args: ai_analyze_image_task.apply(args=args)):
+            with self.captureOnCommitCallbacks(execute=True):
+                response = self.client.post(f'/api/images/{self.image.id}/generate_ai_description/')
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.data['status'], 'pending')
+        return self.client.get(f"/api/images/ai_jobs/{response.data['job_id']}/")
+
+    def test_job_completes_with_description_and_tags(self):
+        response = self.generate()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['status'], 'success')
+        self.assertEqual(response.data['description'], '湖边的日落')
+        self.assertEqual([tag['name'] for tag in response.data['tags']], ['风景', '日落'])
+        self.assertNotIn('owner_id', response.data)
+
+        self.image.refresh_from_db()
+        self.assertEqual(self.image.description, '湖边的日落')
+        self.assertEqual(set(self.image.tags.values_list('name', flat=True)), {'风景', '日落'})
+        headers, payload = self.stub.requests[0]
+        self.assertEqual(headers['Authorization'], 'Bearer sk-test')
+        self.assertTrue(payload['messages'][1]['content'][1]['image_url']['url'].startswith('data:image/jpeg;base64,'))
+
+    def test_client_error_fails_without_retry(self):
+        self.stub.status = 401
+        response = self.generate()
+        self.assertEqual(response.data['status'], 'failed')
+        self.assertEqual(len(self.stub.requests), 1)
+        self.image.refresh_from_db()
+        self.assertEqual(self.image.description, '')
+
+    def test_server_error_retried(self):
+        from .tasks import ai_analyze_image_task
+
+        self.stub.status = 503
+        response = self.generate()
+        self.assertEqual(response.data['status'], 'failed')
+        self.assertEqual(len(self.stub.requests), ai_analyze_image_task.max_retries + 1)
+
+    def test_job_hidden_from_other_users(self):
+        from .ai import create_job
+
+        job_id = create_job(self.image)
+        other = APIClient()
+        other.force_authenticate(User.objects.create_user(username='bob', password='pass12345'))
+        self.assertEqual(other.get(f'/api/images/ai_jobs/{job_id}/').status_code, 404)
+        self.assertEqual(self.client.get(f'/api/images/ai_jobs/{job_id}/').data['status'], 'pending')
+
+    def upload_noise(self, size):
+        from PIL import Image as PILImage
+
+        buffer = BytesIO()
+        PILImage.frombytes('RGB', size, os.urandom(size[0] * size[1] * 3)).save(buffer, format='JPEG', quality=95)
+        upload = SimpleUploadedFile('large.jpg', buffer.getvalue(), content_type='image/jpeg')
+        self.image = Image.objects.get(
+            id=self.client.post('/api/images/', {'file': upload}, format='multipart').data['id']
+        )
+
+    def sent_image(self):
+        import base64
+        from PIL import Image as PILImage
+
+        headers, payload = self.stub.requests[-1]
+        data = base64.b64decode(payload['messages'][1]['content'][1]['image_url']['url'].split(',', 1)[1])
+        return headers, data, PILImage.open(BytesIO(data))
+
+    @override_settings(VISION_IMAGE_MAX_EDGE=256)
+    def test_sends_downscaled_jpeg_and_records_metrics(self):
+        from .ai import vision_api_stats
+
+        self.upload_noise((1200, 800))
+        response = self.generate()
+        self.assertEqual(response.data['status'], 'success')
+
+        headers, data, sent = self.sent_image()
+        self.assertEqual(sent.format, 'JPEG')
+        self.assertEqual(sent.size, (256, 171))
+        metrics = response.data['metrics']
+        self.assertEqual(metrics['image_bytes'], len(data))
+        self.assertEqual(metrics['request_bytes'], int(headers['Content-Length']))
+        self.assertNotIn('Transfer-Encoding', headers)
+        self.assertGreater(metrics['response_bytes'], 0)
+
+        stats = vision_api_stats()
+        self.assertEqual(stats['calls'], 1)
+        self.assertEqual(stats['errors'], 0)
+        self.assertEqual(stats['request_bytes'], metrics['request_bytes'])
+
+    @override_settings(VISION_IMAGE_MAX_EDGE=1024, VISION_IMAGE_MAX_BYTES=40 * 1024)
+    def test_payload_size_capped(self):
+        self.upload_noise((1600, 1200))
+        self.generate()
+        _, data, sent = self.sent_image()
+        self.assertLessEqual(len(data), 40 * 1024)
+        self.assertLess(max(sent.size), 1024)
+
+    def test_streamed_payload_matches_json(self):
+        import base64
+        import json
+        from .ai import IMAGE_PLACEHOLDER, StreamedPayload, build_payload
+
+        data = os.urandom(StreamedPayload.CHUNK_SIZE * 2 + 7)
+        body = StreamedPayload(build_payload(f'data:image/jpeg;base64,{IMAGE_PLACEHOLDER}'), data)
+        expected = json.dumps(build_payload('data:image/jpeg;base64,' + base64.b64encode(data).decode()))
+        self.assertEqual(b''.join(body), expected.encode('utf-8'))
+        self.assertEqual(len(body), len(expected))
+
+    @override_settings(VISION_API_MAX_CONCURRENCY=1)
+    def test_concurrency_limited_per_api_key(self):
+        from .ai import ConcurrencyLimited, api_key_slot
+
+        with api_key_slot('sk-test'):
+            with self.assertRaises(ConcurrencyLimited):
+                with api_key_slot('sk-test'):
+                    pass
+            with api_key_slot('sk-other'):
+                pass
+        # 名额释放后可以再次占用
+        with api_key_slot('sk-test'):
+            pass
+
+
+@override_settings(VISION_API_RATE=1000, VISION_API_BURST=1000)
+class AIBatchTests(VisionTestCase):
+    """批量 AI 分析：按内容哈希复用结果、令牌桶限速、进度与恢复"""
+
+    def setUp(self):
+        super().setUp()
+        self.dispatched = []
+        patcher = mock.patch(
+            'apps.images.ai_batch.dispatch_batch',
+            side_effect=lambda batch_id, countdown=0: self.dispatched.append((batch_id, countdown)),
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def upload(self, data, name):
+        upload = SimpleUploadedFile(name, data, content_type='image/jpeg')
+        return self.client.post('/api/images/', {'file': upload}, format='multipart').data['id']
+
+    def start(self, image_ids):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/ai-batches/', {'image_ids': image_ids}, format='json')
+        self.assertEqual(response.status_code, 202)
+        return response.data['id']
+
+    def drive(self):
+        """执行已投递的任务，直到不再投递"""
+        from .ai_batch import run_batch
+
+        countdowns = []
+        while self.dispatched:
+            batch_id, countdown = self.dispatched.pop(0)
+            countdowns.append(countdown)
+            run_batch(batch_id)
+        return countdowns
+
+    def progress(self, batch_id):
+        return self.client.get(f'/api/ai-batches/{batch_id}/').data
+
+    def test_batch_reuses_results_for_identical_content(self):
+        copy = self.upload(make_jpeg(), 'copy.jpg')
+        other = self.upload(make_jpeg(color=(0, 0, 255)), 'blue.jpg')
+        foreign = make_image(User.objects.create_user(username='bob', password='pass12345'))
+
+        batch_id = self.start([self.image.id, copy, other, foreign.id])
+        self.assertEqual(self.progress(batch_id)['total'], 3)
+        self.drive()
+
+        progress = self.progress(batch_id)
+        self.assertEqual(progress['status'], 'completed')
+        self.assertEqual((progress['success'], progress['cached'], progress['failed']), (2, 1, 0))
+        self.assertEqual(progress['progress'], 1)
+        self.assertEqual(len(self.stub.requests), 2)
+        for image in Image.objects.filter(id__in=[self.image.id, copy, other]):
+            self.assertEqual(image.description, '湖边的日落')
+        self.assertEqual(Image.objects.get(id=foreign.id).description, '')
+
+        # 单张分析也使用缓存结果
+        from .tasks import ai_analyze_image_task
+        result = ai_analyze_image_task.apply(args=[copy]).get()
+        self.assertTrue(result['cached'])
+        self.assertEqual(len(self.stub.requests), 2)
+
+    @override_settings(VISION_API_RATE=0.01, VISION_API_BURST=1, VISION_BATCH_CHUNK=5)
+    def test_rate_limited_batch_resumes_after_restart(self):
+        from .ai_batch import resume_stale_batches, run_batch
+        from .models import AIBatch
+
+        other = self.upload(make_jpeg(color=(0, 0, 255)), 'blue.jpg')
+        batch_id = self.start([self.image.id, other])
+        run_batch(self.dispatched.pop(0)[0])
+
+        # 令牌用完：本段只发送一张，按等待时间延迟投递下一段
+        self.assertEqual(len(self.stub.requests), 1)
+        self.assertEqual(self.progress(batch_id)['pending'], 1)
+        (_, countdown), = self.dispatched
+        self.assertGreater(countdown, 60)
+
+        # 模拟投递丢失（worker 重启），定时任务重新投递没有进展的批次
+        self.dispatched.clear()
+        self.assertEqual(resume_stale_batches(), 0)
+        AIBatch.objects.filter(id=batch_id).update(updated_at=timezone.now() - timedelta(hours=1))
+        self.assertEqual(resume_stale_batches(), 1)
+        with override_settings(VISION_API_RATE=1000):
+            self.drive()
+        self.assertEqual(self.progress(batch_id)['status'], 'completed')
+        self.assertEqual(len(self.stub.requests), 2)
+
+    @override_settings(VISION_BATCH_MAX_ATTEMPTS=2)
+    def test_retryable_errors_then_resume(self):
+        self.stub.status = 503
+        batch_id = self.start([self.image.id])
+        self.assertEqual(self.drive(), [0, 5])
+        progress = self.progress(batch_id)
+        self.assertEqual((progress['status'], progress['failed']), ('completed', 1))
+        self.assertEqual(progress['failures'][0]['image'], self.image.id)
+        self.assertEqual(len(self.stub.requests), 2)
+
+        self.stub.status = 200
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(f'/api/ai-batches/{batch_id}/resume/')
+        self.assertEqual(response.data['pending'], 1)
+        self.drive()
+        self.assertEqual(self.progress(batch_id)['success'], 1)
+
+    def test_token_bucket(self):
+        from .ai import take_token
+
+        with override_settings(VISION_API_RATE=1, VISION_API_BURST=2):
+            self.assertEqual(take_token('sk-test'), 0)
+            self.assertEqual(take_token('sk-test'), 0)
+            self.assertAlmostEqual(take_token('sk-test'), 1, delta=0.1)
+            self.assertEqual(take_token('sk-other'), 0)
+
+    def test_batch_hidden_from_other_users(self):
+        batch_id = self.start([self.image.id])
+        other = APIClient()
+        other.force_authenticate(User.objects.create_user(username='bob', password='pass12345'))
+        self.assertEqual(other.get(f'/api/ai-batches/{batch_id}/').status_code, 404)
+        response = other.post('/api/ai-batches/', {'image_ids': [self.image.id]}, format='json')
+        self.assertEqual(response.status_code, 400)
+
+
+@override_settings(IMAGE_RENDITION_FORMATS=['webp'])
+class OrphanFileGCTests(MediaTestCase):
+    """孤立文件增量回收"""
+
+    def setUp(self):
+        super().setUp()
+        from django.core.files.base import ContentFile
+        from django.core.files.storage import default_storage
+        from .tasks import process_pending_images
+
+        clear_caches()
+        self.addCleanup(clear_caches)
+        self.storage = default_storage
+
+        upload = SimpleUploadedFile('photo.jpg', make_jpeg((400, 300)), content_type='image/jpeg')
+        self.client.post('/api/images/', {'file': upload}, format='multipart')
+        with self.captureOnCommitCallbacks(execute=True):
+            process_pending_images.apply()
+        blob_image = Image.objects.get()
+        self.assertTrue(blob_image.thumbnail.name and blob_image.renditions)
+
+        # 旧数据：文件独占存储在 uploads/user_<id>/ 下
+        prefix = f'user_{self.user.id}'
+        legacy = {
+            'file': f'uploads/{prefix}/legacy.jpg',
+            'thumbnail': f'thumbnails/{prefix}/legacy_thumb.jpg',
+            'rendition': f'renditions/uploads/{prefix}/legacy_150w.webp',
+        }
+        for path in legacy.values():
+            self.storage.save(path, ContentFile(b'x'))
+        make_image(self.user, file=legacy['file'], thumbnail=legacy['thumbnail'],
+                   renditions=[{'width': 150, 'height': 100, 'format': 'webp', 'path': legacy['rendition'], 'size': 1}])
+
+        blob_stem = os.path.splitext(blob_image.blob.file_path)[0]
+        self.orphans = [
+            f'uploads/{prefix}/orphan.jpg',
+            f'thumbnails/{prefix}/edited_thumb.jpg',
+            f'renditions/{blob_stem}_9999w.webp',
+            'blobs/ff/ff/' + 'f' * 64 + '.jpg',
+            'uploads/loose.jpg',
+        ]
+        for path in self.orphans:
+            self.storage.save(path, ContentFile(b'orphan'))
+
+        self.referenced = [blob_image.file.name, blob_image.thumbnail.name, *legacy.values()]
+        self.referenced += [item['path'] for item in blob_image.renditions]
+
+        # 只回收修改时间足够早的文件
+        old = time.time() - 2 * 60 * 60
+        for root, _, files in os.walk(self.media_root):
+            for name in files:
+                os.utime(os.path.join(root, name), (old, old))
+        self.fresh = f'uploads/{prefix}/fresh.jpg'
+        self.storage.save(self.fresh, ContentFile(b'new'))
+
+    def assert_files(self, paths, exist=True):
+        for path in paths:
+            self.assertEqual(self.storage.exists(path), exist, path)
+
+    def test_dry_run_reports_without_deleting(self):
+        from .gc import collect_orphans
+
+        report = collect_orphans(dry_run=True, delete_rate=0)
+        self.assertEqual(report['orphans'], len(self.orphans))
+        self.assertEqual(report['deleted'], 0)
+        self.assertEqual(report['skipped_recent'], 1)
+        self.assertTrue(report['completed'])
+        self.assert_files(self.orphans)
+
+    def test_collects_orphans_across_layout(self):
+        from .gc import collect_orphans
+
+        report = collect_orphans(full=True, delete_rate=0)
+        self.assertEqual(report['deleted'], len(self.orphans))
+        self.assertEqual(report['files_scanned'], len(self.orphans) + len(self.referenced) + 1)
+        self.assertGreater(report['files_per_second'], 0)
+        self.assert_files(self.orphans, exist=False)
+        self.assert_files(self.referenced + [self.fresh])
+
+    def test_resumes_from_checkpoint(self):
+        from .gc import collect_orphans, iter_shards
+
+        shards = list(iter_shards())
+        self.assertEqual(
+            [shard.path for shard in shards],
+            sorted((shard.path for shard in shards), key=lambda path: path.split('/')),
+        )
+        runs = []
+        while True:
+            report = collect_orphans(max_shards=2, delete_rate=0)
+            runs.append(report)
+            if report['completed']:
+                break
+            self.assertIsNotNone(report['checkpoint'])
+        self.assertEqual(sum(report['shards'] for report in runs), len(shards))
+        self.assertEqual(sum(report['deleted'] for report in runs), len(self.orphans))
+        self.assertGreater(len(runs), 1)
+        self.assert_files(self.referenced)
+
+    def test_merge_join_streams_sorted_paths(self):
+        from .gc import Shard, iter_referenced_paths, iter_stored_files, merge_orphans
+
+        shard = Shard(f'thumbnails/user_{self.user.id}')
+        stored = list(iter_stored_files(shard))
+        self.assertEqual(stored, sorted(stored))
+        referenced = list(iter_referenced_paths(shard, batch_size=1))
+        self.assertEqual(referenced, [f'thumbnails/user_{self.user.id}/legacy_thumb.jpg'])
+        self.assertEqual(list(merge_orphans(stored, referenced)), [f'thumbnails/user_{self.user.id}/edited_thumb.jpg'])
+        self.assertEqual(list(merge_orphans(['a', 'b', 'c', 'd'], iter(['b', 'b', 'c', 'e']))), ['a', 'd'])
+
+
+@skipUnless(connection.vendor == 'sqlite', 'EXPLAIN QUERY PLAN 输出格式为 SQLite 专有')
+class FileDeletionTests(MediaTestCase):
+    """删除图片后在事务提交后分批删除文件"""
+
+    def setUp(self):
+        super().setUp()
+        from django.core.files.base import ContentFile
+        from django.core.files.storage import default_storage
+
+        self.storage = default_storage
+        self.images, self.paths = [], []
+        for index in range(3):
+            paths = [f'uploads/user_{self.user.id}/{index}.jpg', f'thumbnails/user_{self.user.id}/{index}_thumb.jpg']
+            for path in paths:
+                self.storage.save(path, ContentFile(b'x'))
+            self.images.append(make_image(self.user, file=paths[0], thumbnail=paths[1]))
+            self.paths += paths
+
+    def assert_files(self, paths, exist=True):
+        for path in paths:
+            self.assertEqual(self.storage.exists(path), exist, path)
+
+    def batch_delete(self):
+        admin = User.objects.create_user(username='admin', password='pass12345', is_staff=True)
+        self.client.force_authenticate(admin)
+        ids = [image.id for image in self.images]
+        return self.client.delete('/api/admin/images/batch_delete/', {'ids': ids}, format='json')
+
+    def test_batch_delete_enqueues_after_commit(self):
+        from .tasks import delete_files_task
+
+        delete_files_task.apply_async.reset_mock()
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.assertEqual(self.batch_delete().status_code, 200)
+            self.assertFalse(Image.objects.exists())
+        # 提交前不删除文件，提交后整个批量删除只投递一个任务
+        self.assert_files(self.paths)
+        delete_files_task.apply_async.assert_not_called()
+        for callback in callbacks:
+            callback()
+        self.assertEqual(delete_files_task.apply_async.call_count, 1)
+        self.assertEqual(sorted(delete_files_task.apply_async.call_args.kwargs['args'][0]), sorted(self.paths))
+        self.assert_files(self.paths, exist=False)
+
+    def test_split_into_batches(self):
+        from .tasks import delete_files_task
+
+        delete_files_task.apply_async.reset_mock()
+        with override_settings(FILE_DELETE_BATCH_SIZE=4), self.captureOnCommitCallbacks(execute=True):
+            self.batch_delete()
+        self.assertEqual([len(call.kwargs['args'][0]) for call in delete_files_task.apply_async.call_args_list], [4, 2])
+        self.assert_files(self.paths, exist=False)
+
+    def test_rollback_keeps_files(self):
+        from django.db import transaction
+        from .blobs import defer_file_deletion
+
+        image_id = self.images[0].id
+        with self.captureOnCommitCallbacks(execute=True):
+            with self.assertRaises(RuntimeError), transaction.atomic(), defer_file_deletion():
+                self.images[0].delete()
+                raise RuntimeError
+        self.assertTrue(Image.objects.filter(id=image_id).exists())
+        self.assert_files(self.paths)
+
+    def test_task_idempotent_and_skips_referenced(self):
+        from .tasks import delete_files_task
+
+        image = self.images[0]
+        paths = [image.file.name, image.thumbnail.name]
+        Image.objects.filter(id=image.id).delete()
+        # 投递后又有记录引用了同一路径
+        make_image(self.user, file=paths[0])
+        result = delete_files_task.apply(args=[paths]).get()
+        self.assertEqual(result, {'status': 'success', 'deleted': 1})
+        self.assert_files(paths[:1])
+        self.assert_files(paths[1:], exist=False)
+        self.assertEqual(delete_files_task.apply(args=[paths]).get()['deleted'], 1)
+
+    def test_reupload_while_deletion_pending(self):
+        from .models import ImageBlob
+
+        data = make_jpeg()
+
+        def upload():
+            file = SimpleUploadedFile('photo.jpg', data, content_type='image/jpeg')
+            return Image.objects.get(id=self.client.post('/api/images/', {'file': file}, format='multipart').data['id'])
+
+        first = upload()
+        old_path = first.file.name
+        with self.captureOnCommitCallbacks() as pending:
+            self.client.delete(f'/api/images/{first.id}/')
+        self.assertFalse(ImageBlob.objects.exists())
+
+        # 删除任务执行前再次上传相同内容：写入新文件，不复用等待删除的旧文件
+        second = upload()
+        self.assertNotEqual(second.file.name, old_path)
+        for callback in pending:
+            callback()
+        self.assert_files([old_path], exist=False)
+        self.assert_files([second.file.name])
+        with second.file.open('rb') as f:
+            self.assertEqual(f.read(), data)
+
+    def test_fallback_when_broker_unavailable(self):
+        from .tasks import delete_files_task
+
+        with mock.patch.object(delete_files_task, 'apply_async', side_effect=OSError('broker down')):
+            with self.captureOnCommitCallbacks(execute=True):
+                response = self.client.delete(f'/api/images/{self.images[0].id}/')
+        self.assertEqual(response.status_code, 204)
+        self.assert_files(self.paths[:2], exist=False)
+        self.assert_files(self.paths[2:])
+
+
+class ImageQueryPlanTests(TestCase):
+    """主要列表查询必须走索引，不能退化为全表扫描或临时排序"""
+
+    def setUp(self):
+        clear_caches()
+        self.addCleanup(clear_caches)
+        self.user = User.objects.create_user(username='alice', password='pass12345')
+        other = User.objects.create_user(username='bob', password='pass12345')
+        tag = Tag.objects.create(name='风景')
+        for i in range(20):
+            image = make_image(self.user if i % 2 else other, filename=f'{i}.jpg', size=i, is_public=i % 3 == 0)
+            if i % 4 == 0:
+                ImageTag.objects.create(image=image, tag=tag)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def plans(self, url, params):
+        with CaptureQueriesContext(connection) as ctx:
+            self.assertEqual(self.client.get(url, params).status_code, 200)
+        plans = []
+        for query in ctx.captured_queries:
+            if query['sql'].startswith('SELECT') and 'FROM "images"' in query['sql']:
+                with connection.cursor() as cursor:
+                    cursor.execute('EXPLAIN QUERY PLAN ' + query['sql'])
+                    plans.append((query['sql'], [row[-1] for row in cursor.fetchall()]))
+        self.assertTrue(plans)
+        return plans
+
+    def assertIndexed(self, url, params, ordered=True):
+        for sql, plan in self.plans(url, params):
+            for step in plan:
+                self.assertFalse(step.startswith('SCAN images') and 'INDEX' not in step, f'{sql}\n{plan}')
+                if ordered:
+                    self.assertNotIn('TEMP B-TREE', step, f'{sql}\n{plan}')
+
+    def test_listings_use_indexes(self):
+        cases = [
+            ('/api/my-images/', {'page_size': 5}),
+            ('/api/my-images/', {'page_size': 5, 'ordering': 'upload_time'}),
+            ('/api/images/public/', {'page_size': 5}),
+            ('/api/images/public/', {'page_size': 5, 'ordering': 'filename'}),
+            ('/api/images/public/', {'page_size': 5, 'ordering': '-size'}),
+            ('/api/images/', {'page_size': 5}),
+        ]
+        for url, params in cases:
+            with self.subTest(url=url, params=params):
+                self.assertIndexed(url, params)
+
+    def test_tag_filters_use_index(self):
+        # 标签子查询走 (tag, image) 索引；选择性高时 SQLite 先取标签命中的行再排序，允许临时排序
+        for mode in ['and', 'or', 'not']:
+            with self.subTest(mode=mode):
+                self.assertIndexed('/api/images/', {'page_size': 5, 'tags': '风景', 'tag_mode': mode}, ordered=False)
+
+    def test_images_by_tag_use_index(self):
+        tag = Tag.objects.get(name='风景')
+        queryset = ImageTag.objects.filter(tag=tag).values('image_id')
+        self.assertIn('image_tags_tag_image_idx', queryset.explain())
@@ -0,0 +1,186 @@
+"""
+图片上传流水线
+
+- HashingUploadHandler：multipart 上传按块直接写入临时文件，
+  接收过程中同时计算 SHA-256 并保留文件头部用于读取尺寸，不在内存中缓存整个文件
+- 分块续传：UploadSession 记录已接收字节数，分块追加到临时文件，
+  完成后以移动文件的方式写入存储
+- create_uploaded_image：普通上传与分块上传共用的图片创建逻辑
+"""
+import hashlib
+import logging
+import os
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files import File
+from django.core.files.uploadhandler import TemporaryFileUploadHandler
+from django.db import transaction
+from PIL import Image as PILImage
+
+logger = logging.getLogger(__name__)
+
+# 读取尺寸时保留的文件头字节数（足以覆盖常见的 EXIF/ICC 段）
+HEADER_BYTES = 256 * 1024
+# 读取文件时的块大小
+READ_CHUNK_SIZE = 1024 * 1024
+
+
+def sniff_image_size(source):
+    """
+    仅读取文件头部获取图片尺寸，不解码像素数据
+
+    Args:
+        source: 文件头部字节，或可 seek 的文件对象（PIL 只读取头部）
+
+    Returns:
+        tuple: (width, height)，无法识别时为 (None, None)
+    """
+    if isinstance(source, (bytes, bytearray)):
+        source = BytesIO(source)
+    try:
+        source.seek(0)
+        with PILImage.open(source) as img:
+            return img.size
+    except Exception:
+        return None, None
+    finally:
+        source.seek(0)
+
+
+def hash_file(file):
+    """分块计算文件的 SHA-256"""
+    hasher = hashlib.sha256()
+    file.seek(0)
+    for chunk in iter(lambda: file.read(READ_CHUNK_SIZE), b''):
+        hasher.update(chunk)
+    file.seek(0)
+    return hasher.hexdigest()
+
+
+class HashingUploadHandler(TemporaryFileUploadHandler):
+    """
+    边接收边计算哈希的上传处理器
+
+    所有上传文件都直接写入临时文件（不使用内存处理器），
+    完成后在文件对象上附加 content_hash 与 image_size 属性
+    """
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.hasher = hashlib.sha256()
+        self.header = bytearray()
+
+    def receive_data_chunk(self, raw_data, start):
+        self.hasher.update(raw_data)
+        if len(self.header) < HEADER_BYTES:
+            self.header.extend(raw_data[:HEADER_BYTES - len(self.header)])
+        return super().receive_data_chunk(raw_data, start)
+
+    def file_complete(self, file_size):
+        file = super().file_complete(file_size)
+        file.content_hash = self.hasher.hexdigest()
+        file.image_size = sniff_image_size(bytes(self.header))
+        return file
+
+
+class AssembledUploadFile(File):
+    """
+    分块上传拼接完成的临时文件
+
+    提供 temporary_file_path，使 FileSystemStorage 直接移动文件而不是复制
+    """
+
+    def temporary_file_path(self):
+        return self.file.name
+
+
+def chunked_upload_path(session_id):
+    """分块上传临时文件路径"""
+    temp_dir = getattr(settings, 'CHUNKED_UPLOAD_TEMP_DIR', os.path.join(settings.BASE_DIR, 'tmp', 'chunked_uploads'))
+    os.makedirs(temp_dir, exist_ok=True)
+    return os.path.join(temp_dir, f'{session_id.hex}.part')
+
+
+def append_chunk(path, offset, stream, max_bytes):
+    """
+    将请求体按块写入临时文件的 offset 位置
+
+    先截断到 offset，丢弃上次中断写入的残留数据
+
+    Returns:
+        int: 写入的字节数
+    """
+    written = 0
+    mode = 'r+b' if os.path.exists(path) else 'w+b'
+    with open(path, mode) as f:
+        f.truncate(offset)
+        f.seek(offset)
+        while True:
+            data = stream.read(min(READ_CHUNK_SIZE, max_bytes - written + 1))
+            if not data:
+                break
+            written += len(data)
+            if written > max_bytes:
+                raise ValueError('分块大小超过限制')
+            f.write(data)
+    return written
+
+
+def create_uploaded_image(owner, file, filename, size, content_hash='', width=None, height=None,
+                          is_public=False, description='', tag_names=None):
+    """
+    创建图片记录并触发异步处理
+
+    普通上传和分块上传共用
+
+    Args:
+        file: 上传文件对象（首次出现的内容会被移动到存储中，重复内容直接丢弃）
+        tag_names: 用户指定的标签名称列表
+    """
+    from .blobs import acquire_blob
+    from .models import Image, attach_tags
+
+    with transaction.atomic():
+        # 相同内容只保存一份文件
+        blob = None
+        if content_hash:
+            ext = filename.split('.')[-1].lower()
+            blob = acquire_blob(file, content_hash, ext, size)
+
+        image = Image.objects.create(
+            owner=owner,
+            file=blob.file_path if blob else file,
+            blob=blob,
+            filename=filename,
+            size=size,
+            width=width,
+            height=height,
+            content_hash=content_hash,
+            is_public=is_public,
+            description=description,
+            processing_status='pending'  # 初始状态为等待处理
+        )
+
+        # 添加用户指定的标签（同步处理，因为用户需要立即看到）
+        if tag_names:
+            attach_tags({image: tag_names}, tag_type='user')
+
+    # 触发异步处理任务（缩略图生成、EXIF解析、AI标注），短时间内的多次上传合并为一个批处理任务
+    try:
+        from .processing import schedule_image_processing
+        schedule_image_processing()
+    except Exception as e:
+        # 如果 Celery 不可用，则同步处理作为降级方案
+        logger.warning(f"异步任务触发失败，使用同步处理: {e}")
+        from .exif_utils import apply_exif_to_image
+        try:
+            apply_exif_to_image(image)
+            image.processing_status = 'completed'
+            image.save(update_fields=['processing_status'])
+        except Exception as ex:
+            logger.error(f"同步 EXIF 解析失败: {ex}")
+            image.processing_status = 'failed'
+            image.save(update_fields=['processing_status'])
+
+    return image
@@ -1,11 +1,13 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import ImageViewSet, MyImagesViewSet, AdminImageViewSet
+from .views import AIBatchViewSet, ImageViewSet, MyImagesViewSet, AdminImageViewSet, UploadSessionViewSet
 
 router = DefaultRouter()
 router.register(r'images', ImageViewSet, basename='image')
 router.register(r'my-images', MyImagesViewSet, basename='my-image')
 router.register(r'admin/images', AdminImageViewSet, basename='admin-image')
+router.register(r'uploads', UploadSessionViewSet, basename='upload')
+router.register(r'ai-batches', AIBatchViewSet, basename='ai-batch')
 
 urlpatterns = [
     path('', include(router.urls)),
@@ -1,13 +1,33 @@
-from rest_framework import viewsets, permissions, status
+import logging
+import os
+
+from rest_framework import viewsets, mixins, permissions, status
 from rest_framework.response import Response
 from rest_framework.parsers import MultiPartParser, FormParser, JSONParser
 from rest_framework.decorators import action
-from django.db.models import Q
+from django.db import transaction
 from django.utils import timezone
 from datetime import timedelta
 
-from .models import Image, ImageTag
-from .serializers import ImageSerializer, ImageUploadSerializer
+from .blobs import defer_file_deletion
+from .models import AIBatch, AIBatchItem, Image, ImageTag, UploadSession
+from .serializers import AIBatchSerializer, ImageCompactSerializer, ImageSerializer, ImageUploadSerializer, UploadSessionSerializer, upload_chunk_size
+from .pagination import ImageKeysetPagination
+from .response_cache import cached_response_data, response_cache_stats
+from .sampling import cached_random_response, random_images_count
+from .search import search_images
+from .stats import get_image_stats, top_uploaders
+from .uploads import AssembledUploadFile, append_chunk, create_uploaded_image, hash_file, sniff_image_size
+from .watermarks import conditional, own_scopes, public_scopes, visible_scopes
+
+logger = logging.getLogger(__name__)
+
+
+def list_serializer_class(request):
+    """列表接口的序列化器：?view=compact 使用紧凑表示"""
+    if request.query_params.get('view') == 'compact':
+        return ImageCompactSerializer
+    return ImageSerializer
 
 
 class ImageViewSet(viewsets.ModelViewSet):
@@ -20,12 +40,16 @@ class ImageViewSet(viewsets.ModelViewSet):
     - is_public: 按公开状态筛选 (true/false)
     - date_from: 上传时间起始
     - date_to: 上传时间截止
-    - search: 搜索文件名或描述
+    - search: 全文检索文件名、描述、标签和相机信息，默认按相关度排序
     - ordering: 排序字段 (upload_time, -upload_time, size, -size)
+    - cursor / page_size: 游标分页（携带任一参数时启用）
+    - fields / omit: 只输出或不输出指定字段（逗号分隔）
+    - view=compact: 列表使用紧凑表示（id、缩略图、尺寸、标签 ID）
     """
     serializer_class = ImageSerializer
     parser_classes = [MultiPartParser, FormParser, JSONParser]
     permission_classes = [permissions.IsAuthenticated]
+    pagination_class = ImageKeysetPagination
     
     def get_queryset(self):
         """
@@ -35,9 +59,9 @@ class ImageViewSet(viewsets.ModelViewSet):
         支持多种筛选条件
         """
         user = self.request.user
-        queryset = Image.objects.filter(
-            Q(owner=user) | Q(is_public=True)
-        ).select_related('owner')
+        # 上传等操作的序列化器不需要预取
+        eager_loading = getattr(self.get_serializer_class(), 'setup_eager_loading', ImageSerializer.setup_eager_loading)
+        queryset = eager_loading(Image.objects.visible_to(user))
         
         # 按用户筛选
         owner_id = self.request.query_params.get('owner')
@@ -72,12 +96,10 @@ class ImageViewSet(viewsets.ModelViewSet):
             elif time_range == 'month':
                 queryset = queryset.filter(upload_time__gte=now - timedelta(days=30))
         
-        # 搜索文件名或描述
+        # 全文检索（文件名、描述、标签、相机信息）
         search = self.request.query_params.get('search')
         if search:
-            queryset = queryset.filter(
-                Q(filename__icontains=search) | Q(description__icontains=search)
-            )
+            queryset = search_images(queryset, search)
         
         # 按标签筛选（支持多种模式）
         # tags: 逗号分隔的标签列表
@@ -85,79 +107,91 @@ class ImageViewSet(viewsets.ModelViewSet):
         tags = self.request.query_params.get('tags')
         tag_mode = self.request.query_params.get('tag_mode', 'and')
         
+        # 标签筛选编译为一个标签 ID 子查询，不会产生重复行
         if tags:
             tag_list = [t.strip() for t in tags.split(',') if t.strip()]
-            if tag_list:
-                if tag_mode == 'or':
-                    # OR模式：包含任意一个标签
-                    queryset = queryset.filter(tags__name__in=tag_list)
-                elif tag_mode == 'not':
-                    # NOT模式：不包含这些标签
-                    queryset = queryset.exclude(tags__name__in=tag_list)
-                else:
-                    # AND模式（默认）：包含所有标签
-                    for tag_name in tag_list:
-                        queryset = queryset.filter(tags__name__iexact=tag_name)
+            queryset = queryset.with_tags(tag_list, tag_mode)
         
         # 兼容旧的单标签筛选
         tag = self.request.query_params.get('tag')
         if tag:
-            queryset = queryset.filter(tags__name__iexact=tag)
+            queryset = queryset.with_tags([tag])
         
-        # 排序
-        ordering = self.request.query_params.get('ordering', '-upload_time')
+        # 排序（搜索时默认按相关度排序）
+        ordering = self.request.query_params.get('ordering', '' if search else '-upload_time')
         if ordering in ['upload_time', '-upload_time', 'size', '-size', 'filename', '-filename']:
             queryset = queryset.order_by(ordering)
         
-        return queryset.distinct()
+        return queryset
     
     def get_serializer_class(self):
         """根据操作类型返回不同的序列化器"""
         if self.action == 'create':
             return ImageUploadSerializer
+        if self.action in ('list', 'public'):
+            return list_serializer_class(self.request)
         return ImageSerializer
     
+    @conditional(visible_scopes)
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
+    
+    @conditional(visible_scopes)
+    def retrieve(self, request, *args, **kwargs):
+        return super().retrieve(request, *args, **kwargs)
+    
     @action(detail=False, methods=['get'])
+    @conditional(public_scopes)
     def public(self, request):
-        """获取所有公开图片"""
-        queryset = Image.objects.filter(is_public=True).select_related('owner')
+        """获取所有公开图片（响应对所有用户相同，使用共享响应缓存）"""
+        return Response(cached_response_data('public', request, lambda: self.render_public(request)))
+    
+    def render_public(self, request):
+        """查询并序列化公开图片列表"""
+        queryset = self.get_serializer_class().setup_eager_loading(Image.objects.filter(is_public=True))
         
-        # 支持搜索
+        # 支持全文检索
         search = request.query_params.get('search')
         if search:
-            queryset = queryset.filter(
-                Q(filename__icontains=search) | Q(description__icontains=search)
-            )
+            queryset = search_images(queryset, search)
         
-        # 排序
-        ordering = request.query_params.get('ordering', '-upload_time')
-        if ordering in ['upload_time', '-upload_time', 'size', '-size']:
+        # 排序（搜索时默认按相关度排序）
+        ordering = request.query_params.get('ordering', '' if search else '-upload_time')
+        if ordering in ['upload_time', '-upload_time', 'size', '-size', 'filename', '-filename']:
             queryset = queryset.order_by(ordering)
         
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            serializer = self.get_serializer(page, many=True)
+            return self.get_paginated_response(serializer.data).data
+        
         serializer = self.get_serializer(queryset, many=True)
-        return Response(serializer.data)
+        return serializer.data
     
     @action(detail=False, methods=['get'])
     def stats(self, request):
         """获取当前用户的图片统计信息"""
-        user = request.user
-        my_images = Image.objects.filter(owner=user)
-        public_images = Image.objects.filter(is_public=True)
+        mine = get_image_stats(request.user)
         
         return Response({
-            'my_total': my_images.count(),
-            'my_public': my_images.filter(is_public=True).count(),
-            'my_private': my_images.filter(is_public=False).count(),
-            'all_public': public_images.count(),
+            'my_total': mine.image_count,
+            'my_public': mine.public_count,
+            'my_private': mine.private_count,
+            'my_size': mine.total_size,
+            'all_public': get_image_stats().public_count,
         })
     
     @action(detail=False, methods=['get'], permission_classes=[permissions.AllowAny])
     def random(self, request):
         """获取随机公开图片（用于首页轮播，无需登录）"""
-        count = int(request.query_params.get('count', 6))
-        images = Image.objects.filter(is_public=True).order_by('?')[:count]
-        serializer = self.get_serializer(images, many=True)
-        return Response(serializer.data)
+        count = random_images_count(request.query_params.get('count', 6))
+        
+        def build(ids):
+            images = ImageSerializer.setup_eager_loading(Image.objects.filter(id__in=ids)).in_bulk(ids)
+            serializer = self.get_serializer([images[pk] for pk in ids if pk in images], many=True)
+            return serializer.data
+        
+        return Response(cached_random_response(count, request, build))
     
     def create(self, request, *args, **kwargs):
         """上传新图片"""
@@ -181,11 +215,9 @@ class ImageViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_403_FORBIDDEN
             )
         
-        # 删除文件
-        if instance.file:
-            instance.file.delete(save=False)
-        
-        instance.delete()
+        # 原图、缩略图和多尺寸图片由 post_delete 信号收集，事务提交后在后台删除
+        with transaction.atomic(), defer_file_deletion():
+            instance.delete()
         return Response(status=status.HTTP_204_NO_CONTENT)
     
     def update(self, request, *args, **kwargs):
@@ -402,149 +434,48 @@ class ImageViewSet(viewsets.ModelViewSet):
                     {'detail': '请先在个人设置中配置 Vision API Key'},
                     status=status.HTTP_400_BAD_REQUEST
                 )
-            api_key = profile.vision_api_key
         except UserProfile.DoesNotExist:
             return Response(
                 {'detail': '请先在个人设置中配置 Vision API Key'},
                 status=status.HTTP_400_BAD_REQUEST
             )
         
-        # 调用 AI 服务生成描述
-        import requests
-        import base64
+        # 调用 AI 服务在 Celery 任务中执行，接口立即返回任务标识，客户端轮询任务状态
+        from .ai import create_job, update_job
+        from .tasks import ai_analyze_image_task
         
+        job_id = create_job(image)
         try:
-            # 读取图片并转为 base64
-            with open(image.file.path, 'rb') as f:
-                image_data = base64.b64encode(f.read()).decode('utf-8')
-            
-            # 获取图片格式
-            ext = image.filename.split('.')[-1].lower()
-            if ext == 'jpg':
-                ext = 'jpeg'
-            image_url = f"data:image/{ext};base64,{image_data}"
-            
-            # 构建请求
-            payload = {
-                "model": "deepseek-ai/deepseek-vl2",
-                "messages": [
-                    {
-                        "role": "system",
-                        "content": [
-                            {
-                                "type": "text",
-                                "text": (
-                                    "你是一个专业的图片分析助手。请对用户提供的图片进行分析，生成描述和标签。\n\n"
-                                    "【输出要求】\n"
-                                    "请严格按照以下 JSON 格式输出，不要包含其他内容：\n"
-                                    "{\n"
-                                    '  "description": "图片的详细描述（50-150字）",\n'
-                                    '  "tags": ["标签1", "标签2"]\n'
-                                    "}\n\n"
-                                    "【描述要求】\n"
-                                    "1. 描述图片的主要内容、场景、氛围\n"
-                                    "2. 如果有人物，描述其大致动作或状态\n"
-                                    "3. 描述主要的颜色、光线等视觉特征\n"
-                                    "4. 语言流畅、客观、专业\n\n"
-                                    "【标签要求】\n"
-                                    "1. 提取1-3个最具特征的标签\n"
-                                    "2. 标签应简短（2-4个字）\n"
-                                    "3. 优先选择：场景类型、主体、风格、颜色等\n"
-                                    "4. 示例标签：风景、人像、美食、建筑、夜景、黑白、动物等"
-                                )
-                            }
-                        ]
-                    },
-                    {
-                        "role": "user",
-                        "content": [
-                            {
-                                "type": "text",
-                                "text": "请分析这张图片，生成描述和标签。"
-                            },
-                            {
-                                "type": "image_url",
-                                "image_url": {
-                                    "url": image_url,
-                                    "detail": "auto"
-                                }
-                            }
-                        ]
-                    }
-                ],
-                "stream": False,
-                "max_tokens": 500,
-                "temperature": 0.7,
-                "top_p": 0.7,
-                "response_format": {"type": "text"},
-            }
-            
-            headers = {
-                "Authorization": f"Bearer {api_key}",
-                "Content-Type": "application/json"
-            }
-            
-            response = requests.post(
-                "https://api.siliconflow.cn/v1/chat/completions",
-                json=payload,
-                headers=headers,
-                timeout=60
-            )
-            
-            response.raise_for_status()
-            result = response.json()
-            content = result['choices'][0]['message']['content']
-            
-            # 解析 JSON 响应
-            import json
-            import re
-            
-            # 尝试提取 JSON
-            json_match = re.search(r'\{[\s\S]*\}', content)
-            if json_match:
-                ai_result = json.loads(json_match.group())
-            else:
-                ai_result = {"description": content, "tags": []}
-            
-            description = ai_result.get('description', '')
-            tags = ai_result.get('tags', [])
-            
-            # 更新图片描述
-            if description:
-                image.description = description
-                image.save()
-            
-            # 添加 AI 生成的标签
-            from apps.tags.models import Tag
-            added_tags = []
-            for tag_name in tags[:3]:  # 最多3个标签
-                if tag_name and len(tag_name) <= 20:
-                    tag = Tag.get_or_create_tag(tag_name.strip(), tag_type='ai')
-                    if not ImageTag.objects.filter(image=image, tag=tag).exists():
-                        ImageTag.objects.create(image=image, tag=tag)
-                        added_tags.append({'id': tag.id, 'name': tag.name, 'type': 'ai'})
-            
-            return Response({
-                'detail': 'AI 描述生成成功',
-                'description': description,
-                'tags': added_tags
-            })
-            
-        except requests.exceptions.RequestException as e:
-            return Response(
-                {'detail': f'AI 服务请求失败: {str(e)}'},
-                status=status.HTTP_500_INTERNAL_SERVER_ERROR
-            )
-        except json.JSONDecodeError:
-            return Response(
-                {'detail': 'AI 响应解析失败'},
-                status=status.HTTP_500_INTERNAL_SERVER_ERROR
-            )
+            ai_analyze_image_task.delay(image.id, job_id)
         except Exception as e:
+            logger.error(f"AI 任务投递失败: {e}")
+            update_job(job_id, status='failed', detail='任务队列不可用')
             return Response(
-                {'detail': f'处理失败: {str(e)}'},
-                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+                {'detail': '任务队列不可用，请稍后重试'},
+                status=status.HTTP_503_SERVICE_UNAVAILABLE
             )
+        
+        return Response({
+            'detail': 'AI 描述生成中',
+            'job_id': job_id,
+            'status': 'pending',
+            'status_url': request.build_absolute_uri(f'/api/images/ai_jobs/{job_id}/'),
+        }, status=status.HTTP_202_ACCEPTED)
+    
+    @action(detail=False, methods=['get'], url_path='ai_jobs/(?P<job_id>[0-9a-f]+)')
+    def ai_job(self, request, job_id=None):
+        """
+        查询 AI 描述任务状态
+        
+        status: pending / running / success / failed；
+        success 时包含 description 和新增的 tags，failed 时包含 detail
+        """
+        from .ai import get_job
+        
+        job = get_job(job_id)
+        if job is None or job['owner_id'] != request.user.id:
+            return Response({'detail': '任务不存在或已过期'}, status=status.HTTP_404_NOT_FOUND)
+        return Response({key: value for key, value in job.items() if key != 'owner_id'})
 
 
 class MyImagesViewSet(viewsets.ReadOnlyModelViewSet):
@@ -555,10 +486,208 @@ class MyImagesViewSet(viewsets.ReadOnlyModelViewSet):
     """
     serializer_class = ImageSerializer
     permission_classes = [permissions.IsAuthenticated]
+    pagination_class = ImageKeysetPagination
     
     def get_queryset(self):
         """获取当前用户的所有图片"""
-        return Image.objects.filter(owner=self.request.user).select_related('owner').prefetch_related('tags')
+        return self.get_serializer_class().setup_eager_loading(Image.objects.filter(owner=self.request.user))
+    
+    def get_serializer_class(self):
+        if self.action == 'list':
+            return list_serializer_class(self.request)
+        return ImageSerializer
+    
+    @conditional(own_scopes)
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
+    
+    @conditional(own_scopes)
+    def retrieve(self, request, *args, **kwargs):
+        return super().retrieve(request, *args, **kwargs)
+
+
+class UploadSessionViewSet(mixins.CreateModelMixin,
+                           mixins.RetrieveModelMixin,
+                           mixins.DestroyModelMixin,
+                           viewsets.GenericViewSet):
+    """
+    分块续传视图集
+    
+    流程：
+    1. POST /uploads/ 创建会话 {filename, size, is_public, description, tags}
+    2. PUT /uploads/{id}/chunk/ 上传分块，请求体为原始字节，
+       请求头 Upload-Offset 指定写入位置（必须等于已接收字节数）
+    3. 中断后 GET /uploads/{id}/ 获取 received_size 继续上传
+    4. POST /uploads/{id}/complete/ 校验并生成图片
+    """
+    serializer_class = UploadSessionSerializer
+    permission_classes = [permissions.IsAuthenticated]
+    
+    def get_queryset(self):
+        return UploadSession.objects.filter(owner=self.request.user, image__isnull=True)
+    
+    def perform_create(self, serializer):
+        serializer.save(owner=self.request.user)
+    
+    def perform_destroy(self, instance):
+        """取消上传并删除临时文件"""
+        if os.path.exists(instance.temp_path):
+            os.remove(instance.temp_path)
+        instance.delete()
+    
+    @action(detail=True, methods=['put'], parser_classes=[])
+    def chunk(self, request, pk=None):
+        """追加一个分块"""
+        session = self.get_object()
+        
+        try:
+            offset = int(request.headers.get('Upload-Offset', ''))
+        except ValueError:
+            return Response({'detail': '缺少 Upload-Offset 请求头'}, status=status.HTTP_400_BAD_REQUEST)
+        
+        # 偏移量不一致时返回当前进度，客户端据此续传
+        if offset != session.received_size:
+            return Response(
+                {'detail': '偏移量不匹配', 'received_size': session.received_size},
+                status=status.HTTP_409_CONFLICT
+            )
+        
+        if request.stream is None:
+            return Response({'detail': '分块内容为空'}, status=status.HTTP_400_BAD_REQUEST)
+        
+        max_bytes = min(upload_chunk_size(), session.total_size - offset)
+        try:
+            written = append_chunk(session.temp_path, offset, request.stream, max_bytes)
+        except ValueError as e:
+            return Response({'detail': str(e)}, status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+        
+        # 乐观并发控制：只有偏移量未被其他请求推进时才提交
+        updated = UploadSession.objects.filter(pk=session.pk, received_size=offset).update(
+            received_size=offset + written, updated_at=timezone.now()
+        )
+        if not updated:
+            session.refresh_from_db()
+            return Response(
+                {'detail': '偏移量不匹配', 'received_size': session.received_size},
+                status=status.HTTP_409_CONFLICT
+            )
+        
+        return Response({'received_size': offset + written, 'size': session.total_size})
+    
+    @action(detail=True, methods=['post'])
+    def complete(self, request, pk=None):
+        """所有分块上传完成后生成图片"""
+        session = self.get_object()
+        
+        if not session.is_complete:
+            return Response(
+                {'detail': '文件尚未上传完成', 'received_size': session.received_size},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        path = session.temp_path
+        if not os.path.exists(path):
+            return Response({'detail': '上传文件已被处理'}, status=status.HTTP_409_CONFLICT)
+        
+        with open(path, 'rb') as f:
+            content_hash = hash_file(f)
+            width, height = sniff_image_size(f)
+            
+            if width is None:
+                os.remove(path)
+                session.delete()
+                return Response({'detail': '无法识别的图片文件'}, status=status.HTTP_400_BAD_REQUEST)
+            
+            # 临时文件直接移动到存储目录
+            image = create_uploaded_image(
+                owner=request.user,
+                file=AssembledUploadFile(f, name=session.filename),
+                filename=session.filename,
+                size=session.total_size,
+                content_hash=content_hash,
+                width=width,
+                height=height,
+                is_public=session.is_public,
+                description=session.description,
+                tag_names=session.tags,
+            )
+        # 内容与已有 blob 相同时文件不会被移动，临时文件需要删除
+        if os.path.exists(path):
+            try:
+                os.remove(path)
+            except OSError as e:
+                logger.error(f"删除分块临时文件失败: {path}, 错误: {e}")
+        session.image = image
+        session.save(update_fields=['image', 'updated_at'])
+        
+        serializer = ImageSerializer(image, context={'request': request})
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
+
+
+class AIBatchViewSet(mixins.CreateModelMixin,
+                     mixins.RetrieveModelMixin,
+                     mixins.ListModelMixin,
+                     viewsets.GenericViewSet):
+    """
+    批量 AI 分析视图集
+    
+    流程：
+    1. POST /ai-batches/ 创建并开始分析 {image_ids}，只分析自己的图片
+    2. GET /ai-batches/{id}/ 查询进度（各状态数量、progress、失败原因）
+    3. POST /ai-batches/{id}/resume/ 重试失败的图片并重新投递（中断的批次也会由定时任务自动恢复）
+    4. POST /ai-batches/{id}/cancel/ 取消，未处理的图片不再分析
+    """
+    serializer_class = AIBatchSerializer
+    permission_classes = [permissions.IsAuthenticated]
+    
+    def get_queryset(self):
+        from django.db.models import Prefetch
+        from .ai_batch import with_progress
+        
+        return with_progress(AIBatch.objects.filter(owner=self.request.user)).prefetch_related(
+            Prefetch('items', queryset=AIBatchItem.objects.filter(status='failed'), to_attr='failed_items')
+        )
+    
+    def create(self, request, *args, **kwargs):
+        from apps.users.models import UserProfile
+        from .ai_batch import create_batch
+        
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        
+        profile = UserProfile.objects.filter(user=request.user).first()
+        if profile is None or not profile.has_vision_api_key:
+            return Response(
+                {'detail': '请先在个人设置中配置 Vision API Key'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        batch = create_batch(request.user, serializer.validated_data['image_ids'])
+        if batch is None:
+            return Response({'detail': '没有可分析的图片'}, status=status.HTTP_400_BAD_REQUEST)
+        
+        batch = self.get_queryset().get(pk=batch.pk)
+        return Response(self.get_serializer(batch).data, status=status.HTTP_202_ACCEPTED)
+    
+    @action(detail=True, methods=['post'])
+    def resume(self, request, pk=None):
+        """重试失败的图片并重新投递"""
+        from django.db import transaction
+        from .ai_batch import dispatch_batch
+        
+        batch = self.get_object()
+        with transaction.atomic():
+            batch.items.filter(status='failed').update(status='pending', attempts=0, detail='')
+            AIBatch.objects.filter(pk=batch.pk).update(status='running', updated_at=timezone.now())
+            transaction.on_commit(lambda: dispatch_batch(batch.pk))
+        return Response(self.get_serializer(self.get_queryset().get(pk=batch.pk)).data)
+    
+    @action(detail=True, methods=['post'])
+    def cancel(self, request, pk=None):
+        """取消批次"""
+        batch = self.get_object()
+        AIBatch.objects.filter(pk=batch.pk, status='running').update(status='cancelled', updated_at=timezone.now())
+        return Response(self.get_serializer(self.get_queryset().get(pk=batch.pk)).data)
 
 
 class IsAdminUser(permissions.BasePermission):
@@ -579,7 +708,7 @@ class AdminImageViewSet(viewsets.ModelViewSet):
     
     def get_queryset(self):
         """获取所有图片"""
-        queryset = Image.objects.all().select_related('owner').prefetch_related('tags')
+        queryset = ImageSerializer.setup_eager_loading(Image.objects.all())
         
         # 按用户筛选
         owner_id = self.request.query_params.get('owner')
@@ -599,15 +728,13 @@ class AdminImageViewSet(viewsets.ModelViewSet):
             elif is_public.lower() == 'false':
                 queryset = queryset.filter(is_public=False)
         
-        # 搜索文件名或描述
+        # 全文检索（文件名、描述、标签、相机信息）
         search = self.request.query_params.get('search')
         if search:
-            queryset = queryset.filter(
-                Q(filename__icontains=search) | Q(description__icontains=search)
-            )
+            queryset = search_images(queryset, search)
         
-        # 排序
-        ordering = self.request.query_params.get('ordering', '-upload_time')
+        # 排序（搜索时默认按相关度排序）
+        ordering = self.request.query_params.get('ordering', '' if search else '-upload_time')
         if ordering in ['upload_time', '-upload_time', 'size', '-size', 'filename', '-filename', 'owner__username', '-owner__username']:
             queryset = queryset.order_by(ordering)
         
@@ -617,13 +744,9 @@ class AdminImageViewSet(viewsets.ModelViewSet):
         """管理员删除图片"""
         instance = self.get_object()
         
-        # 删除文件
-        if instance.file:
-            instance.file.delete(save=False)
-        if instance.thumbnail:
-            instance.thumbnail.delete(save=False)
-        
-        instance.delete()
+        # 原图、缩略图和多尺寸图片由 post_delete 信号收集，事务提交后在后台删除
+        with transaction.atomic(), defer_file_deletion():
+            instance.delete()
         return Response(status=status.HTTP_204_NO_CONTENT)
     
     @action(detail=False, methods=['get'])
@@ -632,25 +755,30 @@ class AdminImageViewSet(viewsets.ModelViewSet):
         from django.contrib.auth import get_user_model
         User = get_user_model()
         
-        total_images = Image.objects.count()
-        public_images = Image.objects.filter(is_public=True).count()
-        private_images = Image.objects.filter(is_public=False).count()
-        total_users = User.objects.count()
-        
-        # 每个用户的图片数量
-        from django.db.models import Count
-        user_stats = User.objects.annotate(
-            image_count=Count('images')
-        ).filter(image_count__gt=0).values('id', 'username', 'image_count').order_by('-image_count')[:10]
+        totals = get_image_stats()
         
         return Response({
-            'total_images': total_images,
-            'public_images': public_images,
-            'private_images': private_images,
-            'total_users': total_users,
-            'top_users': list(user_stats)
+            'total_images': totals.image_count,
+            'public_images': totals.public_count,
+            'private_images': totals.private_count,
+            'total_size': totals.total_size,
+            'total_users': User.objects.count(),
+            # 图片数量最多的用户
+            'top_users': top_uploaders(10)
         })
     
+    @action(detail=False, methods=['get'])
+    def cache_stats(self, request):
+        """公开列表响应缓存的命中率和平均耗时"""
+        return Response(response_cache_stats(['public', 'random']))
+    
+    @action(detail=False, methods=['get'])
+    def vision_stats(self, request):
+        """Vision API 调用次数、平均请求/响应字节数和平均耗时"""
+        from .ai import vision_api_stats
+        
+        return Response(vision_api_stats())
+    
     @action(detail=False, methods=['get'])
     def all_users(self, request):
         """获取所有用户列表"""
@@ -717,11 +845,7 @@ class AdminImageViewSet(viewsets.ModelViewSet):
         images = Image.objects.filter(id__in=ids)
         count = images.count()
         
-        for image in images:
-            if image.file:
-                image.file.delete(save=False)
-            if image.thumbnail:
-                image.thumbnail.delete(save=False)
-        
-        images.delete()
+        # 文件由 post_delete 信号收集（共享文件按引用计数释放），事务提交后合并为分批的后台任务删除
+        with transaction.atomic(), defer_file_deletion():
+            images.delete()
         return Response({'detail': f'成功删除 {count} 张图片'})
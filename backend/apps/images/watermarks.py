@@ -0,0 +1,141 @@
+"""
+列表变更水位线与 HTTP 条件请求
+
+每个数据范围（scope）在共享缓存中保存一个“最后修改时间”水位线：
+- user:<id>：该用户的图片（创建、修改、删除、标签变化、处理结果写回）
+- public：公开图片
+- tags：标签列表（创建、改名、删除、使用次数变化）
+- tag-names：已有标签的修改和删除（图片序列化结果中包含标签）。新建标签和使用次数变化
+  不推进该水位线，图片结果中嵌套的使用次数随图片所在范围的下一次变化刷新
+
+写入在事务提交后推进水位线（touch_watermarks）。列表接口由所依赖范围的水位线、
+请求路径和当前用户计算 ETag / Last-Modified，客户端携带 If-None-Match /
+If-Modified-Since 且数据未变化时直接返回 304，不执行查询和序列化。
+
+缓存中的水位线丢失时以当前时间重新初始化，只会让客户端多取一次完整响应。
+水位线必须由所有进程共享：进程内存中的水位线只记录本进程的写入，其他进程
+会把已经变化的列表当作未变化返回 304。因此 CACHE_SHARED 为 False 时不生成
+校验器，也不返回 304。
+"""
+import hashlib
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, quote_etag
+
+WATERMARK_PREFIX = 'watermark'
+PUBLIC_SCOPE = 'public'
+TAGS_SCOPE = 'tags'
+TAG_NAMES_SCOPE = 'tag-names'
+
+
+def user_scope(user_id):
+    """用户图片范围"""
+    return f'user:{user_id}'
+
+
+def image_scopes(states):
+    """
+    图片变化影响的范围
+
+    Args:
+        states: (owner_id, is_public) 序列，包含变化前后的状态
+    """
+    scopes = set()
+    for owner_id, is_public in states:
+        scopes.add(user_scope(owner_id))
+        if is_public:
+            scopes.add(PUBLIC_SCOPE)
+    return scopes
+
+
+def watermark_key(scope):
+    return f'{WATERMARK_PREFIX}:{scope}'
+
+
+def touch_watermarks(scopes):
+    """事务提交后将各范围的水位线推进到当前时间"""
+    keys = {watermark_key(scope) for scope in scopes}
+    if keys:
+        transaction.on_commit(lambda: cache.set_many(dict.fromkeys(keys, time.time()), timeout=None))
+
+
+def get_watermarks(scopes):
+    """读取各范围的水位线，缺失的以当前时间初始化"""
+    keys = [watermark_key(scope) for scope in scopes]
+    values = cache.get_many(keys)
+    missing = [key for key in keys if key not in values]
+    if missing:
+        now = time.time()
+        for key in missing:
+            cache.add(key, now, timeout=None)
+        values.update(cache.get_many(missing))
+    return [values.get(key, 0) for key in keys]
+
+
+def response_validators(request, scopes):
+    """
+    计算条件请求的验证器
+
+    Returns:
+        tuple: (ETag, Last-Modified 时间戳)
+    """
+    marks = get_watermarks(scopes)
+    source = '|'.join([
+        request.get_full_path(),
+        str(request.user.pk),
+        request.META.get('HTTP_ACCEPT', ''),
+        *(repr(mark) for mark in marks),
+    ])
+    etag = 'W/' + quote_etag(hashlib.md5(source.encode('utf-8')).hexdigest())
+    return etag, int(max(marks))
+
+
+def conditional(get_scopes):
+    """
+    为视图集方法添加 ETag / Last-Modified 条件请求支持
+
+    Args:
+        get_scopes: 函数 (view, request) -> 响应所依赖的范围列表
+    """
+    def decorator(method):
+        @wraps(method)
+        def wrapper(self, request, *args, **kwargs):
+            if not getattr(settings, 'CACHE_SHARED', False):
+                return method(self, request, *args, **kwargs)
+            etag, last_modified = response_validators(request, get_scopes(self, request))
+            response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+            if response is None:
+                response = method(self, request, *args, **kwargs)
+            if response.status_code in (200, 304):
+                response['ETag'] = etag
+                response['Last-Modified'] = http_date(last_modified)
+                # 允许浏览器缓存，但每次使用前都需要重新验证
+                patch_cache_control(response, private=True, no_cache=True)
+            return response
+        return wrapper
+    return decorator
+
+
+def visible_scopes(view, request):
+    """当前用户可见的图片：自己的图片与所有公开图片"""
+    return [user_scope(request.user.pk), PUBLIC_SCOPE, TAG_NAMES_SCOPE]
+
+
+def own_scopes(view, request):
+    """当前用户自己的图片"""
+    return [user_scope(request.user.pk), TAG_NAMES_SCOPE]
+
+
+def public_scopes(view, request):
+    """公开图片"""
+    return [PUBLIC_SCOPE, TAG_NAMES_SCOPE]
+
+
+def tag_scopes(view, request):
+    """标签列表"""
+    return [TAGS_SCOPE]
@@ -0,0 +1,136 @@
+"""
+标签名称解析缓存（进程内）
+
+批量处理时同一组自动标签（"横向"、"高清"、年份、季节、相机品牌）几乎每张图片都会用到，
+Tag.get_or_create_tags 先查询本缓存，预热后不再访问数据库。
+
+- LRU 淘汰，最多 TAG_CACHE_SIZE 项；每项 TAG_CACHE_TTL 秒后过期
+- 只缓存已提交的标签：在事务中解析到的标签在提交后才写入缓存，避免缓存回滚的记录
+- 缓存 (id, name, type, color)，每次查询返回新的 Tag 对象（usage_count 等字段延迟加载），
+  调用方之间不共享可变对象，也不会读到过期的计数
+- 标签改名或删除时（Tag 的 post_save / post_delete 信号）移除对应项，
+  并递增共享缓存中的版本号；其他进程最多每 TAG_CACHE_VERSION_INTERVAL 秒读取一次版本号，
+  发现变化后清空本地缓存（查询不必每次访问共享缓存）
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache
+
+# 共享缓存中的失效版本号
+VERSION_KEY = 'tags:name-cache-version'
+# 缓存的标签字段
+CACHED_FIELDS = ('id', 'name', 'type', 'color')
+
+
+def _to_tag(values):
+    """由缓存的字段值构造 Tag（其余字段访问时再从数据库加载）"""
+    from .models import Tag
+
+    return Tag.from_db('default', CACHED_FIELDS, values)
+
+
+class TagCache:
+    """标签名称 → (id, name, type, color) 的 LRU + TTL 缓存"""
+
+    def __init__(self):
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._version = None
+        self._version_checked_at = None
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def maxsize(self):
+        return getattr(settings, 'TAG_CACHE_SIZE', 1024)
+
+    @property
+    def ttl(self):
+        return getattr(settings, 'TAG_CACHE_TTL', 300)
+
+    @property
+    def version_interval(self):
+        return getattr(settings, 'TAG_CACHE_VERSION_INTERVAL', 5)
+
+    def _check_version(self, now):
+        """其他进程修改过标签时清空本地缓存，间隔内不重复读取版本号（调用方持有锁）"""
+        if self._version_checked_at is not None and now - self._version_checked_at < self.version_interval:
+            return
+        self._version_checked_at = now
+        version = cache.get(VERSION_KEY, 0)
+        if version != self._version:
+            self._entries.clear()
+            self._version = version
+
+    def get_many(self, names):
+        """
+        查询缓存
+
+        Returns:
+            tuple: ({名称: Tag}, 未命中的名称集合)
+        """
+        found = {}
+        missing = set()
+        now = time.monotonic()
+        with self._lock:
+            self._check_version(now)
+            for name in names:
+                entry = self._entries.get(name)
+                if entry is not None and entry[1] > now:
+                    self._entries.move_to_end(name)
+                    found[name] = entry[0]
+                else:
+                    if entry is not None:
+                        del self._entries[name]
+                    missing.add(name)
+            self.hits += len(found)
+            self.misses += len(missing)
+        return {name: _to_tag(values) for name, values in found.items()}, missing
+
+    def set_many(self, tags):
+        """写入缓存（超出容量时淘汰最久未使用的项）"""
+        if self.maxsize <= 0:
+            return
+        expires_at = time.monotonic() + self.ttl
+        with self._lock:
+            for tag in tags:
+                self._entries[tag.name] = (tuple(getattr(tag, field) for field in CACHED_FIELDS), expires_at)
+                self._entries.move_to_end(tag.name)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, tag_id):
+        """移除指定标签并通知其他进程"""
+        with self._lock:
+            for name in [name for name, (values, _) in self._entries.items() if values[0] == tag_id]:
+                del self._entries[name]
+        try:
+            cache.incr(VERSION_KEY)
+        except ValueError:
+            cache.add(VERSION_KEY, 1, timeout=None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._version_checked_at = None
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        """命中统计"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'maxsize': self.maxsize,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / total, 4) if total else None,
+            }
+
+
+tag_cache = TagCache()
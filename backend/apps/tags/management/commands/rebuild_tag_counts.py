@@ -0,0 +1,56 @@
+"""
+重建标签使用计数
+
+根据 image_tags 表重新计算 Tag.usage_count 与 TagUsage，
+用于数据迁移后或计数出现偏差时校正：
+
+    python manage.py rebuild_tag_counts
+"""
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from apps.images.models import ImageTag
+from apps.images.watermarks import TAG_NAMES_SCOPE, TAGS_SCOPE, touch_watermarks
+from apps.tags.models import Tag, TagUsage
+
+
+def rebuild_tag_counts(batch_size=1000):
+    """
+    从头重建全局与按用户的标签计数
+    
+    Returns:
+        tuple: (标签数, 用户标签统计行数)
+    """
+    with transaction.atomic():
+        counts = ImageTag.objects.filter(
+            tag=OuterRef('pk')
+        ).order_by().values('tag').annotate(count=Count('*')).values('count')
+        tag_total = Tag.objects.update(usage_count=Coalesce(Subquery(counts), 0))
+        
+        TagUsage.objects.all().delete()
+        rows = (
+            ImageTag.objects.order_by()
+            .values('tag_id', 'image__owner_id')
+            .annotate(count=Count('*'))
+        )
+        usages = TagUsage.objects.bulk_create(
+            (
+                TagUsage(tag_id=row['tag_id'], owner_id=row['image__owner_id'], count=row['count'])
+                for row in rows.iterator()
+            ),
+            batch_size=batch_size
+        )
+    touch_watermarks([TAGS_SCOPE, TAG_NAMES_SCOPE])
+    return tag_total, len(usages)
+
+
+class Command(BaseCommand):
+    help = '根据图片标签关联重建标签使用计数'
+    
+    def handle(self, *args, **options):
+        tag_total, usage_total = rebuild_tag_counts()
+        self.stdout.write(self.style.SUCCESS(
+            f'已重建 {tag_total} 个标签的计数，{usage_total} 条用户标签统计'
+        ))
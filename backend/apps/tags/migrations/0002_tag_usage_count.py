@@ -0,0 +1,79 @@
+# Generated by Django 4.2.27 on 2026-10-18 19:36
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def populate_tag_counts(apps, schema_editor):
+    """根据已有的图片标签关联初始化计数"""
+    Tag = apps.get_model('tags', 'Tag')
+    TagUsage = apps.get_model('tags', 'TagUsage')
+    ImageTag = apps.get_model('images', 'ImageTag')
+    
+    rows = ImageTag.objects.order_by().values('tag_id', 'image__owner_id').annotate(count=Count('*'))
+    totals = {}
+    usages = []
+    for row in rows:
+        totals[row['tag_id']] = totals.get(row['tag_id'], 0) + row['count']
+        usages.append(TagUsage(tag_id=row['tag_id'], owner_id=row['image__owner_id'], count=row['count']))
+    TagUsage.objects.bulk_create(usages, batch_size=1000)
+    for tag_id, total in totals.items():
+        Tag.objects.filter(pk=tag_id).update(usage_count=total)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tags', '0001_initial'),
+        ('images', '0003_image_processing_status_image_thumbnail_and_more'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TagUsage',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('count', models.PositiveIntegerField(default=0, verbose_name='使用次数')),
+            ],
+            options={
+                'verbose_name': '用户标签使用统计',
+                'verbose_name_plural': '用户标签使用统计',
+                'db_table': 'tag_user_usages',
+            },
+        ),
+        migrations.AddField(
+            model_name='tag',
+            name='usage_count',
+            field=models.PositiveIntegerField(default=0, verbose_name='使用次数'),
+        ),
+        migrations.AddIndex(
+            model_name='tag',
+            index=models.Index(fields=['-usage_count', 'name'], name='tags_usage_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='tag',
+            index=models.Index(fields=['type', '-usage_count'], name='tags_type_usage_idx'),
+        ),
+        migrations.AddField(
+            model_name='tagusage',
+            name='owner',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='tag_usages', to=settings.AUTH_USER_MODEL, verbose_name='用户'),
+        ),
+        migrations.AddField(
+            model_name='tagusage',
+            name='tag',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='user_usages', to='tags.tag', verbose_name='标签'),
+        ),
+        migrations.AddIndex(
+            model_name='tagusage',
+            index=models.Index(fields=['owner', '-count'], name='tag_usage_owner_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='tagusage',
+            unique_together={('tag', 'owner')},
+        ),
+        migrations.RunPython(populate_tag_counts, migrations.RunPython.noop),
+    ]
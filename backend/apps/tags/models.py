@@ -1,4 +1,11 @@
-from django.db import models
+from collections import Counter, defaultdict
+
+from django.conf import settings
+from django.db import models, transaction
+from django.db.models import F
+from django.db.models.functions import Greatest
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
 
 
 class Tag(models.Model):
@@ -32,12 +39,21 @@ class Tag(models.Model):
         auto_now_add=True,
         verbose_name='创建时间'
     )
+    # 冗余计数：使用该标签的图片数量，由 ImageTag 信号维护
+    usage_count = models.PositiveIntegerField(
+        default=0,
+        verbose_name='使用次数'
+    )
     
     class Meta:
         db_table = 'tags'
         ordering = ['name']
         verbose_name = '标签'
         verbose_name_plural = '标签'
+        indexes = [
+            models.Index(fields=['-usage_count', 'name'], name='tags_usage_idx'),
+            models.Index(fields=['type', '-usage_count'], name='tags_type_usage_idx'),
+        ]
     
     def __str__(self):
         return self.name
@@ -45,8 +61,224 @@ class Tag(models.Model):
     @classmethod
     def get_or_create_tag(cls, name, tag_type='user'):
         """获取或创建标签"""
+        from .cache import tag_cache
+        
+        name = name.strip().lower()
+        found, _ = tag_cache.get_many([name])
+        if found:
+            return found[name]
         tag, created = cls.objects.get_or_create(
-            name=name.strip().lower(),
+            name=name,
             defaults={'type': tag_type}
         )
+        cache_tags_on_commit([tag])
         return tag
+    
+    @classmethod
+    def get_or_create_tags(cls, names, tag_type='user'):
+        """
+        批量获取或创建标签
+        
+        先查进程内缓存；未命中的一次查询取出，缺失的标签用 bulk_create 创建（忽略并发创建的冲突）后再查询一次
+        
+        Args:
+            names: 标签名称序列（与 get_or_create_tag 相同，去除空白并转小写）
+            tag_type: 新建标签的类型
+        
+        Returns:
+            dict: {规范化后的名称: Tag}
+        """
+        from apps.images.watermarks import TAGS_SCOPE, touch_watermarks
+        from .cache import tag_cache
+        
+        normalized = {name.strip().lower() for name in names if name and name.strip()}
+        if not normalized:
+            return {}
+        # 先查进程内缓存，未命中的再查询数据库
+        tags, missing = tag_cache.get_many(normalized)
+        if not missing:
+            return tags
+        loaded = {tag.name: tag for tag in cls.objects.filter(name__in=missing)}
+        created = missing - loaded.keys()
+        if created:
+            cls.objects.bulk_create(
+                [cls(name=name, type=tag_type) for name in created], ignore_conflicts=True
+            )
+            touch_watermarks([TAGS_SCOPE])
+            loaded.update((tag.name, tag) for tag in cls.objects.filter(name__in=created))
+        cache_tags_on_commit(loaded.values())
+        tags.update(loaded)
+        return tags
+    
+    @classmethod
+    def resolve_tags(cls, names):
+        """
+        按名称查找已有标签（只查询，不创建）
+        
+        名称按 get_or_create_tag 的规则规范化，先查进程内缓存
+        
+        Returns:
+            dict: {规范化后的名称: Tag}，不存在的名称不在结果中
+        """
+        from .cache import tag_cache
+        
+        normalized = {name.strip().lower() for name in names if name and name.strip()}
+        if not normalized:
+            return {}
+        tags, missing = tag_cache.get_many(normalized)
+        if missing:
+            loaded = list(cls.objects.filter(name__in=missing))
+            cache_tags_on_commit(loaded)
+            tags.update((tag.name, tag) for tag in loaded)
+        return tags
+
+
+class TagUsage(models.Model):
+    """按用户统计的标签使用次数（冗余计数）"""
+    
+    tag = models.ForeignKey(
+        Tag,
+        on_delete=models.CASCADE,
+        related_name='user_usages',
+        verbose_name='标签'
+    )
+    owner = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name='tag_usages',
+        verbose_name='用户'
+    )
+    count = models.PositiveIntegerField(
+        default=0,
+        verbose_name='使用次数'
+    )
+    
+    class Meta:
+        db_table = 'tag_user_usages'
+        unique_together = ['tag', 'owner']
+        verbose_name = '用户标签使用统计'
+        verbose_name_plural = '用户标签使用统计'
+        indexes = [
+            models.Index(fields=['owner', '-count'], name='tag_usage_owner_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.owner_id} - {self.tag_id}: {self.count}"
+
+
+def adjust_tag_usage(pairs, delta, public=False):
+    """
+    批量调整标签使用计数
+    
+    Args:
+        pairs: (tag_id, owner_id) 序列，每一项代表一条 ImageTag 记录
+        delta: +1 表示新增关联，-1 表示删除关联
+        public: 涉及的图片中是否有公开图片；只有这时才推进公开图片水位线，
+            私有图片打标签不会使公开列表的响应缓存失效
+    """
+    per_owner = Counter(pairs)
+    if not per_owner:
+        return
+    per_tag = Counter()
+    for (tag_id, owner_id), n in per_owner.items():
+        per_tag[tag_id] += n
+    
+    def grouped(counter):
+        # 按增量分组，相同增量的行用一条 UPDATE 完成
+        groups = defaultdict(list)
+        for key, n in counter.items():
+            groups[n].append(key)
+        return groups.items()
+    
+    def shifted(field, n):
+        if delta > 0:
+            return F(field) + n
+        return Greatest(F(field) - n, 0)
+    
+    from apps.images.watermarks import PUBLIC_SCOPE, TAGS_SCOPE, touch_watermarks, user_scope
+    
+    # 标签使用次数和图片的标签都有变化
+    scopes = [TAGS_SCOPE] + [user_scope(owner_id) for owner_id in {owner for _, owner in per_owner}]
+    if public:
+        scopes.append(PUBLIC_SCOPE)
+    touch_watermarks(scopes)
+    with transaction.atomic():
+        for n, tag_ids in grouped(per_tag):
+            Tag.objects.filter(pk__in=tag_ids).update(usage_count=shifted('usage_count', n))
+        
+        if delta > 0:
+            TagUsage.objects.bulk_create(
+                [TagUsage(tag_id=tag_id, owner_id=owner_id) for tag_id, owner_id in per_owner],
+                ignore_conflicts=True
+            )
+        for n, keys in grouped(per_owner):
+            by_owner = defaultdict(list)
+            for tag_id, owner_id in keys:
+                by_owner[owner_id].append(tag_id)
+            for owner_id, tag_ids in by_owner.items():
+                TagUsage.objects.filter(owner_id=owner_id, tag_id__in=tag_ids).update(
+                    count=shifted('count', n)
+                )
+
+
+def cache_tags_on_commit(tags):
+    """事务提交后将标签写入名称缓存（不缓存可能回滚的记录）"""
+    from .cache import tag_cache
+    
+    tags = list(tags)
+    if tags:
+        transaction.on_commit(lambda: tag_cache.set_many(tags))
+
+
+@receiver(post_save, sender=Tag)
+@receiver(post_delete, sender=Tag)
+def touch_tag_watermark(sender, instance, created=False, raw=False, **kwargs):
+    """标签新增、修改或删除后推进标签列表水位线；修改和删除同时推进图片列表依赖的标签水位线"""
+    from apps.images.watermarks import TAG_NAMES_SCOPE, TAGS_SCOPE, touch_watermarks
+    if not raw:
+        touch_watermarks([TAGS_SCOPE] if created else [TAGS_SCOPE, TAG_NAMES_SCOPE])
+
+
+@receiver(post_save, sender=Tag)
+def invalidate_renamed_tag(sender, instance, created, raw=False, **kwargs):
+    """标签改名等修改后移除名称缓存"""
+    if not created and not raw:
+        from .cache import tag_cache
+        tag_cache.invalidate(instance.id)
+
+
+@receiver(post_delete, sender=Tag)
+def invalidate_deleted_tag(sender, instance, **kwargs):
+    """删除标签后移除名称缓存"""
+    from .cache import tag_cache
+    tag_cache.invalidate(instance.id)
+
+
+def _image_owner(image_tag):
+    """获取 ImageTag 所属图片的 (用户 ID, 是否公开)，优先使用已缓存的图片对象"""
+    from apps.images.models import Image, ImageTag
+    
+    if ImageTag.image.is_cached(image_tag):
+        return image_tag.image.owner_id, image_tag.image.is_public
+    return Image.objects.filter(pk=image_tag.image_id).values_list('owner_id', 'is_public').first() or (None, False)
+
+
+@receiver(post_save, sender='images.ImageTag')
+def increment_tag_usage(sender, instance, created, raw=False, **kwargs):
+    """新增图片标签关联时增加计数"""
+    if created and not raw:
+        owner_id, is_public = _image_owner(instance)
+        adjust_tag_usage([(instance.tag_id, owner_id)], 1, public=is_public)
+
+
+@receiver(post_delete, sender='images.ImageTag')
+def decrement_tag_usage(sender, instance, origin=None, **kwargs):
+    """
+    删除图片标签关联时减少计数
+    
+    随图片级联删除的关联由图片的删除信号汇总后一次调整；随标签删除时计数行一起删除，不需要调整
+    """
+    if origin is not None and getattr(origin, 'model', type(origin))._meta.label != 'images.ImageTag':
+        return
+    owner_id, is_public = _image_owner(instance)
+    adjust_tag_usage([(instance.tag_id, owner_id)], -1, public=is_public)
@@ -14,16 +14,13 @@ class TagSerializer(serializers.ModelSerializer):
     
     def get_image_count(self, obj):
         """获取使用该标签的图片数量"""
-        # 优先使用 annotated 的 usage_count（如果有的话）
-        if hasattr(obj, 'usage_count'):
-            return obj.usage_count
-        return obj.images.count()
+        return self.get_usage_count(obj)
     
     def get_usage_count(self, obj):
-        """获取使用次数 - 优先使用 annotated 的值"""
-        if hasattr(obj, 'usage_count'):
-            return obj.usage_count
-        return obj.images.count()
+        """获取使用次数 - 按用户统计时优先使用用户维度的计数"""
+        if hasattr(obj, 'user_usage_count'):
+            return obj.user_usage_count
+        return obj.usage_count
 
 
 class TagCreateSerializer(serializers.ModelSerializer):
@@ -1,3 +1,233 @@
+import time
+from io import StringIO
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
 from django.test import TestCase
+from rest_framework.test import APIClient
+
+from apps.images.models import Image, ImageTag
+from .cache import tag_cache
+from .models import Tag, TagUsage
+
+User = get_user_model()
+
+
+def make_image(owner, **kwargs):
+    """创建不带实际文件的图片记录"""
+    defaults = {'file': f'uploads/user_{owner.id}/test.jpg', 'filename': 'test.jpg', 'size': 1024}
+    defaults.update(kwargs)
+    return Image.objects.create(owner=owner, **defaults)
+
+
+class TagUsageCounterTests(TestCase):
+    """标签冗余计数的维护"""
+
+    def setUp(self):
+        self.alice = User.objects.create_user(username='alice', password='pass12345')
+        self.bob = User.objects.create_user(username='bob', password='pass12345')
+        self.tag = Tag.objects.create(name='风景')
+        self.client = APIClient()
+        self.client.force_authenticate(self.alice)
+
+    def assertCounts(self, total, per_owner):
+        self.tag.refresh_from_db()
+        self.assertEqual(self.tag.usage_count, total)
+        for owner, count in per_owner.items():
+            usage = TagUsage.objects.filter(tag=self.tag, owner=owner).first()
+            self.assertEqual(usage.count if usage else 0, count)
+
+    def test_add_and_remove_tag(self):
+        image = make_image(self.alice)
+        self.client.post(f'/api/images/{image.id}/add_tag/', {'tag_name': '风景'})
+        # 重复添加不增加计数
+        self.client.post(f'/api/images/{image.id}/add_tag/', {'tag_name': '风景'})
+        self.assertCounts(1, {self.alice: 1})
+
+        self.client.delete(f'/api/images/{image.id}/remove_tag/{self.tag.id}/')
+        self.assertCounts(0, {self.alice: 0})
+
+    def test_cascade_and_batch_delete(self):
+        images = [make_image(self.alice) for _ in range(3)] + [make_image(self.bob)]
+        for image in images:
+            ImageTag.objects.create(image=image, tag=self.tag)
+        self.assertCounts(4, {self.alice: 3, self.bob: 1})
+
+        images[0].delete()
+        self.assertCounts(3, {self.alice: 2, self.bob: 1})
+
+        Image.objects.filter(id__in=[images[1].id, images[3].id]).delete()
+        self.assertCounts(1, {self.alice: 1, self.bob: 0})
+
+    def test_attach_tags_counts_only_inserted(self):
+        from django.db.models import QuerySet
+        from apps.images.models import attach_tags
+
+        images = [make_image(self.alice), make_image(self.bob)]
+        values_list = QuerySet.values_list
+        stale = []
+
+        def stale_read(queryset, *fields, **kwargs):
+            # 读取已有关联之后、插入之前，另一个请求添加了同一关联
+            if queryset.model is ImageTag and not stale:
+                stale.append(ImageTag.objects.create(image=images[0], tag=self.tag))
+                return []
+            return values_list(queryset, *fields, **kwargs)
+
+        with mock.patch.object(QuerySet, 'values_list', autospec=True, side_effect=stale_read):
+            added = attach_tags({image: ['风景'] for image in images})
+        self.assertEqual([image for image, _ in added], images[1:])
+        self.assertEqual(ImageTag.objects.filter(tag=self.tag).count(), 2)
+        self.assertCounts(2, {self.alice: 1, self.bob: 1})
+
+    def test_batch_delete_adjusts_counts_once(self):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        from .models import adjust_tag_usage
+
+        tags = [self.tag] + [Tag.objects.create(name=f'tag{i}') for i in range(3)]
+        images = [make_image(self.alice) for _ in range(5)] + [make_image(self.bob) for _ in range(5)]
+        ImageTag.objects.bulk_create([ImageTag(image=image, tag=tag) for image in images for tag in tags])
+        adjust_tag_usage([(tag.id, image.owner_id) for image in images for tag in tags], 1)
+
+        with CaptureQueriesContext(connection) as ctx:
+            Image.objects.filter(id__in=[image.id for image in images]).delete()
+        # 计数更新的语句数与删除的图片和关联数量无关
+        updates = [q['sql'] for q in ctx.captured_queries
+                   if q['sql'].startswith('UPDATE') and ('"tags"' in q['sql'] or '"tag_user_usages"' in q['sql'])]
+        self.assertLessEqual(len(updates), 3)
+        self.assertCounts(0, {self.alice: 0, self.bob: 0})
+        self.assertEqual(Tag.objects.get(name='tag0').usage_count, 0)
+
+        # 删除标签时级联删除的关联不调整计数
+        image = make_image(self.alice)
+        ImageTag.objects.create(image=image, tag=self.tag)
+        with CaptureQueriesContext(connection) as ctx:
+            self.tag.delete()
+        self.assertFalse([q for q in ctx.captured_queries if q['sql'].startswith('UPDATE "tags"')])
+
+    def test_rebuild_command(self):
+        for owner in [self.alice, self.alice, self.bob]:
+            ImageTag.objects.create(image=make_image(owner), tag=self.tag)
+        Tag.objects.update(usage_count=0)
+        TagUsage.objects.all().delete()
+
+        call_command('rebuild_tag_counts', stdout=StringIO())
+        self.assertCounts(3, {self.alice: 2, self.bob: 1})
+
+    def test_my_tags_uses_owner_counts(self):
+        for owner in [self.alice, self.bob, self.bob]:
+            ImageTag.objects.create(image=make_image(owner), tag=self.tag)
+        response = self.client.get('/api/tags/my_tags/')
+        self.assertEqual(response.data[0]['usage_count'], 1)
+        response = self.client.get('/api/tags/')
+        self.assertEqual(response.data[0]['usage_count'], 3)
+
+    def test_bulk_attach_tags(self):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        from apps.images.models import attach_tags
+
+        images = [make_image(self.alice), make_image(self.bob)]
+        ImageTag.objects.create(image=images[0], tag=self.tag)
+        with CaptureQueriesContext(connection) as ctx:
+            added = attach_tags({
+                images[0]: ['风景', ' Travel ', 'new1', 'new2'],
+                images[1]: ['风景', 'travel', 'new1'],
+            }, tag_type='auto')
+        # 查询数与标签数量无关（计数按用户分组更新）
+        self.assertLessEqual(len(ctx.captured_queries), 20)
+        self.assertEqual(len(added), 6)
+        self.assertEqual(Tag.objects.get(name='new2').type, 'auto')
+        self.assertEqual(
+            set(images[1].tags.values_list('name', flat=True)), {'风景', 'travel', 'new1'}
+        )
+        self.assertCounts(2, {self.alice: 1, self.bob: 1})
+        self.assertEqual(Tag.objects.get(name='travel').usage_count, 2)
+
+        # 重复添加不产生新关联
+        self.assertEqual(attach_tags({images[0]: ['new1']}), [])
+
+
+class TagCacheTests(TestCase):
+    """标签名称解析缓存"""
+
+    def setUp(self):
+        tag_cache.clear()
+        self.addCleanup(tag_cache.clear)
+        self.admin = User.objects.create_superuser(username='admin', password='pass12345')
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+
+    def resolve(self, names):
+        with self.captureOnCommitCallbacks(execute=True):
+            return Tag.get_or_create_tags(names, tag_type='auto')
+
+    def test_warm_cache_skips_database(self):
+        first = self.resolve(['横向', '高清', '2024年'])
+        with self.assertNumQueries(0):
+            second = self.resolve(['横向', '高清', '2024年'])
+            tag = Tag.get_or_create_tag('横向')
+        self.assertEqual({name: t.id for name, t in first.items()}, {name: t.id for name, t in second.items()})
+        self.assertEqual(tag.id, first['横向'].id)
+        stats = self.client.get('/api/tags/cache_stats/').data
+        self.assertEqual((stats['hits'], stats['misses']), (4, 3))
+
+    def test_rename_and_delete_invalidate(self):
+        tag = self.resolve(['风景'])['风景']
+        self.client.patch(f'/api/tags/{tag.id}/', {'name': '山水'}, format='json')
+        renamed = self.resolve(['风景', '山水'])
+        self.assertNotEqual(renamed['风景'].id, tag.id)
+        self.assertEqual(renamed['山水'].id, tag.id)
+
+        self.client.delete(f'/api/tags/{tag.id}/')
+        self.assertFalse(Tag.objects.filter(id=tag.id).exists())
+        self.assertNotEqual(self.resolve(['山水'])['山水'].id, tag.id)
+
+    def test_lru_and_ttl(self):
+        with self.settings(TAG_CACHE_SIZE=2, TAG_CACHE_TTL=60):
+            self.resolve(['a', 'b'])
+            self.resolve(['a'])
+            self.resolve(['c'])
+            # b 最久未使用，被淘汰
+            found, missing = tag_cache.get_many(['a', 'b', 'c'])
+            self.assertEqual((set(found), missing), ({'a', 'c'}, {'b'}))
+
+            with mock.patch('apps.tags.cache.time.monotonic', return_value=time.monotonic() + 61):
+                self.assertEqual(tag_cache.get_many(['a'])[1], {'a'})
+
+    def test_version_checked_per_interval(self):
+        from django.core.cache import cache
+
+        self.resolve(['风景'])
+        with mock.patch('apps.tags.cache.cache.get', wraps=cache.get) as get:
+            for _ in range(3):
+                tag_cache.get_many(['风景'])
+            get.assert_not_called()
+
+            # 其他标签改名后递增版本号，间隔过后本地缓存清空
+            tag_cache.invalidate(0)
+            later = time.monotonic() + 10
+            with mock.patch('apps.tags.cache.time.monotonic', return_value=later):
+                self.assertEqual(tag_cache.get_many(['风景'])[1], {'风景'})
+            get.assert_called_once()
+
+    def test_returns_independent_instances(self):
+        tag = self.resolve(['风景'])['风景']
+        Tag.objects.filter(pk=tag.pk).update(usage_count=7)
+        first, _ = tag_cache.get_many(['风景'])
+        second, _ = tag_cache.get_many(['风景'])
+        self.assertIsNot(first['风景'], second['风景'])
+        # 计数不缓存，访问时从数据库读取
+        self.assertEqual(first['风景'].usage_count, 7)
+        self.assertEqual((first['风景'].id, first['风景'].name), (tag.id, '风景'))
+
+    def test_not_cached_before_commit(self):
+        Tag.get_or_create_tags(['临时'])
+        self.assertEqual(tag_cache.stats()['size'], 0)
 
-# Create your tests here.
+    def test_stats_admin_only(self):
+        user = User.objects.create_user(username='carol', password='pass12345')
+        self.client.force_authenticate(user)
+        self.assertEqual(self.client.get('/api/tags/cache_stats/').status_code, 403)
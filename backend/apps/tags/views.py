@@ -1,9 +1,11 @@
 from rest_framework import viewsets, permissions, status
 from rest_framework.response import Response
 from rest_framework.decorators import action
-from django.db.models import Count, Q as DQ
 
-from .models import Tag
+from apps.images.watermarks import conditional, tag_scopes
+
+from .cache import tag_cache
+from .models import Tag, TagUsage
 from .serializers import TagSerializer, TagCreateSerializer
 
 
@@ -26,9 +28,7 @@ class TagViewSet(viewsets.ModelViewSet):
         """
         获取标签列表，支持筛选
         """
-        queryset = Tag.objects.annotate(
-            usage_count=Count('images')
-        ).order_by('-usage_count', 'name')
+        queryset = Tag.objects.order_by('-usage_count', 'name')
         
         # 按类型筛选
         tag_type = self.request.query_params.get('type')
@@ -42,7 +42,12 @@ class TagViewSet(viewsets.ModelViewSet):
         
         return queryset
     
+    @conditional(tag_scopes)
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
+    
     @action(detail=False, methods=['get'])
+    @conditional(tag_scopes)
     def popular(self, request):
         """
         获取热门标签
@@ -53,9 +58,7 @@ class TagViewSet(viewsets.ModelViewSet):
         4. 最多返回30个
         """
         # 获取所有使用次数大于1的标签
-        all_tags = Tag.objects.annotate(
-            usage_count=Count('images')
-        ).filter(usage_count__gt=1).order_by('-usage_count')
+        all_tags = Tag.objects.filter(usage_count__gt=1).order_by('-usage_count', 'name')
         
         total_count = all_tags.count()
         
@@ -74,15 +77,14 @@ class TagViewSet(viewsets.ModelViewSet):
     @action(detail=False, methods=['get'])
     def my_tags(self, request):
         """获取当前用户图片使用的所有标签"""
-        from apps.images.models import Image
+        usages = TagUsage.objects.filter(
+            owner=request.user, count__gt=0
+        ).select_related('tag').order_by('-count', 'tag__name')
         
-        user = request.user
-        # 获取用户所有图片的标签
-        queryset = Tag.objects.filter(
-            images__owner=user
-        ).annotate(
-            usage_count=Count('images', filter=DQ(images__owner=user))
-        ).distinct().order_by('-usage_count', 'name')
+        queryset = []
+        for usage in usages:
+            usage.tag.user_usage_count = usage.count
+            queryset.append(usage.tag)
         
         serializer = self.get_serializer(queryset, many=True)
         return Response(serializer.data)
@@ -90,9 +92,7 @@ class TagViewSet(viewsets.ModelViewSet):
     @action(detail=False, methods=['get'])
     def auto_tags(self, request):
         """获取自动生成的标签"""
-        queryset = Tag.objects.filter(type='auto').annotate(
-            usage_count=Count('images')
-        ).order_by('-usage_count')
+        queryset = Tag.objects.filter(type='auto').order_by('-usage_count', 'name')
         
         serializer = self.get_serializer(queryset, many=True)
         return Response(serializer.data)
@@ -100,9 +100,12 @@ class TagViewSet(viewsets.ModelViewSet):
     @action(detail=False, methods=['get'])
     def user_tags(self, request):
         """获取用户自定义的标签"""
-        queryset = Tag.objects.filter(type='user').annotate(
-            usage_count=Count('images')
-        ).order_by('-usage_count')
+        queryset = Tag.objects.filter(type='user').order_by('-usage_count', 'name')
         
         serializer = self.get_serializer(queryset, many=True)
         return Response(serializer.data)
+    
+    @action(detail=False, methods=['get'], permission_classes=[permissions.IsAdminUser])
+    def cache_stats(self, request):
+        """获取标签名称缓存的命中统计（当前进程）"""
+        return Response(tag_cache.stats())
@@ -12,6 +12,7 @@ https://docs.djangoproject.com/en/3.2/ref/settings/
 
 from pathlib import Path
 import os
+import sys
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -123,6 +124,55 @@ DATABASES = {
 }
 
 
+# 缓存
+# 默认使用 Celery 消息代理所在的 Redis（1 号库）：web 进程与 Celery worker 共享 AI 任务状态、
+# API Key 并发名额和令牌桶、列表水位线、标签缓存版本和响应缓存。
+# CACHE_REDIS_URL 可指定其他地址，设为 locmem 时使用进程内存（只适用于单进程）；运行测试时使用进程内存
+# responses：公开列表的响应缓存，与其他缓存分开限制容量
+
+TESTING = sys.argv[1:2] == ['test']
+
+
+def redis_db_url(url, db):
+    """同一 Redis 实例上另一个库的地址"""
+    base, _, last = url.rstrip('/').rpartition('/')
+    return f'{base}/{db}' if last.isdigit() else f'{url.rstrip("/")}/{db}'
+
+
+_broker_url = os.environ.get('CELERY_BROKER_URL', 'redis://localhost:6379/0')
+CACHE_REDIS_URL = os.environ.get('CACHE_REDIS_URL') or (
+    redis_db_url(_broker_url, 1) if _broker_url.startswith(('redis://', 'rediss://')) else 'locmem'
+)
+# 缓存是否由所有进程共享；不共享时列表接口不生成 ETag / Last-Modified（见 images.watermarks）
+CACHE_SHARED = CACHE_REDIS_URL != 'locmem' and not TESTING
+
+if CACHE_SHARED:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': CACHE_REDIS_URL,
+            'KEY_PREFIX': 'photo-manager',
+        },
+        'responses': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': CACHE_REDIS_URL,
+            'KEY_PREFIX': 'photo-manager-responses',
+        },
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'photo-manager',
+        },
+        'responses': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'photo-manager-responses',
+            'OPTIONS': {'MAX_ENTRIES': 1000},
+        },
+    }
+
+
 # Password validation
 # https://docs.djangoproject.com/en/3.2/ref/settings/#auth-password-validators
 
@@ -182,7 +232,103 @@ CELERY_TIMEZONE = 'Asia/Shanghai'
 CELERY_TASK_TRACK_STARTED = True
 CELERY_TASK_TIME_LIMIT = 30 * 60  # 30分钟超时
 
+# Celery Beat 定时任务
+CELERY_BEAT_SCHEDULE = {
+    'process-pending-images': {
+        'task': 'apps.images.tasks.process_pending_images',
+        'schedule': 5 * 60,  # 每5分钟处理遗漏的待处理图片
+    },
+    'cleanup-stale-upload-sessions': {
+        'task': 'apps.images.tasks.cleanup_stale_upload_sessions',
+        'schedule': 60 * 60,  # 每小时
+    },
+    'reconcile-image-stats': {
+        'task': 'apps.images.tasks.reconcile_image_stats',
+        'schedule': 6 * 60 * 60,  # 每6小时校正统计计数
+    },
+    'cleanup-orphaned-files': {
+        'task': 'apps.images.tasks.cleanup_orphaned_files',
+        'schedule': 60 * 60,  # 每小时增量回收孤立文件
+    },
+    'resume-ai-batches': {
+        'task': 'apps.images.tasks.resume_ai_batches',
+        'schedule': 5 * 60,  # 每5分钟恢复中断的批量 AI 分析
+    },
+}
+
+
+# 删除图片后在后台分批删除文件
+FILE_DELETE_BATCH_SIZE = 500  # 每个删除任务的文件数
+
+# 孤立文件回收（增量，见 apps/images/gc.py）
+ORPHAN_GC_TIME_BUDGET = 5 * 60  # 每次运行的时间（秒），超时后保存检查点，下次继续
+ORPHAN_GC_BATCH_SIZE = 1000  # 每批从数据库读取的路径数
+ORPHAN_GC_MIN_AGE = 60 * 60  # 只回收修改时间早于该秒数的文件
+ORPHAN_GC_DELETE_RATE = 50  # 每秒最多删除的文件数，0 表示不限速
+
+# 标签名称解析缓存（进程内 LRU）
+TAG_CACHE_SIZE = 1024  # 最多缓存的标签数
+TAG_CACHE_TTL = 300  # 缓存有效期（秒）
+TAG_CACHE_VERSION_INTERVAL = 5  # 读取共享失效版本号的最小间隔（秒），其他进程的改名最多延迟这么久生效
+
+# 首页随机图片
+RANDOM_IMAGES_MAX_COUNT = 20  # 单次最多返回的图片数
+RANDOM_IMAGES_CACHE_TTL = 60  # 响应缓存有效期（秒）
+RANDOM_IMAGES_CACHE_VARIANTS = 4  # 每个 count 缓存的不同结果组数
+
+# 公开列表响应缓存（按公开图片和标签的水位线分版本，数据变化后旧版本自然失效）
+PUBLIC_RESPONSE_CACHE_ALIAS = 'responses'
+PUBLIC_RESPONSE_CACHE_TTL = 300  # 秒
+
+# Vision AI 图片描述（在 Celery 任务中调用）
+VISION_API_URL = os.environ.get('VISION_API_URL', 'https://api.siliconflow.cn/v1/chat/completions')
+VISION_API_MODEL = 'deepseek-ai/deepseek-vl2'
+VISION_API_TIMEOUT = 60  # 单次请求超时（秒）
+VISION_API_POOL_SIZE = 8  # 每个 worker 进程的连接池大小
+VISION_API_MAX_CONCURRENCY = 2  # 同一 API Key 的最大并发请求数
+VISION_JOB_TTL = 60 * 60  # 任务状态保留时间（秒）
+VISION_IMAGE_MAX_EDGE = 1024  # 发送图片的长边上限（像素）
+VISION_IMAGE_QUALITY = 85  # 发送图片的 JPEG 质量
+VISION_IMAGE_MAX_BYTES = 512 * 1024  # 发送图片的体积上限，超过时降低质量或缩小尺寸
+VISION_API_RATE = 0.5  # 令牌桶：同一 API Key 每秒补充的请求数（批量分析）
+VISION_API_BURST = 5  # 令牌桶容量
+VISION_BATCH_MAX_IMAGES = 500  # 单次批量分析的图片数上限
+VISION_BATCH_CHUNK = 20  # 批量分析每段处理的图片数
+VISION_BATCH_MAX_ATTEMPTS = 3  # 每张图片最多请求次数
+VISION_BATCH_STALE_SECONDS = 10 * 60  # 超过该时间没有进展的批次由定时任务重新投递
+
+# 标签 AND 筛选：所有标签的使用次数都超过该值时改用逐个 EXISTS，不做分组聚合
+TAG_FILTER_GROUPED_MAX = 5000
+
+
+# 图片列表游标分页配置
+IMAGE_PAGE_SIZE = 30  # 默认每页数量
+IMAGE_MAX_PAGE_SIZE = 100  # 每页最大数量
+IMAGE_VISIBILITY_MERGE = False  # 可见性查询拆成两个分支在 Python 中归并（见 images.pagination）
+
+
+# 上传配置
+# 所有上传文件直接写入临时文件，接收时计算哈希并读取图片尺寸
+FILE_UPLOAD_HANDLERS = ['apps.images.uploads.HashingUploadHandler']
+IMAGE_MAX_UPLOAD_SIZE = 10 * 1024 * 1024  # 普通上传最大 10MB
+CHUNKED_UPLOAD_MAX_SIZE = 50 * 1024 * 1024  # 分块上传最大 50MB
+CHUNKED_UPLOAD_CHUNK_SIZE = 2 * 1024 * 1024  # 单个分块最大 2MB
+CHUNKED_UPLOAD_TEMP_DIR = BASE_DIR / 'tmp' / 'chunked_uploads'
+CHUNKED_UPLOAD_EXPIRE_HOURS = 24  # 未完成的分块上传保留时间
+
 
 # 缩略图配置
 THUMBNAIL_SIZE = (300, 300)  # 缩略图尺寸
 THUMBNAIL_QUALITY = 85  # JPEG 压缩质量
+
+# 响应式多尺寸图片配置（与缩略图在同一次解码中生成）
+IMAGE_RENDITION_WIDTHS = [150, 300, 800, 1600]  # 宽度阶梯，不会超过原图宽度
+IMAGE_RENDITION_FORMATS = ['avif', 'webp']  # 当前 Pillow 不支持的格式自动跳过
+IMAGE_RENDITION_QUALITY = {'webp': 80, 'avif': 60}
+
+# 批量处理配置
+IMAGE_BATCH_WINDOW = 2  # 合并投递窗口（秒），窗口内的上传合并为一个批处理任务
+IMAGE_BATCH_SIZE = 200  # 单个批处理任务最多处理的图片数
+IMAGE_BATCH_WRITE_SIZE = 100  # 每个事务写回的图片数
+IMAGE_BATCH_WORKERS = 4  # 线程池大小（Pillow 处理时释放 GIL）
+IMAGE_PROCESSING_TIMEOUT = 30 * 60  # 停留在 processing 超过该秒数的图片重新处理
@@ -4,6 +4,9 @@ import apiClient from './api'
  * 图片相关 API
  */
 
+// 超过该大小的文件使用分块续传
+const CHUNKED_UPLOAD_THRESHOLD = 5 * 1024 * 1024
+
 /**
  * 上传图片
  * @param {File} file - 图片文件
@@ -14,6 +17,10 @@ import apiClient from './api'
  * @returns {Promise}
  */
 export const uploadImage = async (file, options = {}) => {
+  if (file.size > CHUNKED_UPLOAD_THRESHOLD) {
+    return uploadImageChunked(file, options)
+  }
+  
   const formData = new FormData()
   formData.append('file', file)
   
@@ -40,6 +47,48 @@ export const uploadImage = async (file, options = {}) => {
   return apiClient.post('/api/images/', formData, config)
 }
 
+/**
+ * 分块续传上传图片
+ * 分块失败时查询服务端已接收的字节数并从该位置继续，最多重试 3 次
+ * @param {File} file - 图片文件
+ * @param {Object} options - 同 uploadImage
+ * @returns {Promise}
+ */
+export const uploadImageChunked = async (file, options = {}) => {
+  const { data: session } = await apiClient.post('/api/uploads/', {
+    filename: file.name,
+    size: file.size,
+    is_public: options.isPublic ?? false,
+    description: options.description || '',
+  })
+  const url = `/api/uploads/${session.id}/`
+  
+  let offset = session.received_size
+  let retries = 0
+  while (offset < file.size) {
+    const chunk = file.slice(offset, offset + session.chunk_size)
+    try {
+      const response = await apiClient.put(`${url}chunk/`, chunk, {
+        headers: {
+          'Content-Type': 'application/octet-stream',
+          'Upload-Offset': String(offset),
+        },
+      })
+      offset = response.data.received_size
+      retries = 0
+      if (options.onProgress) {
+        options.onProgress(Math.round((offset * 100) / file.size))
+      }
+    } catch (error) {
+      if (++retries > 3) throw error
+      const { data } = await apiClient.get(url)
+      offset = data.received_size
+    }
+  }
+  
+  return apiClient.post(`${url}complete/`)
+}
+
 /**
  * 获取图片列表
  * @param {Object} params - 查询参数
@@ -119,3 +168,38 @@ export const getPublicImages = async (params = {}) => {
 export const getImageStats = async () => {
   return apiClient.get('/api/images/stats/')
 }
+
+/**
+ * 创建批量 AI 分析
+ * @param {number[]} imageIds - 图片 ID 列表
+ * @returns {Promise}
+ */
+export const createAiBatch = async (imageIds) => {
+  return apiClient.post('/api/ai-batches/', { image_ids: imageIds })
+}
+
+/**
+ * 查询批量 AI 分析进度
+ * @param {number} id - 批次 ID
+ * @returns {Promise}
+ */
+export const getAiBatch = async (id) => {
+  return apiClient.get(`/api/ai-batches/${id}/`)
+}
+
+/**
+ * 选择合适宽度的多尺寸图片 URL
+ * 取不小于 minWidth 的最小一档 WebP，没有时返回最大一档，均无时返回原图
+ * @param {Object} image - 图片数据（含 renditions 和 file_url）
+ * @param {number} minWidth - 需要的最小显示宽度（像素）
+ * @returns {string}
+ */
+export const getRenditionUrl = (image, minWidth) => {
+  const sources = image?.renditions?.webp?.sources || []
+  if (sources.length === 0) {
+    return image?.file_url
+  }
+  const sorted = [...sources].sort((a, b) => a.width - b.width)
+  const match = sorted.find(source => source.width >= minWidth * (window.devicePixelRatio || 1))
+  return (match || sorted[sorted.length - 1]).url
+}